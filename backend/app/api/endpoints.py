@@ -1,12 +1,23 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
-from typing import List
-import os
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Query, Request, Header
+from fastapi.responses import JSONResponse, FileResponse, Response
+from typing import List, Optional
+import asyncio
+import hmac
+import math
+import uuid
 import logging
 from app.core.config import settings
 from app.services.ai_service import process_scan, get_scan_results
-from app.utils.file_utils import save_upload_file
-from app.models.schemas import ScanResponse, ProcessingStatus
+from app.services.admission_service import AdmissionRejected, RequestCancelled, Ticket, get_admission_controller
+from app.services.db_service import get_persistence_writer
+from app.services.history_service import get_history_store
+from app.services.report_service import get_report_service, REPORTLAB_AVAILABLE
+from app.services.model_registry import get_model_registry
+from app.services.similarity_service import get_similarity_index
+from app.services.slice_service import get_slice_service, SliceRequest, SLICE_FORMATS
+from app.services.storage_service import get_storage_manager
+from app.utils.file_utils import save_upload_file, UploadTooLargeError
+from app.models.schemas import ScanResponse, ProcessingStatus, ScanHistoryPage, ScanResult, SimilarScansResponse, ModelReloadRequest
 from datetime import datetime
 
 # Configure logging
@@ -15,15 +26,38 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+def _shed(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=503, detail=e.reason, headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+def _ticket(request: Request, default_priority: str = "interactive") -> Ticket:
+    try:
+        return Ticket.from_request(request, default_priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Non-standard "client closed request"; the client is gone, so this is only seen in logs
+CLIENT_CLOSED_REQUEST = 499
+
 @router.post("/upload", response_model=ScanResponse)
 async def upload_scan(
+    request: Request,
     file: UploadFile = File(...),
     background_tasks: BackgroundTasks = None
 ):
     """
-    Upload a brain scan (DICOM or NIfTI) for processing
+    Upload a brain scan (DICOM or NIfTI) for processing.
+    Processing is batch priority unless X-Priority says otherwise; uploads
+    are refused with 503 while the inference queue cannot take more work.
     """
     try:
+        ticket = _ticket(request, default_priority="batch")
+        if background_tasks:
+            try:
+                get_admission_controller().check(ticket, "scan")
+            except AdmissionRejected as e:
+                logger.warning(f"Shedding upload: {e.reason}")
+                raise _shed(e)
+
         logger.info(f"Received upload request for file: {file.filename}")
         logger.info(f"File content type: {file.content_type}")
         logger.info(f"File size: {file.size if hasattr(file, 'size') else 'unknown'} bytes")
@@ -39,32 +73,58 @@ async def upload_scan(
         
         logger.info("File type validation passed")
         
+        # Generate a unique ID for the scan (UUID to match the scans table)
+        scan_id = str(uuid.uuid4())
+        
         # Save file
         try:
-            file_path = await save_upload_file(file)
+            saved = await save_upload_file(file, scan_id)
+            file_path = saved.path
             logger.info(f"File saved successfully at: {file_path}")
+        except UploadTooLargeError as e:
+            logger.error(f"Upload too large: {file.filename}")
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             logger.error(f"Error saving file: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
         
+        # Queue the scan row for the background writer
+        created_at = datetime.now()
+        get_persistence_writer().upsert("scans", {
+            "id": scan_id,
+            "file_name": file.filename,
+            "file_path": file_path,
+            "file_size": saved.size,
+            "file_type": file.content_type or "",
+            "public_url": "",
+            "status": "processing" if background_tasks else "uploaded",
+            "created_at": created_at,
+            "updated_at": created_at
+        })
+        
+        get_history_store().record_upload(
+            scan_id,
+            file_name=file.filename,
+            file_type=file.content_type or "",
+            status="processing" if background_tasks else "uploaded",
+            created_at=created_at
+        )
+        
         # Start processing in background
         if background_tasks:
             logger.info("Adding background processing task")
-            background_tasks.add_task(process_scan, file_path)
+            background_tasks.add_task(process_scan, file_path, scan_id, Ticket(ticket.priority))
             logger.info("Background task added successfully")
         
-        # Generate a unique ID for the scan
-        scan_id = os.urandom(8).hex()
-        
         response = ScanResponse(
             message="File uploaded successfully",
             file_path=file_path,
             status="processing",
             file_name=file.filename,
-            file_size=file.size if hasattr(file, 'size') else None,
+            file_size=saved.size,
             file_type=file.content_type,
             id=scan_id,
-            created_at=datetime.now()
+            created_at=created_at
         )
         
         logger.info(f"Upload successful. Response: {response}")
@@ -77,50 +137,279 @@ async def upload_scan(
         logger.error(f"Unexpected error during upload: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/scans", response_model=ScanHistoryPage)
+async def list_scans(
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_MAX_PAGE_SIZE),
+    predicted_class: Optional[str] = None,
+    min_confidence: Optional[float] = Query(None, ge=0.0, le=1.0),
+    max_confidence: Optional[float] = Query(None, ge=0.0, le=1.0),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+):
+    """
+    List past scans, newest first, using cursor-based pagination
+    """
+    try:
+        items, next_cursor = await asyncio.to_thread(
+            get_history_store().list_scans,
+            limit,
+            cursor=cursor,
+            predicted_class=predicted_class,
+            min_confidence=min_confidence,
+            max_confidence=max_confidence,
+            created_after=created_after,
+            created_before=created_before
+        )
+        return ScanHistoryPage(items=items, next_cursor=next_cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listing scans: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/scans/{scan_id}", response_model=ScanResult)
+async def get_scan(scan_id: str):
+    """
+    Get a stored scan with its full analysis results
+    """
+    try:
+        scan = await asyncio.to_thread(get_history_store().get_scan, scan_id)
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found")
+        return scan
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting scan: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/similar/{scan_id}", response_model=SimilarScansResponse)
+async def get_similar_scans(scan_id: str, k: int = Query(settings.SIMILAR_TOP_K, ge=1, le=50)):
+    """
+    Find the past scans whose image features are closest to this scan's
+    """
+    try:
+        index = get_similarity_index(get_model_registry().active_index_version or settings.MODEL_VERSION)
+        embedding = index.get(scan_id)
+        if embedding is None:
+            raise HTTPException(status_code=404, detail="No embedding found for scan")
+        matches = await asyncio.to_thread(index.search, embedding, k, scan_id)
+        summaries = await asyncio.to_thread(get_history_store().get_summaries, [match_id for match_id, _ in matches])
+        similar = []
+        for match_id, similarity in matches:
+            summary = summaries.get(match_id, {})
+            similar.append({
+                "scan_id": match_id,
+                "similarity": similarity,
+                "predicted_class": summary.get("predicted_class"),
+                "confidence": summary.get("confidence"),
+                "created_at": summary.get("created_at")
+            })
+        return SimilarScansResponse(scan_id=scan_id, similar=similar)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error finding similar scans: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _volume_upload(scan_id: str):
+    upload = get_storage_manager().lookup(scan_id, "upload")
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    return upload
+
+@router.get("/slices/{scan_id}/info")
+async def get_slice_info(scan_id: str):
+    """
+    Get the slice counts per plane and the default window/level of a volume
+    """
+    try:
+        upload = await asyncio.to_thread(_volume_upload, scan_id)
+        return await asyncio.to_thread(get_slice_service().info, upload.path, upload.content_hash)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error reading volume info: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/slices/{scan_id}")
+async def get_slice(
+    scan_id: str,
+    plane: str = Query("axial", pattern="^(axial|coronal|sagittal)$"),
+    index: int = Query(..., ge=0),
+    window: Optional[float] = Query(None, gt=0),
+    level: Optional[float] = None,
+    format: str = Query("png", pattern="^(png|webp)$"),
+    size: Optional[int] = Query(None, ge=16, le=2048)
+):
+    """
+    Render one axial, coronal or sagittal slice of an uploaded NIfTI/DICOM volume
+    """
+    try:
+        upload = await asyncio.to_thread(_volume_upload, scan_id)
+        request = SliceRequest(upload.path, plane, index, window, level, format, size, upload.content_hash)
+        slices = get_slice_service()
+        data = slices.get_cached(request)
+        if data is None:
+            data = await asyncio.to_thread(slices.render, request)
+        else:
+            slices.schedule_prefetch(request)
+        return Response(content=data, media_type=SLICE_FORMATS[format], headers={"Cache-Control": "private, max-age=3600"})
+    except HTTPException:
+        raise
+    except IndexError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error rendering slice: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/process/{scan_id}", response_model=ProcessingStatus)
-async def get_processing_status(scan_id: str):
+async def get_processing_status(scan_id: str, request: Request):
     """
     Get the processing status of a scan
     """
     try:
         logger.info(f"Checking processing status for scan_id: {scan_id}")
-        status = await get_scan_results(scan_id)
+        status = await get_scan_results(scan_id, ticket=_ticket(request))
+        if not status:
+            logger.warning(f"No scan found for scan_id: {scan_id}")
+            raise HTTPException(status_code=404, detail="Scan not found")
         logger.info(f"Processing status: {status}")
         return status
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        logger.warning(f"Shedding request for scan_id {scan_id}: {e.reason}")
+        raise _shed(e)
+    except RequestCancelled as e:
+        logger.info(f"Stopped work for scan_id {scan_id}: {str(e)}")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting processing status: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/results/{scan_id}")
-async def get_results(scan_id: str):
+async def get_results(scan_id: str, request: Request):
     """
     Get the analysis results for a processed scan
     """
     try:
         logger.info(f"Fetching results for scan_id: {scan_id}")
-        results = await get_scan_results(scan_id)
+        results = await get_scan_results(scan_id, ticket=_ticket(request))
         if not results:
             logger.warning(f"No results found for scan_id: {scan_id}")
             raise HTTPException(status_code=404, detail="Results not found")
         logger.info(f"Results retrieved successfully: {results}")
         return results
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        logger.warning(f"Shedding request for scan_id {scan_id}: {e.reason}")
+        raise _shed(e)
+    except RequestCancelled as e:
+        logger.info(f"Stopped work for scan_id {scan_id}: {str(e)}")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting results: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/model/{scan_id}")
-async def get_model(scan_id: str):
+async def get_model(scan_id: str, request: Request):
     """
     Get the 3D model data for visualization
     """
     try:
         logger.info(f"Fetching 3D model for scan_id: {scan_id}")
-        model_data = await get_scan_results(scan_id, include_model=True)
+        model_data = await get_scan_results(scan_id, include_model=True, ticket=_ticket(request))
         if not model_data:
             logger.warning(f"No model found for scan_id: {scan_id}")
             raise HTTPException(status_code=404, detail="Model not found")
         logger.info(f"Model data retrieved successfully: {model_data}")
         return model_data
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        logger.warning(f"Shedding request for scan_id {scan_id}: {e.reason}")
+        raise _shed(e)
+    except RequestCancelled as e:
+        logger.info(f"Stopped work for scan_id {scan_id}: {str(e)}")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f"Error getting model data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/reports/{scan_id}")
+async def get_report(scan_id: str, format: str = Query("json", pattern="^(json|pdf)$")):
+    """
+    Get the generated report for a scan, or 202 while it is still being built
+    """
+    try:
+        if format == "pdf" and not REPORTLAB_AVAILABLE:
+            raise HTTPException(status_code=501, detail="PDF reports require reportlab")
+        reports = get_report_service()
+        # Reports are keyed by the model version that produced the results; try the active one first.
+        # Storage lookups commit to the index and history reads hit SQLite, so both run in a thread
+        cached = await asyncio.to_thread(reports.get_cached, scan_id, format)
+        if cached is None:
+            scan = await asyncio.to_thread(get_history_store().get_scan, scan_id)
+            if not scan or scan["status"] == "failed":
+                raise HTTPException(status_code=404, detail="Report not found")
+            # While the scan is still processing, the report is pending too
+            model_version = scan["results"].get("model_version", settings.MODEL_VERSION)
+            cached = await asyncio.to_thread(reports.get_cached, scan_id, format, model_version)
+            if cached is None and scan["status"] == "completed" and not reports.is_pending(scan_id, model_version):
+                # Results exist but no report yet (e.g. evicted): build one
+                await reports.enqueue(scan_id, scan["results"], model_version)
+
+        if cached is not None:
+            if format == "pdf":
+                return FileResponse(cached.path, media_type="application/pdf", filename=f"{scan_id}.pdf")
+            return FileResponse(cached.path, media_type="application/json")
+
+        logger.info(f"Report for scan_id {scan_id} is still being generated")
+        return JSONResponse(
+            status_code=202,
+            content={"scan_id": scan_id, "status": "pending"},
+            headers={"Retry-After": "1"}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting report: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _require_admin(token: Optional[str]) -> None:
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not token or not hmac.compare_digest(token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@router.get("/admin/model")
+async def get_model_status(x_admin_token: Optional[str] = Header(None)):
+    """
+    Report the active model version, versions still draining and reload progress
+    """
+    _require_admin(x_admin_token)
+    return get_model_registry().status()
+
+@router.post("/admin/model/reload", status_code=202)
+async def reload_model(body: Optional[ModelReloadRequest] = None, x_admin_token: Optional[str] = Header(None)):
+    """
+    Load a new model version in the background and switch traffic to it once it is warm
+    """
+    _require_admin(x_admin_token)
+    registry = get_model_registry()
+    body = body or ModelReloadRequest()
+    try:
+        started = await registry.start_reload(body.path, body.version)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not started:
+        raise HTTPException(status_code=409, detail="A model reload is already in progress")
+    logger.info(f"Model reload started (path={body.path or 'default'}, version={body.version or 'auto'})")
+    return registry.status()
@@ -1,9 +1,8 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from ...utils.grad_cam import create_gradcam
 from ...models.model import load_model
+from ...ml_model.preprocessing import ImagePreprocessor
 import numpy as np
-from PIL import Image
-import io
 import logging
 import traceback
 
@@ -17,6 +16,7 @@ router = APIRouter()
 try:
     model = load_model()
     gradcam = create_gradcam(model)
+    preprocessor = ImagePreprocessor((224, 224))  # Adjust size based on your model
     logger.info("Model and GradCAM instance loaded successfully")
 except Exception as e:
     logger.error(f"Error initializing model or GradCAM: {str(e)}")
@@ -28,30 +28,12 @@ async def predict(file: UploadFile = File(...)):
     try:
         logger.info(f"Processing file: {file.filename}")
         
-        # Read and preprocess image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        logger.info(f"Image loaded: size={image.size}, mode={image.mode}")
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            logger.info("Image converted to RGB")
-            
-        # Resize to model input size
-        image = image.resize((224, 224))  # Adjust size based on your model
-        logger.info("Image resized to 224x224")
-        
-        # Convert to numpy array and preprocess
-        img_array = np.array(image)
-        logger.info(f"Image converted to numpy array: shape={img_array.shape}, dtype={img_array.dtype}")
-        
-        # Store original image for heatmap
-        original_img = img_array.copy()
+        # Decode (reduced-size for JPEG) and preprocess image
+        original_img = preprocessor.load(file.file)
+        logger.info(f"Image loaded: shape={original_img.shape}, dtype={original_img.dtype}")
         
         # Preprocess for model
-        img_array = img_array.astype('float32') / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        img_array = preprocessor.normalize(original_img)
         logger.info(f"Image preprocessed: shape={img_array.shape}, dtype={img_array.dtype}")
         
         # Get prediction
@@ -17,18 +17,87 @@ class Settings(BaseSettings):
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
     
+    # Persistence Configuration
+    PERSISTENCE_BACKEND: str = os.getenv("PERSISTENCE_BACKEND", "auto")  # auto, supabase or sqlite
+    SQLITE_DB_PATH: str = os.getenv("SQLITE_DB_PATH", "data/neuronav.db")
+    DB_POOL_SIZE: int = 4
+    DB_BATCH_SIZE: int = 100
+    DB_FLUSH_INTERVAL_SECONDS: float = 0.5
+    DB_MAX_RETRIES: int = 5
+    DB_QUEUE_MAX_SIZE: int = 10000
+    HISTORY_PAGE_SIZE: int = 20
+    HISTORY_MAX_PAGE_SIZE: int = 100
+    HISTORY_SCAN_LIMIT: int = 5000  # Index entries examined per page when filtering by confidence
+    
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8  # 8 days
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")  # X-Admin-Token for /admin endpoints, empty disables them
     
     # AI Model Configuration
+    MODEL_VERSION: str = os.getenv("MODEL_VERSION", "1.0.0")
     MODEL_PATH: str = os.getenv("MODEL_PATH", "models/3d_unet.pth")
     DEVICE: str = os.getenv("DEVICE", "cuda" if os.getenv("USE_GPU", "false").lower() == "true" else "cpu")
+    MODEL_REPLICAS: int = int(os.getenv("MODEL_REPLICAS", 1))  # >1 runs predictions on a pool of model processes
+    THREADS_PER_REPLICA: int = int(os.getenv("THREADS_PER_REPLICA", 0))  # 0 keeps TensorFlow's default
+    PIN_MODEL_REPLICAS: bool = os.getenv("PIN_MODEL_REPLICAS", "false").lower() == "true"  # Pin each replica to its own cores
+    FOLD_RESCALE_INTO_MODEL: bool = os.getenv("FOLD_RESCALE_INTO_MODEL", "false").lower() == "true"  # Feed uint8 pixels, /255 in-graph
+    CASCADE_ENABLED: bool = os.getenv("CASCADE_ENABLED", "false").lower() == "true"  # Run a fast model first, full model only when needed
+    CASCADE_FAST_MODEL_PATH: str = os.getenv("CASCADE_FAST_MODEL_PATH", "")  # Defaults to app/ml_model/fast_model.keras
+    CASCADE_CONFIDENCE_THRESHOLD: float = float(os.getenv("CASCADE_CONFIDENCE_THRESHOLD", 0.9))  # Below this, escalate to the full model
+    CASCADE_ESCALATE_TUMORS: bool = os.getenv("CASCADE_ESCALATE_TUMORS", "false").lower() == "true"  # Always confirm tumor predictions
+    # With MODEL_REPLICAS > 1 the fast model gets a pool of its own, so MODEL_REPLICAS + CASCADE_FAST_REPLICAS model
+    # processes run in total; when pinned, the two pools split the cores and never share one
+    CASCADE_FAST_REPLICAS: int = int(os.getenv("CASCADE_FAST_REPLICAS", 1))
+    CASCADE_FAST_THREADS_PER_REPLICA: int = int(os.getenv("CASCADE_FAST_THREADS_PER_REPLICA", 0))  # 0 = THREADS_PER_REPLICA
+    
+    # 3D segmentation Configuration
+    SEGMENTATION_STANDIN: bool = os.getenv("SEGMENTATION_STANDIN", "false").lower() == "true"  # Random-weight net when MODEL_PATH is missing
+    SEGMENTATION_PATCH_SIZE: int = int(os.getenv("SEGMENTATION_PATCH_SIZE", 96))  # Cubic sliding-window patch side, voxels
+    SEGMENTATION_OVERLAP: float = float(os.getenv("SEGMENTATION_OVERLAP", 0.5))  # Fraction of a patch shared with its neighbour
+    SEGMENTATION_BATCH_SIZE: int = int(os.getenv("SEGMENTATION_BATCH_SIZE", 2))  # Patches per forward pass
+    SEGMENTATION_THREADS: int = int(os.getenv("SEGMENTATION_THREADS", 0))  # torch intra-op threads, 0 keeps the default
+    SEGMENTATION_THRESHOLD: float = 0.5  # Foreground probability for a voxel to count as anomalous
+    SEGMENTATION_MIN_COMPONENT_VOXELS: int = 10  # Smaller connected components are dropped as noise
+    SEGMENTATION_SCRATCH_DIR: str = os.getenv("SEGMENTATION_SCRATCH_DIR", "")  # Probability memmaps, empty = system temp dir
+    
+    # Admission control Configuration
+    ADMISSION_SLOTS: int = int(os.getenv("ADMISSION_SLOTS", 0))  # Concurrent inference jobs, 0 = one per model replica
+    ADMISSION_RESERVED_INTERACTIVE: int = 1  # Slots batch work never takes (needs ADMISSION_SLOTS > 1)
+    ADMISSION_MAX_QUEUE: int = 256
+    INTERACTIVE_DEADLINE_MS: int = 15000  # Default X-Deadline-Ms per priority, 0 = no deadline
+    BATCH_DEADLINE_MS: int = 0
     
     # Storage Configuration
     UPLOAD_DIR: str = "uploads"
     MAX_UPLOAD_SIZE: int = 100 * 1024 * 1024  # 100MB
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # 1MB, bounds memory per upload
+    STORAGE_INDEX_PATH: str = os.getenv("STORAGE_INDEX_PATH", "uploads/index.db")
+    STORAGE_SHARD_DEPTH: int = 2  # Levels of hashed subdirectories
+    STORAGE_QUOTA_BYTES: int = int(os.getenv("STORAGE_QUOTA_BYTES", 10 * 1024 * 1024 * 1024))  # 10GB
+    UPLOAD_TTL_SECONDS: int = int(os.getenv("UPLOAD_TTL_SECONDS", 60 * 60 * 24 * 7))  # 7 days
+    HEATMAP_TTL_SECONDS: int = int(os.getenv("HEATMAP_TTL_SECONDS", 60 * 60 * 24 * 7))  # 7 days
+    MESH_TTL_SECONDS: int = int(os.getenv("MESH_TTL_SECONDS", 60 * 60 * 24 * 3))  # 3 days
+    REPORT_TTL_SECONDS: int = int(os.getenv("REPORT_TTL_SECONDS", 60 * 60 * 24 * 30))  # 30 days
+    STORAGE_SWEEP_INTERVAL_SECONDS: int = 300
+    VOLUME_CACHE_BYTES: int = int(os.getenv("VOLUME_CACHE_BYTES", 5 * 1024 * 1024 * 1024))  # 5GB of decompressed .nii.gz
+    VOLUME_CACHE_TTL_SECONDS: int = int(os.getenv("VOLUME_CACHE_TTL_SECONDS", 60 * 60 * 24))  # 1 day
     
+    # Similar-case search Configuration
+    EMBEDDING_INDEX_DIR: str = os.getenv("EMBEDDING_INDEX_DIR", "data/embeddings")
+    SIMILAR_EXACT_THRESHOLD: int = 50000  # Above this many embeddings, switch to IVF search
+    SIMILAR_NLIST: int = 1024
+    SIMILAR_NPROBE: int = 16
+    SIMILAR_TOP_K: int = 5
+    
+    # Slice preview Configuration
+    SLICE_CACHE_BYTES: int = 64 * 1024 * 1024  # Encoded slices kept in memory
+    SLICE_MAX_OPEN_VOLUMES: int = 8
+    SLICE_PREFETCH: int = 2  # Neighbouring slices rendered ahead on each side
+    
+    # Report Configuration
+    REPORT_WORKERS: int = 2
+
     # CORS Configuration
     BACKEND_CORS_ORIGINS: list = [
         "http://localhost:3000",
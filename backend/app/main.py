@@ -1,9 +1,16 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
+from app.core.middleware import MaxBodySizeMiddleware
 from app.api.endpoints import router as api_router
 from .routes import prediction
 from .services import ai_service
+from .services.storage_service import get_storage_manager
+from .services.db_service import get_persistence_writer
+from .services.history_service import get_history_store
+from .services.report_service import get_report_service
+from .services.slice_service import get_slice_service
+from .services.model_registry import get_model_registry
 import logging
 import uvicorn
 
@@ -23,6 +30,24 @@ async def startup_event():
     logger.info("Application startup: Loading models...")
     ai_service.load_model()
     logger.info("Application startup: Models loaded.")
+    get_storage_manager().start_sweeper()
+    await get_persistence_writer().start()
+    # Same writer unless persistence goes to Supabase
+    await get_history_store().writer.start()
+    await get_report_service().start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    logger.info("Application shutdown: Stopping background tasks...")
+    await get_storage_manager().stop_sweeper()
+    await get_persistence_writer().stop()
+    await get_history_store().writer.stop()
+    await get_report_service().stop()
+    get_slice_service().shutdown()
+    ai_service.shutdown_model_pool()
+
+# Abort oversized uploads before they are spooled; added before CORS so its 413s get CORS headers
+app.add_middleware(MaxBodySizeMiddleware, max_body_size=settings.MAX_UPLOAD_SIZE)
 
 # Configure CORS
 app.add_middleware(
@@ -47,7 +72,13 @@ async def root():
 @app.get("/health")
 async def health_check():
     logger.info("Health check endpoint accessed")
-    return {"status": "healthy"}
+    slot = get_model_registry().active
+    return {
+        "status": "healthy",
+        "model_version": slot.version if slot is not None else None,
+        # Share of image predictions answered by the cascade's fast model alone
+        "cascade": slot.cascade_stats.snapshot() if slot is not None and slot.cascade_stats is not None else None
+    }
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
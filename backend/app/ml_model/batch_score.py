@@ -0,0 +1,248 @@
+"""
+Offline batch scoring of an image archive with the classification model.
+
+Inputs are every image under a directory (recursively) or the paths listed in
+a manifest (.txt with one path per line, or .csv with a ``path`` column;
+relative paths are resolved against the manifest's directory). Worker threads
+decode and resize whole batches ahead of the model, which runs on large
+batches. Results are written incrementally to CSV or Parquet (a directory of
+part files) and a checkpoint next to the output records how far the run got,
+so re-running the same command after an interruption resumes where it
+stopped. Output left without a checkpoint is only replaced with
+--overwrite. Images that fail to decode get a row with an ``error`` and no
+probabilities.
+
+Usage (from the backend directory):
+    python -m app.ml_model.batch_score app/ml_model/best_model.keras archive/ scores.parquet --workers 8
+    python -m app.ml_model.batch_score app/ml_model/best_model.keras manifest.csv scores.csv --batch-size 512
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services.model_registry import model_digest
+from .model_handler import ModelHandler
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def read_inputs(source):
+    """Image paths from a directory walk or a manifest, in a stable order"""
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+        return paths
+    base = os.path.dirname(os.path.abspath(source))
+    if source.lower().endswith(".csv"):
+        entries = pd.read_csv(source, usecols=["path"])["path"].astype(str).tolist()
+    else:
+        with open(source) as f:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [p if os.path.isabs(p) else os.path.join(base, p) for p in entries]
+
+
+def inputs_fingerprint(paths):
+    hasher = hashlib.sha256()
+    for path in paths:
+        hasher.update(path.encode())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def decode_batch(preprocessor, paths):
+    """Decode one batch into a uint8 (N, H, W, 3) array; failed images are left black"""
+    width, height = preprocessor.size
+    pixels = np.zeros((len(paths), height, width, 3), dtype=np.uint8)
+    errors = [None] * len(paths)
+    for i, path in enumerate(paths):
+        try:
+            pixels[i] = preprocessor.load(path)
+        except Exception as e:
+            errors[i] = str(e)
+    return pixels, errors
+
+
+class ResultWriter:
+    """
+    Appends scored rows to CSV or Parquet part files and keeps the resume checkpoint.
+
+    A chunk is written before the checkpoint is advanced past it. On resume the CSV
+    is truncated back to the checkpointed size and Parquet parts are named by their
+    first row, so a chunk written just before a crash is replaced, never duplicated.
+    Without a checkpoint, existing output is only replaced when ``overwrite`` is set.
+    """
+
+    def __init__(self, output, run_key, overwrite=False):
+        self.output = output
+        self.overwrite = overwrite
+        self.parquet = output.lower().endswith(".parquet")
+        self.checkpoint_path = output.rstrip("/") + ".checkpoint.json"
+        self.run_key = run_key
+        self.done = 0
+        self.csv_bytes = 0
+        self._pending = []
+
+    def resume(self):
+        """Restore progress from a matching checkpoint; returns the number of rows already done"""
+        if not os.path.exists(self.checkpoint_path):
+            self._reset()
+            return 0
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("run_key") != self.run_key:
+            raise SystemExit(
+                f"{self.checkpoint_path} belongs to a different model or input list; "
+                f"remove it and {self.output} to start over"
+            )
+        self.done = checkpoint["done"]
+        self.csv_bytes = checkpoint.get("csv_bytes", 0)
+        if not self.parquet and os.path.exists(self.output):
+            with open(self.output, "r+b") as f:
+                f.truncate(self.csv_bytes)
+        return self.done
+
+    def _reset(self):
+        if self._existing_output() and not self.overwrite:
+            raise SystemExit(f"{self.output} already exists and has no checkpoint; pass --overwrite to replace it")
+        if self.parquet:
+            os.makedirs(self.output, exist_ok=True)
+            for name in os.listdir(self.output):
+                if name.startswith("part-") and name.endswith(".parquet"):
+                    os.remove(os.path.join(self.output, name))
+        elif os.path.exists(self.output):
+            os.remove(self.output)
+
+    def _existing_output(self):
+        if self.parquet:
+            return os.path.isdir(self.output) and any(
+                name.startswith("part-") and name.endswith(".parquet") for name in os.listdir(self.output)
+            )
+        return os.path.exists(self.output)
+
+    def add(self, rows):
+        self._pending.extend(rows)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        if not self._pending:
+            return
+        frame = pd.DataFrame(self._pending)
+        # Text columns that are all empty in one chunk must keep the same Parquet type as in the others
+        frame = frame.astype({column: "string" for column in frame.columns if frame[column].dtype == object})
+        if self.parquet:
+            frame.to_parquet(os.path.join(self.output, f"part-{self.done:012d}.parquet"), index=False)
+        else:
+            frame.to_csv(self.output, mode="a", header=self.csv_bytes == 0, index=False)
+            self.csv_bytes = os.path.getsize(self.output)
+        self.done += len(self._pending)
+        self._pending = []
+
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"run_key": self.run_key, "done": self.done, "csv_bytes": self.csv_bytes}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+def score(handler, paths, writer, model_version, batch_size=256, workers=4, prefetch=None, flush_rows=4096,
+          log_every=10):
+    """Score ``paths`` in order, writing rows through ``writer``; returns (images, seconds)"""
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    prefetch = prefetch or workers
+    probability_columns = [f"prob_{name}" for name in handler.class_names]
+    start = time.perf_counter()
+    wait_seconds = model_seconds = 0.0
+    scored = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as loader:
+        # Keep up to ``prefetch`` batches decoding while the model works on the current one
+        queue = deque()
+        next_batch = 0
+        while next_batch < len(batches) and len(queue) < prefetch:
+            queue.append(loader.submit(decode_batch, handler.preprocessor, batches[next_batch]))
+            next_batch += 1
+
+        for batch_index, batch_paths in enumerate(batches):
+            wait_start = time.perf_counter()
+            pixels, errors = queue.popleft().result()
+            wait_seconds += time.perf_counter() - wait_start
+            if next_batch < len(batches):
+                queue.append(loader.submit(decode_batch, handler.preprocessor, batches[next_batch]))
+                next_batch += 1
+
+            model_start = time.perf_counter()
+            inputs = pixels if handler.fold_rescale else handler.preprocessor.normalize(pixels)
+            _, probabilities = handler.inference_model.predict_on_batch(inputs)
+            probabilities = np.asarray(probabilities)
+            model_seconds += time.perf_counter() - model_start
+
+            rows = []
+            for path, error, row in zip(batch_paths, errors, probabilities):
+                record = {"path": path, "model_version": model_version}
+                if error is None:
+                    record["predicted_class"] = handler.class_names[int(np.argmax(row))]
+                    record["confidence"] = float(np.max(row))
+                    record.update(zip(probability_columns, row.astype(float)))
+                else:
+                    record["predicted_class"] = None
+                    record["confidence"] = np.nan
+                    record.update(dict.fromkeys(probability_columns, np.nan))
+                record["error"] = error
+                rows.append(record)
+            writer.add(rows)
+            scored += len(rows)
+            if writer.pending >= flush_rows:
+                writer.flush()
+
+            if (batch_index + 1) % log_every == 0 or batch_index + 1 == len(batches):
+                elapsed = time.perf_counter() - start
+                print(f"{writer.done + writer.pending} images scored, {scored / elapsed:.1f} images/s "
+                      f"(waiting on decode {wait_seconds:.1f}s, model {model_seconds:.1f}s)", flush=True)
+        writer.flush()
+    return scored, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model_path")
+    parser.add_argument("source", help="Directory of images, or a .txt/.csv manifest of image paths")
+    parser.add_argument("output", help="Results file: .csv, or .parquet (written as a directory of parts)")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Threads decoding images")
+    parser.add_argument("--prefetch", type=int, default=None, help="Batches decoded ahead (default: --workers)")
+    parser.add_argument("--flush-rows", type=int, default=4096, help="Rows per write and checkpoint")
+    parser.add_argument("--model-version", default=None, help="Recorded with each row (default: version+digest)")
+    parser.add_argument("--overwrite", action="store_true", help="Replace existing output that has no checkpoint")
+    parser.add_argument("--fold-rescale", action="store_true", default=settings.FOLD_RESCALE_INTO_MODEL,
+                        help="Feed uint8 pixels with the /255 folded into the model")
+    args = parser.parse_args()
+
+    paths = read_inputs(args.source)
+    if not paths:
+        raise SystemExit(f"No images found in {args.source}")
+    digest = model_digest(args.model_path)
+    model_version = args.model_version or f"{settings.MODEL_VERSION}+{digest[:12]}"
+    writer = ResultWriter(args.output, run_key=f"{digest}:{inputs_fingerprint(paths)}", overwrite=args.overwrite)
+    done = writer.resume()
+    if done >= len(paths):
+        print(f"All {len(paths)} images already scored in {args.output}")
+        raise SystemExit(0)
+    if done:
+        print(f"Resuming after {done}/{len(paths)} images")
+
+    handler = ModelHandler(args.model_path, fold_rescale=args.fold_rescale)
+    scored, elapsed = score(handler, paths[done:], writer, model_version, batch_size=args.batch_size,
+                            workers=args.workers, prefetch=args.prefetch, flush_rows=args.flush_rows)
+    print(f"\n✅ {scored} images in {elapsed:.1f}s ({scored / elapsed:.1f} images/s). Results: {args.output}")
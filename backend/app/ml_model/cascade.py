@@ -0,0 +1,51 @@
+import threading
+from typing import Any, Dict, Optional
+
+TUMOR_CLASSES = ("glioma", "meningioma", "pituitary")
+
+
+def escalation_reason(prediction: Dict[str, Any], threshold: float, escalate_tumors: bool) -> Optional[str]:
+    """
+    Decide whether a fast-model prediction must be confirmed by the full model.
+
+    Returns None when the fast prediction can be served as-is (early exit).
+    """
+    if prediction["confidence"] < threshold:
+        return "low_confidence"
+    if escalate_tumors and prediction["predicted_class"] in TUMOR_CLASSES:
+        return "tumor"
+    return None
+
+
+class CascadeStats:
+    """Thread-safe counters for how often the cascade exits after the fast model"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.early_exits = 0
+        self.escalations: Dict[str, int] = {}
+        self.fast_seconds = 0.0
+        self.full_seconds = 0.0
+
+    def record(self, reason: Optional[str], fast_seconds: float, full_seconds: float = 0.0) -> None:
+        with self._lock:
+            self.requests += 1
+            self.fast_seconds += fast_seconds
+            self.full_seconds += full_seconds
+            if reason is None:
+                self.early_exits += 1
+            else:
+                self.escalations[reason] = self.escalations.get(reason, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            escalated = self.requests - self.early_exits
+            return {
+                "requests": self.requests,
+                "early_exits": self.early_exits,
+                "early_exit_share": self.early_exits / self.requests if self.requests else 0.0,
+                "escalations": dict(self.escalations),
+                "mean_fast_ms": 1000 * self.fast_seconds / self.requests if self.requests else 0.0,
+                "mean_full_ms": 1000 * self.full_seconds / escalated if escalated else 0.0,
+            }
@@ -0,0 +1,130 @@
+"""
+Accuracy/latency trade-off of the fast/full model cascade on a labelled folder.
+
+The folder holds one subdirectory per class (glioma, meningioma, notumor,
+pituitary). Both models score every image once, in batches; the cascade is then
+replayed for each confidence threshold from the stored probabilities, so a
+threshold sweep costs no extra inference. Expected latency per image is the
+fast model's single-image latency plus, for escalated images, the full
+model's.
+
+Usage (from the backend directory):
+    python -m app.ml_model.evaluate_cascade app/ml_model/fast_model.keras \\
+        app/ml_model/best_model.keras data/val --thresholds 0.7 0.8 0.9 0.95
+"""
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .cascade import escalation_reason
+from .model_handler import ModelHandler
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def list_labelled_images(data_dir, class_names):
+    paths, labels = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(class_dir, name))
+                labels.append(label)
+    return paths, np.array(labels)
+
+
+def score_all(handler, paths, batch_size, workers):
+    """Class probabilities for every image, decoding the next batch while the current one runs"""
+    probabilities = []
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    decode = lambda batch: np.stack([handler.preprocessor.load(p) for p in batch])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = pool.submit(decode, batches[0]) if batches else None
+        for i in range(len(batches)):
+            pixels = pending.result()
+            if i + 1 < len(batches):
+                pending = pool.submit(decode, batches[i + 1])
+            inputs = pixels if handler.fold_rescale else handler.preprocessor.normalize(pixels)
+            _, predictions = handler.inference_model.predict(inputs, verbose=0)
+            probabilities.append(np.asarray(predictions))
+    return np.concatenate(probabilities)
+
+
+def single_image_ms(handler, paths, samples):
+    """Median single-image latency, the way the API serves a request"""
+    handler.predict(paths[0])
+    latencies = []
+    for path in paths[:samples]:
+        start = time.perf_counter()
+        handler.predict(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies))
+
+
+def replay(fast_probs, full_probs, labels, handler, threshold, escalate_tumors):
+    predictions = []
+    early_exits = 0
+    for fast_row, full_row in zip(fast_probs, full_probs):
+        reason = escalation_reason(handler.format_prediction(fast_row), threshold, escalate_tumors)
+        if reason is None:
+            early_exits += 1
+            predictions.append(int(np.argmax(fast_row)))
+        else:
+            predictions.append(int(np.argmax(full_row)))
+    accuracy = float(np.mean(np.array(predictions) == labels))
+    return accuracy, early_exits / len(labels)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fast_model_path")
+    parser.add_argument("full_model_path")
+    parser.add_argument("data_dir", help="Directory with one subdirectory of images per class")
+    parser.add_argument("--thresholds", type=float, nargs="+",
+                        default=[0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98])
+    parser.add_argument("--escalate-tumors", action="store_true",
+                        help="Also escalate confident tumor predictions (as results with GradCAM do)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4, help="Threads used to decode images")
+    parser.add_argument("--latency-samples", type=int, default=50, help="Images timed one at a time per model")
+    parser.add_argument("--output", default="cascade_tradeoff.csv")
+    args = parser.parse_args()
+
+    fast = ModelHandler(args.fast_model_path)
+    full = ModelHandler(args.full_model_path)
+    paths, labels = list_labelled_images(args.data_dir, full.class_names)
+    if not paths:
+        raise SystemExit(f"No labelled images under {args.data_dir}")
+    print(f"{len(paths)} images, fast input {fast.img_size}, full input {full.img_size}")
+
+    fast_probs = score_all(fast, paths, args.batch_size, args.workers)
+    full_probs = score_all(full, paths, args.batch_size, args.workers)
+    fast_ms = single_image_ms(fast, paths, args.latency_samples)
+    full_ms = single_image_ms(full, paths, args.latency_samples)
+    fast_accuracy = float(np.mean(fast_probs.argmax(axis=1) == labels))
+    full_accuracy = float(np.mean(full_probs.argmax(axis=1) == labels))
+
+    rows = [
+        ("fast only", fast_accuracy, 1.0, fast_ms),
+        ("full only", full_accuracy, 0.0, full_ms),
+    ]
+    for threshold in args.thresholds:
+        accuracy, early_exit_share = replay(fast_probs, full_probs, labels, full, threshold, args.escalate_tumors)
+        rows.append((f"{threshold:.2f}", accuracy, early_exit_share, fast_ms + (1 - early_exit_share) * full_ms))
+
+    with open(args.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["threshold", "accuracy", "early_exit_share", "expected_latency_ms"])
+        for name, accuracy, share, latency in rows:
+            writer.writerow([name, f"{accuracy:.4f}", f"{share:.4f}", f"{latency:.2f}"])
+
+    print(f"{'threshold':>10} {'accuracy':>9} {'early exit':>11} {'latency ms':>11}")
+    for name, accuracy, share, latency in rows:
+        print(f"{name:>10} {accuracy:>9.4f} {share:>11.1%} {latency:>11.1f}")
+    print(f"Written to {args.output}")
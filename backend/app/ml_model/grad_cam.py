@@ -4,13 +4,24 @@ import matplotlib.pyplot as plt
 import cv2
 import sys
 import os
+import csv
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# 🔥 Experiment with these layers (MobileNetV2 recommended layers)
+CANDIDATE_LAYERS = [
+    "block_16_project",  # most recommended
+    "block_15_project",
+    "block_14_project",
+    "Conv_1"  # fallback
+]
 
 def get_img_array(img_path, size=(224, 224)):
-    img = tf.keras.preprocessing.image.load_img(img_path, target_size=size)
-    array = tf.keras.preprocessing.image.img_to_array(img)
-    array = np.expand_dims(array, axis=0)
-    array = array / 255.0
-    return array
+    array, _ = load_image_pair(img_path, size)
+    return np.expand_dims(array, axis=0)
 
 def make_gradcam_heatmap(img_array, model, last_conv_layer_name, pred_index=None):
     grad_model = tf.keras.models.Model(
@@ -30,43 +41,203 @@ def make_gradcam_heatmap(img_array, model, last_conv_layer_name, pred_index=None
     heatmap = tf.maximum(heatmap, 0) / tf.math.reduce_max(heatmap)
     return heatmap.numpy()
 
-def save_and_display_gradcam(img_path, heatmap, layer_name, alpha=0.4):
-    img = cv2.imread(img_path)
-    img = cv2.resize(img, (224, 224))
+def make_multi_layer_grad_model(model, layer_names):
+    """Build one grad model that outputs every layer in layer_names plus the predictions"""
+    outputs = [model.get_layer(name).output for name in layer_names]
+    return tf.keras.models.Model([model.inputs], outputs + [model.output])
+
+def make_multi_layer_gradcam_heatmaps(img_array, grad_model, layer_names, pred_index=None):
+    """
+    Compute Grad-CAM heatmaps for all layers of a multi-output grad model
+    with a single forward and backward pass over a batch of images.
+
+    Returns a dict of layer name -> (batch, h, w) heatmaps and the predictions.
+    """
+    with tf.GradientTape() as tape:
+        *conv_outputs, predictions = grad_model(img_array, training=False)
+        if pred_index is None:
+            pred_index = tf.argmax(predictions, axis=1)
+        else:
+            pred_index = tf.fill([tf.shape(predictions)[0]], tf.cast(pred_index, tf.int64))
+        class_channel = tf.gather(predictions, pred_index, axis=1, batch_dims=1)
+
+    grads = tape.gradient(class_channel, conv_outputs)
+    heatmaps = {}
+    for layer_name, conv_output, grad in zip(layer_names, conv_outputs, grads):
+        pooled_grads = tf.reduce_mean(grad, axis=(1, 2))
+        heatmap = tf.einsum("bhwc,bc->bhw", conv_output, pooled_grads)
+        heatmap = tf.maximum(heatmap, 0)
+        heatmap = tf.math.divide_no_nan(heatmap, tf.reduce_max(heatmap, axis=(1, 2), keepdims=True))
+        heatmaps[layer_name] = heatmap.numpy()
+    return heatmaps, predictions.numpy()
+
+def save_and_display_gradcam(img_path, heatmap, layer_name, alpha=0.4, output_dir=".", img=None, verbose=True):
+    if img is None:
+        img = cv2.imread(img_path)
+        img = cv2.resize(img, (224, 224))
     heatmap = cv2.resize(heatmap, (img.shape[1], img.shape[0]))
     heatmap = np.uint8(255 * heatmap)
     heatmap_color = cv2.applyColorMap(heatmap, cv2.COLORMAP_PLASMA)
     superimposed_img = cv2.addWeighted(heatmap_color, alpha, img, 1 - alpha, 0)
 
-    heatmap_path = f"gradcam_heatmap_{layer_name}.png"
-    overlay_path = f"gradcam_overlay_{layer_name}.png"
+    if output_dir == ".":
+        heatmap_path = f"gradcam_heatmap_{layer_name}.png"
+        overlay_path = f"gradcam_overlay_{layer_name}.png"
+    else:
+        stem = os.path.splitext(os.path.basename(img_path))[0]
+        heatmap_path = os.path.join(output_dir, f"{stem}_gradcam_heatmap_{layer_name}.png")
+        overlay_path = os.path.join(output_dir, f"{stem}_gradcam_overlay_{layer_name}.png")
 
-    cv2.imwrite(heatmap_path, heatmap_color)
-    cv2.imwrite(overlay_path, superimposed_img)
-    print(f"✅ Saved Grad-CAM for layer '{layer_name}': {overlay_path}, {heatmap_path}")
+    # cv2.imwrite reports failure by its return value, not an exception
+    if not cv2.imwrite(heatmap_path, heatmap_color) or not cv2.imwrite(overlay_path, superimposed_img):
+        raise IOError(f"Could not write Grad-CAM images for {img_path} to {output_dir}")
+    if verbose:
+        print(f"✅ Saved Grad-CAM for layer '{layer_name}': {overlay_path}, {heatmap_path}")
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python grad_cam.py <model_path> <image_path>")
-        sys.exit(1)
+def load_image_pair(img_path, size=(224, 224)):
+    """
+    Decode once into the normalized RGB model input and the BGR image used for overlays.
 
-    model_path = sys.argv[1]
-    image_path = sys.argv[2]
+    Single-image and directory mode both load through here (keras/PIL decode
+    and resize), so the same file always gets the same heatmap.
+    """
+    img = tf.keras.preprocessing.image.load_img(img_path, target_size=size)
+    rgb = tf.keras.preprocessing.image.img_to_array(img, dtype="uint8")
+    array = rgb.astype(np.float32) / 255.0
+    return array, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
 
-    model = tf.keras.models.load_model(model_path)
-    img_array = get_img_array(image_path)
+def try_load_image_pair(img_path, size=(224, 224)):
+    """load_image_pair, or None (with a message) for a corrupt or unreadable file"""
+    try:
+        return load_image_pair(img_path, size)
+    except Exception as e:
+        print(f"❌ Skipping unreadable image {img_path}: {e}")
+        return None
 
-    # 🔥 Experiment with these layers (MobileNetV2 recommended layers)
-    candidate_layers = [
-        "block_16_project",  # most recommended
-        "block_15_project",
-        "block_14_project",
-        "Conv_1"  # fallback
-    ]
+def heatmap_stats(heatmap, threshold=0.5):
+    """Summary statistics used to compare layers: peak location and hot-area coverage"""
+    peak_y, peak_x = np.unravel_index(np.argmax(heatmap), heatmap.shape)
+    return {
+        "coverage": float(np.mean(heatmap >= threshold)),
+        "mean": float(np.mean(heatmap)),
+        "peak_x": float(peak_x / heatmap.shape[1]),
+        "peak_y": float(peak_y / heatmap.shape[0]),
+    }
 
-    for layer_name in candidate_layers:
+def resolve_layers(model, layer_names):
+    valid = []
+    for layer_name in layer_names:
         try:
-            heatmap = make_gradcam_heatmap(img_array, model, layer_name)
-            save_and_display_gradcam(image_path, heatmap, layer_name)
-        except Exception as e:
+            model.get_layer(layer_name)
+            valid.append(layer_name)
+        except ValueError as e:
             print(f"❌ Failed for layer '{layer_name}': {e}")
+    return valid
+
+def run_directory(model, image_dir, layer_names, output_dir, batch_size=32, workers=4, write_overlays=True):
+    """
+    Run multi-layer Grad-CAM over every image in image_dir.
+
+    Images for the next batch are decoded by a thread pool while the current
+    batch runs through the grad model, and overlays are written in the
+    background. A per-image, per-layer summary is written to summary.csv.
+    """
+    paths = sorted(
+        os.path.join(image_dir, f) for f in os.listdir(image_dir)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not paths:
+        print(f"No images found in {image_dir}")
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    grad_model = make_multi_layer_grad_model(model, layer_names)
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    summary_path = os.path.join(output_dir, "summary.csv")
+    layer_totals = {name: [] for name in layer_names}
+    skipped = 0
+    writes = []
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as loader, \
+            ThreadPoolExecutor(max_workers=workers) as writer, \
+            open(summary_path, "w", newline="") as summary_file:
+        summary = csv.writer(summary_file)
+        summary.writerow(["image", "predicted_index", "confidence", "layer", "coverage", "mean", "peak_x", "peak_y"])
+        pending = [loader.submit(try_load_image_pair, p) for p in batches[0]]
+        for batch_index, batch_paths in enumerate(batches):
+            results = [f.result() for f in pending]
+            # Prefetch the next batch while this one is on the model
+            if batch_index + 1 < len(batches):
+                pending = [loader.submit(try_load_image_pair, p) for p in batches[batch_index + 1]]
+            skipped += results.count(None)
+            batch_paths = [p for p, pair in zip(batch_paths, results) if pair is not None]
+            loaded = [pair for pair in results if pair is not None]
+            if not loaded:
+                continue
+            img_batch = np.stack([arr for arr, _ in loaded])
+            heatmaps, predictions = make_multi_layer_gradcam_heatmaps(img_batch, grad_model, layer_names)
+            for i, img_path in enumerate(batch_paths):
+                pred_index = int(np.argmax(predictions[i]))
+                confidence = float(predictions[i][pred_index])
+                for layer_name in layer_names:
+                    heatmap = heatmaps[layer_name][i]
+                    stats = heatmap_stats(heatmap)
+                    layer_totals[layer_name].append(stats["coverage"])
+                    summary.writerow([
+                        os.path.basename(img_path), pred_index, f"{confidence:.4f}", layer_name,
+                        f"{stats['coverage']:.4f}", f"{stats['mean']:.4f}",
+                        f"{stats['peak_x']:.3f}", f"{stats['peak_y']:.3f}"
+                    ])
+                    if write_overlays:
+                        writes.append(writer.submit(save_and_display_gradcam, img_path, heatmap, layer_name,
+                                                    output_dir=output_dir, img=loaded[i][1], verbose=False))
+            print(f"Processed {min((batch_index + 1) * batch_size, len(paths))}/{len(paths)} images")
+
+        failed_writes = 0
+        for future in writes:
+            try:
+                future.result()
+            except Exception as e:
+                failed_writes += 1
+                print(f"❌ {e}")
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ {len(paths) - skipped} images x {len(layer_names)} layers in {elapsed:.1f}s "
+          f"({len(paths) / elapsed:.1f} images/s). Summary: {summary_path}")
+    if skipped or failed_writes:
+        print(f"⚠️ {skipped} unreadable images skipped, {failed_writes} overlay writes failed")
+    print(f"{'layer':<20} {'mean coverage':>14}")
+    for layer_name, coverages in layer_totals.items():
+        print(f"{layer_name:<20} {np.mean(coverages):>14.4f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grad-CAM layer comparison for a single image or a directory of images")
+    parser.add_argument("model_path")
+    parser.add_argument("image_path", help="Image file, or a directory of images")
+    parser.add_argument("--layers", nargs="+", default=CANDIDATE_LAYERS, help="Layers to compare")
+    parser.add_argument("--output-dir", default=None, help="Where to write overlays (directory mode default: gradcam_output)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4, help="Threads used to decode and write images")
+    parser.add_argument("--no-overlays", action="store_true", help="Only write the summary table")
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model_path)
+    layer_names = resolve_layers(model, args.layers)
+    if not layer_names:
+        sys.exit(1)
+
+    if os.path.isdir(args.image_path):
+        run_directory(
+            model, args.image_path, layer_names,
+            output_dir=args.output_dir or "gradcam_output",
+            batch_size=args.batch_size, workers=args.workers,
+            write_overlays=not args.no_overlays
+        )
+    else:
+        output_dir = args.output_dir or "."
+        os.makedirs(output_dir, exist_ok=True)
+        img_array, img = load_image_pair(args.image_path)
+        grad_model = make_multi_layer_grad_model(model, layer_names)
+        heatmaps, _ = make_multi_layer_gradcam_heatmaps(img_array[np.newaxis], grad_model, layer_names)
+        for layer_name in layer_names:
+            save_and_display_gradcam(args.image_path, heatmaps[layer_name][0], layer_name, output_dir=output_dir, img=img)
@@ -1,45 +1,62 @@
 import tensorflow as tf
 import numpy as np
-from PIL import Image
 import os
+from .preprocessing import ImagePreprocessor, build_uint8_model
 
 class ModelHandler:
-    def __init__(self, model_path):
+    def __init__(self, model_path, fold_rescale=False):
         self.model = tf.keras.models.load_model(model_path)
         self.class_names = ['glioma', 'meningioma', 'notumor', 'pituitary']
-        self.img_size = (224, 224)  # Adjust based on your model's input size
+        # (width, height) from the model's input, so reduced-resolution variants work unchanged
+        height, width = self.model.input_shape[1:3]
+        self.img_size = (width, height) if width and height else (224, 224)
+        self.preprocessor = ImagePreprocessor(self.img_size)
+        # With fold_rescale the /255 runs inside the graph and uint8 pixels are fed directly.
+        # self.model stays the float model so GradCAM can still reach its layers.
+        self.fold_rescale = fold_rescale
+        # The classifier head's input (penultimate features) is returned next to the
+        # predictions so similar-case search gets embeddings from the same forward pass.
+        self.feature_model = tf.keras.Model(self.model.inputs, [self.model.layers[-1].input, self.model.output])
+        self.inference_model = build_uint8_model(self.feature_model) if fold_rescale else self.feature_model
 
     def preprocess_image(self, image_path):
         """Preprocess the image for model prediction"""
         try:
-            img = Image.open(image_path)
-            img = img.resize(self.img_size)
-            img = img.convert('RGB')
-            img_array = np.array(img)
-            img_array = img_array / 255.0  # Normalize
-            img_array = np.expand_dims(img_array, axis=0)
-            return img_array
+            return self.preprocessor.preprocess(image_path)
         except Exception as e:
             raise Exception(f"Error preprocessing image: {str(e)}")
 
-    def predict(self, image_path):
-        """Make prediction on the input image"""
+    def prepare_input(self, image_path):
+        """Decode an image into the batch the inference model expects (uint8 or float32)"""
+        try:
+            if self.fold_rescale:
+                return self.preprocessor.load(image_path)[np.newaxis]
+            return self.preprocessor.preprocess(image_path)
+        except Exception as e:
+            raise Exception(f"Error preprocessing image: {str(e)}")
+
+    def format_prediction(self, probabilities):
+        """Map one row of class probabilities to the prediction response"""
+        return {
+            "predicted_class": self.class_names[int(np.argmax(probabilities))],
+            "confidence": float(np.max(probabilities)),
+            "all_probabilities": {
+                class_name: float(prob) 
+                for class_name, prob in zip(self.class_names, probabilities)
+            }
+        }
+
+    def predict(self, image_path, return_embedding=False):
+        """Make prediction on the input image, optionally returning its feature embedding"""
         try:
             # Preprocess the image
-            processed_img = self.preprocess_image(image_path)
+            processed_img = self.prepare_input(image_path)
             
             # Make prediction
-            predictions = self.model.predict(processed_img)
-            predicted_class = self.class_names[np.argmax(predictions[0])]
-            confidence = float(np.max(predictions[0]))
-            
-            return {
-                "predicted_class": predicted_class,
-                "confidence": confidence,
-                "all_probabilities": {
-                    class_name: float(prob) 
-                    for class_name, prob in zip(self.class_names, predictions[0])
-                }
-            }
+            embeddings, predictions = self.inference_model.predict(processed_img, verbose=0)
+            result = self.format_prediction(predictions[0])
+            if return_embedding:
+                return result, embeddings[0].reshape(-1).astype(np.float32)
+            return result
         except Exception as e:
-            raise Exception(f"Error making prediction: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Error making prediction: {str(e)}")
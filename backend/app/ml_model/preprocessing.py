@@ -0,0 +1,78 @@
+import threading
+import numpy as np
+from PIL import Image
+
+class ImagePreprocessor:
+    """
+    Shared image preprocessing for ModelHandler, GradCAM and the predict endpoint.
+
+    JPEGs are decoded with PIL's draft mode, which lets libjpeg scale the DCT
+    by 1/2, 1/4 or 1/8 so a large scan is decoded close to the target size
+    instead of at full resolution. Normalized output is written into a
+    preallocated float32 buffer per thread, so no float64 intermediates are
+    created and Keras does not need to cast again.
+    """
+
+    def __init__(self, size=(224, 224), use_draft=True):
+        self.size = tuple(size)
+        self.use_draft = use_draft
+        self._local = threading.local()
+
+    def load(self, source):
+        """
+        Decode an image path or file object into a (H, W, 3) uint8 RGB array
+        at the target size.
+        """
+        img = Image.open(source)
+        if self.use_draft and img.format == 'JPEG':
+            img.draft('RGB', self.size)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != self.size:
+            img = img.resize(self.size)
+        return np.asarray(img)
+
+    def _buffer(self, shape):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape[1:] != shape[1:] or buffer.shape[0] < shape[0]:
+            buffer = np.empty(shape, dtype=np.float32)
+            self._local.buffer = buffer
+        return buffer[:shape[0]]
+
+    def normalize(self, img_array, out=None):
+        """
+        Scale a (H, W, 3) or (N, H, W, 3) uint8 array to [0, 1] float32 with a
+        leading batch axis.
+
+        Unless ``out`` is given, the result is a view of this thread's reusable
+        buffer and is overwritten by the next call on the same thread.
+        """
+        if img_array.ndim == 3:
+            img_array = img_array[np.newaxis]
+        if out is None:
+            out = self._buffer(img_array.shape)
+        np.divide(img_array, np.float32(255.0), out=out, dtype=np.float32, casting='unsafe')
+        return out
+
+    def preprocess(self, source, out=None):
+        """Decode and normalize one image into a (1, H, W, 3) float32 batch"""
+        return self.normalize(self.load(source), out=out)
+
+    def preprocess_batch(self, sources, out=None):
+        """Decode and normalize several images into one (N, H, W, 3) float32 batch"""
+        if out is None:
+            out = self._buffer((len(sources), self.size[1], self.size[0], 3))
+        for i, source in enumerate(sources):
+            self.normalize(self.load(source), out=out[i:i + 1])
+        return out
+
+def build_uint8_model(model):
+    """
+    Wrap a model that expects [0, 1] float input so that it takes uint8 pixels
+    directly, with the /255 rescale folded into the graph.
+    """
+    import tensorflow as tf
+
+    inputs = tf.keras.Input(shape=model.input_shape[1:], dtype=tf.uint8)
+    x = tf.keras.layers.Rescaling(1.0 / 255.0)(inputs)
+    return tf.keras.Model(inputs, model(x), name=f"{model.name}_uint8")
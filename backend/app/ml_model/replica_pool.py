@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Set in each replica process by _init_replica
+_handler = None
+
+def _init_replica(model_path, threads, cpus, fold_rescale):
+    """Runs once in every replica process, before TensorFlow creates its thread pools"""
+    global _handler
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    import numpy as np
+    import tensorflow as tf
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    from app.ml_model.model_handler import ModelHandler
+    _handler = ModelHandler(model_path, fold_rescale=fold_rescale)
+
+    # Warm up so the first real request does not pay for graph tracing
+    dtype = np.uint8 if fold_rescale else np.float32
+    _handler.inference_model.predict(np.zeros((1, *_handler.img_size[::-1], 3), dtype=dtype), verbose=0)
+
+def available_cpus() -> List[int]:
+    """Cores this process may run on"""
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+def _predict(image_path, return_embedding=False):
+    return _handler.predict(image_path, return_embedding=return_embedding)
+
+class ModelReplicaPool:
+    """
+    Pool of model replicas for CPU inference.
+
+    TensorFlow's intra/inter-op thread pools are per process, so each replica
+    is a single-worker process with its own bounded thread count and,
+    optionally, pinned to its own slice of cores (of ``cpus``, by default all
+    cores this process may use). Requests go to the replica with the fewest
+    in-flight predictions.
+    """
+
+    def __init__(self, model_path, replicas, threads_per_replica=0, pin=False, fold_rescale=False, cpus=None):
+        self.model_path = model_path
+        self.threads_per_replica = threads_per_replica
+        context = multiprocessing.get_context("spawn")
+        cpus = self._cpu_slices(replicas, threads_per_replica, cpus) if pin else [None] * replicas
+
+        self._executors: List[ProcessPoolExecutor] = []
+        for index in range(replicas):
+            self._executors.append(ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=_init_replica,
+                initargs=(model_path, threads_per_replica, cpus[index], fold_rescale),
+            ))
+            logger.info(f"Started model replica {index} (threads={threads_per_replica or 'default'}, cpus={cpus[index] or 'any'})")
+        self._inflight = [0] * replicas
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cpu_slices(replicas, threads_per_replica, cpus=None) -> List[Optional[set]]:
+        available = list(cpus) if cpus is not None else available_cpus()
+        per_replica = threads_per_replica or max(1, len(available) // replicas)
+        if per_replica * replicas > len(available):
+            logger.warning(f"{replicas} replicas x {per_replica} threads exceeds {len(available)} cores, not pinning")
+            return [None] * replicas
+        return [set(available[i * per_replica:(i + 1) * per_replica]) for i in range(replicas)]
+
+    @property
+    def size(self) -> int:
+        return len(self._executors)
+
+    def warmup(self) -> None:
+        """Block until every replica process has loaded its model"""
+        for executor in self._executors:
+            executor.submit(os.getpid).result()
+
+    def _acquire(self) -> int:
+        with self._lock:
+            # Least-loaded replica, round-robin among ties
+            n = len(self._inflight)
+            index = min(range(n), key=lambda i: (self._inflight[i], (i - self._next) % n))
+            self._inflight[index] += 1
+            self._next = (index + 1) % n
+            return index
+
+    def _release(self, index: int) -> None:
+        with self._lock:
+            self._inflight[index] -= 1
+
+    def submit(self, image_path, return_embedding=False) -> Future:
+        index = self._acquire()
+        try:
+            future = self._executors[index].submit(_predict, image_path, return_embedding)
+        except Exception:
+            self._release(index)
+            raise
+        future.add_done_callback(lambda _: self._release(index))
+        return future
+
+    def predict(self, image_path, return_embedding=False):
+        """Make a prediction on the least-loaded replica"""
+        return self.submit(image_path, return_embedding).result()
+
+    async def predict_async(self, image_path, return_embedding=False):
+        """Make a prediction without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(image_path, return_embedding))
+
+    def stats(self):
+        with self._lock:
+            return {"replicas": self.size, "threads_per_replica": self.threads_per_replica, "inflight": list(self._inflight)}
+
+    def shutdown(self) -> None:
+        for executor in self._executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+        self._executors = []
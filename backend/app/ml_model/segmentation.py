@@ -0,0 +1,308 @@
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from scipy import ndimage
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+
+class TinyUNet3D(nn.Module):
+    """
+    Two-level 3D U-Net with a handful of channels.
+
+    Randomly initialized it stands in for the trained network, so the
+    sliding-window engine can be exercised and benchmarked without weights.
+    Trained checkpoints of this architecture load through ``load_segmentation_model``.
+    """
+
+    def __init__(self, in_channels: int = 1, num_classes: int = 2, base_channels: int = 8):
+        super().__init__()
+        c = base_channels
+        self.enc1 = self._block(in_channels, c)
+        self.enc2 = self._block(c, 2 * c)
+        self.bottleneck = self._block(2 * c, 4 * c)
+        self.up2 = nn.ConvTranspose3d(4 * c, 2 * c, kernel_size=2, stride=2)
+        self.dec2 = self._block(4 * c, 2 * c)
+        self.up1 = nn.ConvTranspose3d(2 * c, c, kernel_size=2, stride=2)
+        self.dec1 = self._block(2 * c, c)
+        self.head = nn.Conv3d(c, num_classes, kernel_size=1)
+        self.pool = nn.MaxPool3d(2)
+        # Input sides must be divisible by this
+        self.divisor = 4
+
+    @staticmethod
+    def _block(in_channels: int, out_channels: int) -> nn.Sequential:
+        return nn.Sequential(
+            nn.Conv3d(in_channels, out_channels, kernel_size=3, padding=1, bias=False),
+            nn.InstanceNorm3d(out_channels, affine=True),
+            nn.LeakyReLU(0.01, inplace=True),
+        )
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        e1 = self.enc1(x)
+        e2 = self.enc2(self.pool(e1))
+        b = self.bottleneck(self.pool(e2))
+        d2 = self.dec2(torch.cat([self.up2(b), e2], dim=1))
+        d1 = self.dec1(torch.cat([self.up1(d2), e1], dim=1))
+        return self.head(d1)
+
+
+def load_segmentation_model(path: Optional[str], device: str = "cpu") -> nn.Module:
+    """
+    Load a full pickled module or a ``TinyUNet3D`` state dict from ``path``.
+    With no path, return a randomly initialized ``TinyUNet3D`` stand-in.
+    """
+    if not path:
+        torch.manual_seed(0)
+        return TinyUNet3D().eval()
+    checkpoint = torch.load(path, map_location=device, weights_only=False)
+    if isinstance(checkpoint, nn.Module):
+        return checkpoint.to(device).eval()
+    model = TinyUNet3D()
+    model.load_state_dict(checkpoint.get("state_dict", checkpoint))
+    return model.to(device).eval()
+
+
+def gaussian_profile(length: int, sigma_scale: float = 0.125) -> np.ndarray:
+    """
+    1D Gaussian importance weights for one patch axis, peaking at the centre.
+
+    The 3D importance map is the outer product of one profile per axis. That
+    keeps it separable, so the blending weights of the whole volume are three
+    1D arrays rather than a second full-size volume.
+    """
+    centre = (length - 1) / 2
+    sigma = max(length * sigma_scale, 1e-3)
+    profile = np.exp(-0.5 * ((np.arange(length) - centre) / sigma) ** 2)
+    profile /= profile.max()
+    # Never fully zero at the border, so voxels covered only by patch edges still get a value
+    return np.maximum(profile, 1e-3).astype(np.float32)
+
+
+def window_starts(size: int, patch: int, step: int) -> List[int]:
+    """Patch start offsets along one axis; the last patch is flush with the end"""
+    if size <= patch:
+        return [0]
+    starts = list(range(0, size - patch, step))
+    starts.append(size - patch)
+    return starts
+
+
+def volume_data(image) -> Tuple[np.ndarray, float, float, Tuple[float, float, float]]:
+    """
+    Raw voxel array (memory-mapped when the file allows it), intensity
+    slope/intercept and voxel spacing in mm of a loaded NIfTI or DICOM image.
+    """
+    if hasattr(image, "dataobj"):
+        proxy = image.dataobj
+        if hasattr(proxy, "get_unscaled"):
+            data = proxy.get_unscaled()
+            slope = float(proxy.slope) if np.isfinite(proxy.slope) else 1.0
+            inter = float(proxy.inter) if np.isfinite(proxy.inter) else 0.0
+        else:
+            data, slope, inter = np.asanyarray(proxy), 1.0, 0.0
+        spacing = tuple(float(z) for z in image.header.get_zooms()[:3])
+    else:
+        data = image.pixel_array
+        slope = float(getattr(image, "RescaleSlope", 1.0))
+        inter = float(getattr(image, "RescaleIntercept", 0.0))
+        row, column = (float(s) for s in getattr(image, "PixelSpacing", (1.0, 1.0)))
+        spacing = (float(getattr(image, "SliceThickness", 1.0) or 1.0), row, column)
+    if data.ndim == 4:
+        data = data[..., 0]
+    elif data.ndim == 2:
+        data = data[np.newaxis]
+    spacing = (spacing + (1.0, 1.0, 1.0))[:3]
+    return data, slope, inter, spacing
+
+
+class SlidingWindowSegmenter:
+    """
+    Patch-based 3D segmentation of volumes too large to run in one pass.
+
+    The volume is tiled with overlapping patches, which are run through the
+    network ``batch_size`` at a time. Each patch's foreground probability is
+    weighted by a Gaussian importance map and added into a float32
+    accumulator memory-mapped in a scratch directory, so neither the
+    full-volume logits nor the input have to fit in memory. Patches are
+    visited slab by slab along the first axis, which keeps the accumulator's
+    dirty pages local.
+
+    Anomalies are the connected components of the thresholded probability
+    map, reported with voxel centroids, volumes in mm^3 and mean probability.
+    """
+
+    def __init__(self, model: nn.Module, patch_size: Sequence[int] = (96, 96, 96), overlap: float = 0.5,
+                 batch_size: int = 2, num_threads: int = 0, threshold: float = 0.5,
+                 min_component_voxels: int = 10, scratch_dir: Optional[str] = None,
+                 sigma_scale: float = 0.125, device: str = "cpu"):
+        if not 0 <= overlap < 1:
+            raise ValueError("overlap must be in [0, 1)")
+        self.model = model.to(device).eval()
+        divisor = getattr(model, "divisor", 1)
+        self.patch_size = tuple(int(np.ceil(p / divisor) * divisor) for p in patch_size)
+        self.overlap = overlap
+        self.batch_size = max(1, batch_size)
+        self.num_threads = num_threads
+        self.threshold = threshold
+        self.min_component_voxels = min_component_voxels
+        self.scratch_dir = scratch_dir
+        self.sigma_scale = sigma_scale
+        self.device = device
+        self._profiles = [gaussian_profile(p, sigma_scale) for p in self.patch_size]
+        self._importance = torch.from_numpy(np.einsum(
+            "i,j,k->ijk", *self._profiles)).to(device)
+        # The model and the intra-op thread setting are shared, so one volume at a time
+        self._lock = threading.Lock()
+
+    def _normalization(self, data: np.ndarray, slope: float, inter: float) -> Tuple[float, float]:
+        """Per-voxel scale and offset for a z-score over non-zero voxels, from a strided sample"""
+        stride = max(1, int(round((data.size / 2_000_000) ** (1 / 3))))
+        sample = np.asarray(data[::stride, ::stride, ::stride], dtype=np.float32) * slope + inter
+        foreground = sample[sample != 0]
+        if foreground.size == 0:
+            foreground = sample.reshape(-1)
+        mean, std = float(foreground.mean()), float(foreground.std()) or 1.0
+        return slope / std, (inter - mean) / std
+
+    def _patches(self, shape: Tuple[int, int, int]) -> List[Tuple[int, int, int]]:
+        steps = [max(1, int(p * (1 - self.overlap))) for p in self.patch_size]
+        axes = [window_starts(s, p, step) for s, p, step in zip(shape, self.patch_size, steps)]
+        return [(z, y, x) for z in axes[0] for y in axes[1] for x in axes[2]]
+
+    def _weights(self, shape: Tuple[int, int, int], patches) -> List[np.ndarray]:
+        """Per-axis sums of the importance profiles over all patch positions"""
+        weights = []
+        for axis, (size, patch) in enumerate(zip(shape, self.patch_size)):
+            total = np.zeros(size, dtype=np.float32)
+            for start in sorted({p[axis] for p in patches}):
+                stop = min(start + patch, size)
+                total[start:stop] += self._profiles[axis][:stop - start]
+            weights.append(total)
+        return weights
+
+    def _accumulate(self, data, scale, offset, accumulator, patches) -> None:
+        shape = accumulator.shape
+        batch = torch.zeros((self.batch_size, 1, *self.patch_size), dtype=torch.float32)
+        batch_np = batch.numpy()
+        for first in range(0, len(patches), self.batch_size):
+            chunk = patches[first:first + self.batch_size]
+            regions = []
+            for i, (z, y, x) in enumerate(chunk):
+                region = tuple(slice(s, min(s + p, size)) for s, p, size in zip((z, y, x), self.patch_size, shape))
+                extent = tuple(r.stop - r.start for r in region)
+                # Edge patches of volumes smaller than the patch are padded with normalized background (raw 0)
+                target = batch_np[i, 0]
+                if extent != self.patch_size:
+                    target.fill(np.float32(offset))
+                view = target[:extent[0], :extent[1], :extent[2]]
+                np.multiply(data[region], np.float32(scale), out=view, casting="unsafe")
+                view += np.float32(offset)
+                regions.append((region, extent))
+
+            logits = self.model(batch[:len(chunk)].to(self.device))
+            if logits.shape[1] == 1:
+                foreground = torch.sigmoid(logits[:, 0])
+            else:
+                foreground = 1 - torch.softmax(logits, dim=1)[:, 0]
+            weighted = (foreground * self._importance).cpu().numpy()
+            for i, (region, extent) in enumerate(regions):
+                accumulator[region] += weighted[i, :extent[0], :extent[1], :extent[2]]
+
+    def _components(self, probability, mask, labels, spacing, slab: int) -> Tuple[List[Dict[str, Any]], int]:
+        count = ndimage.label(mask, structure=np.ones((3, 3, 3), dtype=bool), output=labels)
+        if count == 0:
+            return [], 0
+        # Per-component voxel counts, probability sums and coordinate sums, one slab at a time
+        voxels = np.zeros(count + 1, dtype=np.int64)
+        prob_sums = np.zeros(count + 1)
+        coord_sums = np.zeros((3, count + 1))
+        for start in range(0, labels.shape[0], slab):
+            block = np.asarray(labels[start:start + slab])
+            nonzero = block > 0
+            ids = block[nonzero]
+            voxels += np.bincount(ids, minlength=count + 1)
+            prob_sums += np.bincount(ids, weights=probability[start:start + slab][nonzero], minlength=count + 1)
+            for axis, coords in enumerate(np.nonzero(nonzero)):
+                if axis == 0:
+                    coords = coords + start
+                coord_sums[axis] += np.bincount(ids, weights=coords, minlength=count + 1)
+
+        voxel_volume = float(np.prod(spacing))
+        anomalies = []
+        for label in range(1, count + 1):
+            n = int(voxels[label])
+            if n < self.min_component_voxels:
+                continue
+            volume = n * voxel_volume
+            anomalies.append({
+                "type": "tumor",
+                "location": [int(round(c)) for c in coord_sums[:, label] / n],
+                "size": round(float((6 * volume / np.pi) ** (1 / 3)), 1),  # Equivalent sphere diameter, mm
+                "volume": round(volume, 1),  # mm^3
+                "voxels": n,
+                "confidence": round(float(prob_sums[label] / n), 4),
+            })
+        anomalies.sort(key=lambda a: a["volume"], reverse=True)
+        return anomalies, count
+
+    def segment(self, image) -> Dict[str, Any]:
+        """
+        Segment a loaded NIfTI/DICOM image and return its anomalies and metrics
+        """
+        data, slope, inter, spacing = volume_data(image)
+        shape = tuple(int(s) for s in data.shape)
+        scale, offset = self._normalization(data, slope, inter)
+        patches = self._patches(shape)
+        slab = self.patch_size[0]
+
+        with self._lock, tempfile.TemporaryDirectory(prefix="segmentation-", dir=self.scratch_dir) as scratch:
+            accumulator = np.memmap(os.path.join(scratch, "probability.f32"), dtype=np.float32, mode="w+", shape=shape)
+            # torch's intra-op thread count is process-wide, so put it back for other callers
+            previous_threads = torch.get_num_threads()
+            if self.num_threads:
+                torch.set_num_threads(self.num_threads)
+            try:
+                with torch.inference_mode():
+                    self._accumulate(data, scale, offset, accumulator, patches)
+            finally:
+                torch.set_num_threads(previous_threads)
+
+            # Normalize the blended sum into a probability map in place and threshold it
+            wz, wy, wx = self._weights(shape, patches)
+            plane_weights = np.outer(wy, wx)
+            mask = np.memmap(os.path.join(scratch, "mask.u8"), dtype=np.uint8, mode="w+", shape=shape)
+            max_probability = 0.0
+            for start in range(0, shape[0], slab):
+                block = accumulator[start:start + slab]
+                block /= wz[start:start + slab, None, None] * plane_weights
+                mask[start:start + slab] = block >= self.threshold
+                max_probability = max(max_probability, float(block.max()))
+
+            labels = np.memmap(os.path.join(scratch, "labels.i32"), dtype=np.int32, mode="w+", shape=shape)
+            anomalies, raw_components = self._components(accumulator, mask, labels, spacing, slab)
+            del accumulator, mask, labels
+
+        lesion_volume = sum(a["volume"] for a in anomalies)
+        confidence = (
+            sum(a["confidence"] * a["voxels"] for a in anomalies) / sum(a["voxels"] for a in anomalies)
+            if anomalies else 1 - max_probability
+        )
+        logger.info(f"Segmented volume {shape} in {len(patches)} patches: "
+                    f"{len(anomalies)} anomalies ({raw_components} raw components)")
+        return {
+            "anomalies": anomalies,
+            "metrics": {
+                "volume": round(lesion_volume, 1),
+                "lesion_fraction": float(lesion_volume / (np.prod(shape) * np.prod(spacing))),
+                "max_probability": round(max_probability, 4),
+                "patches": float(len(patches)),
+            },
+            "confidence_score": round(float(confidence), 4),
+        }
@@ -55,3 +55,33 @@ class ScanResult(BaseModel):
     results: dict
     created_at: datetime
     updated_at: datetime
+
+class ScanSummary(BaseModel):
+    scan_id: str
+    status: str
+    file_name: Optional[str] = None
+    file_type: Optional[str] = None
+    predicted_class: Optional[str] = None
+    confidence: Optional[float] = None
+    processing_time: Optional[float] = None
+    created_at: datetime
+    updated_at: datetime
+
+class ScanHistoryPage(BaseModel):
+    items: List[ScanSummary]
+    next_cursor: Optional[str] = None
+
+class SimilarScan(BaseModel):
+    scan_id: str
+    similarity: float
+    predicted_class: Optional[str] = None
+    confidence: Optional[float] = None
+    created_at: Optional[datetime] = None
+
+class SimilarScansResponse(BaseModel):
+    scan_id: str
+    similar: List[SimilarScan]
+
+class ModelReloadRequest(BaseModel):
+    path: Optional[str] = None  # Defaults to app/ml_model/best_model.keras
+    version: Optional[str] = None  # Defaults to MODEL_VERSION plus the file's content hash
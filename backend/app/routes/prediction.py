@@ -1,47 +1,56 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from ..ml_model.model_handler import ModelHandler
-import os
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+from ..services.admission_service import AdmissionRejected, RequestCancelled, Ticket, get_admission_controller
+from ..services.model_registry import get_model_registry
+from ..services.storage_service import get_storage_manager
+from ..utils.file_utils import save_upload_file, UploadTooLargeError
+import asyncio
+import math
 from typing import Dict, Any
 
 router = APIRouter()
-model_handler = None
-
-def init_model():
-    global model_handler
-    model_path = os.path.join(os.path.dirname(__file__), "../ml_model/best_model.keras")
-    if not os.path.exists(model_path):
-        raise Exception("Model file not found")
-    model_handler = ModelHandler(model_path)
 
 @router.post("/predict")
-async def predict_image(file: UploadFile = File(...)) -> Dict[str, Any]:
+async def predict_image(request: Request, file: UploadFile = File(...)) -> Dict[str, Any]:
     """
-    Endpoint to predict brain tumor type from uploaded MRI image
+    Endpoint to predict brain tumor type from uploaded MRI image.
+    Honours X-Priority / X-Deadline-Ms: requests that cannot finish in time get 503.
     """
     try:
-        if not model_handler:
-            init_model()
+        try:
+            ticket = Ticket.from_request(request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        admission = get_admission_controller()
+        admission.check(ticket, "predict")
 
         # File type check
         if not file.filename.lower().endswith((
             '.jpg', '.jpeg', '.png', '.dcm', '.nii', '.nii.gz')):
             raise HTTPException(status_code=400, detail="Invalid file type. Only .jpg, .jpeg, .png, .dcm, .nii, .nii.gz files are supported.")
 
-        # Save uploaded file temporarily
-        temp_path = f"uploads/{file.filename}"
-        os.makedirs("uploads", exist_ok=True)
-        
-        with open(temp_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Stream uploaded file into temporary storage
+        try:
+            saved = await save_upload_file(file)
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
 
-        # Get prediction
-        result = model_handler.predict(temp_path)
-        
-        # Clean up temporary file
-        os.remove(temp_path)
+        try:
+            async with admission.slot(ticket, "predict"), get_model_registry().lease() as slot:
+                await ticket.checkpoint("inference")
+                # Get prediction from the active model version
+                result = await slot.predict(saved.path)
+                result["model_version"] = slot.version
+        finally:
+            # Clean up temporary file; deleting commits to the storage index, so keep it off the event loop
+            await asyncio.to_thread(get_storage_manager().delete, saved.scan_id)
         
         return result
 
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=503, detail=e.reason, headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+    except RequestCancelled as e:
+        raise HTTPException(status_code=499, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "batch")
+
+# How often a queued request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.25
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed because it cannot finish before its deadline"""
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+
+class RequestCancelled(Exception):
+    """Raised at a stage boundary once the client has disconnected"""
+
+
+class Ticket:
+    """
+    Priority, deadline and (optionally) the HTTP request of one unit of work.
+
+    ``checkpoint`` is called between stages (queueing, inference, GradCAM) so
+    work stops as soon as the client is gone or the deadline has passed.
+    """
+
+    def __init__(self, priority: str = "interactive", deadline: Optional[float] = None, request: Any = None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.priority = priority
+        self.deadline = deadline
+        self.request = request
+
+    @classmethod
+    def from_request(cls, request: Any, default_priority: str = "interactive") -> "Ticket":
+        """
+        Build a ticket from the X-Priority and X-Deadline-Ms (time budget) headers
+        """
+        priority = request.headers.get("x-priority", default_priority).lower()
+        if priority not in PRIORITIES:
+            raise ValueError(f"X-Priority must be one of {', '.join(PRIORITIES)}")
+        budget_ms = request.headers.get("x-deadline-ms")
+        if budget_ms is None:
+            budget_ms = settings.INTERACTIVE_DEADLINE_MS if priority == "interactive" else settings.BATCH_DEADLINE_MS
+        try:
+            budget_ms = float(budget_ms)
+        except ValueError:
+            raise ValueError("X-Deadline-Ms must be a number of milliseconds")
+        deadline = time.monotonic() + budget_ms / 1000 if budget_ms > 0 else None
+        return cls(priority, deadline, request)
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    async def is_disconnected(self) -> bool:
+        return self.request is not None and await self.request.is_disconnected()
+
+    async def checkpoint(self, stage: str) -> None:
+        if await self.is_disconnected():
+            raise RequestCancelled(f"Client disconnected before {stage}")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise AdmissionRejected(f"Deadline exceeded before {stage}")
+
+    async def should_run(self, stage: str) -> bool:
+        """
+        Gate for an optional stage: False once the deadline has passed, so the
+        caller can return what it already has; a disconnected client still cancels
+        """
+        if await self.is_disconnected():
+            raise RequestCancelled(f"Client disconnected before {stage}")
+        remaining = self.remaining()
+        return remaining is None or remaining > 0
+
+
+class AdmissionController:
+    """
+    Bounded, priority-aware admission to the inference slots.
+
+    At most ``slots`` jobs run at once; interactive requests are always
+    dispatched before batch ones, and ``reserved_interactive`` slots are
+    never given to batch work so a saturating batch load cannot make
+    interactive requests queue behind it. The expected wait is predicted
+    from the queue ahead and a moving average of slot hold times; requests
+    that would miss their deadline, or arrive to a full queue, are rejected
+    immediately instead of queueing.
+    """
+
+    def __init__(self, slots: int, reserved_interactive: int = 1, max_queue: int = 256,
+                 initial_service_seconds: float = 1.0, smoothing: float = 0.2):
+        self.slots = max(1, slots)
+        self.reserved_interactive = min(reserved_interactive, self.slots - 1)
+        self.max_queue = max_queue
+        self.smoothing = smoothing
+        self._service: Dict[str, float] = {}
+        self._mean_service = initial_service_seconds
+        self._running = Counter()
+        self._queues: Dict[str, Deque[Tuple[asyncio.Future, Ticket]]] = {p: deque() for p in PRIORITIES}
+        self.shed = Counter()
+        self.cancelled = Counter()
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def _usable_slots(self, priority: str) -> int:
+        return self.slots if priority == "interactive" else self.slots - self.reserved_interactive
+
+    def _can_start(self, priority: str) -> bool:
+        if self.running >= self.slots:
+            return False
+        return priority == "interactive" or self._running["batch"] < self._usable_slots("batch")
+
+    def _queued_ahead(self, priority: str) -> int:
+        ahead = len(self._queues["interactive"])
+        if priority == "batch":
+            ahead += len(self._queues["batch"])
+        return ahead
+
+    def expected_service(self, kind: str) -> float:
+        return self._service.get(kind, self._mean_service)
+
+    def predicted_wait(self, priority: str) -> float:
+        ahead = self._queued_ahead(priority)
+        if ahead == 0 and self._can_start(priority):
+            return 0.0
+        return (ahead + 1) / self._usable_slots(priority) * self._mean_service
+
+    def check(self, ticket: Ticket, kind: str) -> None:
+        """
+        Raise AdmissionRejected if the work should be shed now rather than queued
+        """
+        predicted_wait = self.predicted_wait(ticket.priority)
+        if self._queued_ahead(ticket.priority) >= self.max_queue:
+            self.shed[ticket.priority] += 1
+            raise AdmissionRejected("Inference queue is full", retry_after=predicted_wait)
+        remaining = ticket.remaining()
+        if remaining is not None and predicted_wait + self.expected_service(kind) > remaining:
+            self.shed[ticket.priority] += 1
+            raise AdmissionRejected(
+                f"Predicted wait of {predicted_wait:.1f}s exceeds the request deadline",
+                retry_after=predicted_wait
+            )
+
+    @asynccontextmanager
+    async def slot(self, ticket: Ticket, kind: str):
+        """
+        Hold one inference slot for the duration of the block
+        """
+        self.check(ticket, kind)
+        if self._queued_ahead(ticket.priority) or not self._can_start(ticket.priority):
+            await self._wait(ticket)
+        else:
+            self._running[ticket.priority] += 1
+
+        start = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            self._record(kind, time.monotonic() - start)
+            self._running[ticket.priority] -= 1
+            self._dispatch()
+
+    async def _wait(self, ticket: Ticket) -> None:
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, ticket)
+        self._queues[ticket.priority].append(entry)
+        try:
+            while not future.done():
+                remaining = ticket.remaining()
+                timeout = DISCONNECT_POLL_SECONDS if remaining is None else min(DISCONNECT_POLL_SECONDS, max(remaining, 0))
+                await asyncio.wait({future}, timeout=timeout)
+                if future.done():
+                    break
+                await ticket.checkpoint("inference")
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was granted while we were giving up: hand it on
+                self._running[ticket.priority] -= 1
+                self._dispatch()
+            else:
+                future.cancel()
+                self._queues[ticket.priority].remove(entry)
+            if isinstance(e, RequestCancelled):
+                self.cancelled[ticket.priority] += 1
+            elif isinstance(e, AdmissionRejected):
+                self.shed[ticket.priority] += 1
+            raise
+
+    def _dispatch(self) -> None:
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._can_start(priority):
+                future, _ = queue.popleft()
+                if future.done():
+                    continue
+                self._running[priority] += 1
+                future.set_result(True)
+
+    def _record(self, kind: str, seconds: float) -> None:
+        alpha = self.smoothing
+        self._service[kind] = (1 - alpha) * self._service.get(kind, seconds) + alpha * seconds
+        self._mean_service = (1 - alpha) * self._mean_service + alpha * seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slots": self.slots,
+            "reserved_interactive": self.reserved_interactive,
+            "running": dict(self._running),
+            "queued": {p: len(q) for p, q in self._queues.items()},
+            "mean_service_seconds": round(self._mean_service, 4),
+            "shed": dict(self.shed),
+            "cancelled": dict(self.cancelled),
+        }
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Return the process-wide admission controller, creating it on first use
+    """
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(
+            slots=settings.ADMISSION_SLOTS or max(1, settings.MODEL_REPLICAS),
+            reserved_interactive=settings.ADMISSION_RESERVED_INTERACTIVE,
+            max_queue=settings.ADMISSION_MAX_QUEUE,
+        )
+    return _admission_controller
@@ -1,139 +1,339 @@
 import torch
 import numpy as np
 from app.core.config import settings
-from app.utils.file_utils import load_medical_image, validate_medical_image
-from ..ml_model.model_handler import ModelHandler  # Import ModelHandler
+from app.utils.file_utils import load_medical_image, get_file_extension
+from app.services.storage_service import get_storage_manager
+from app.services.db_service import get_persistence_writer
+from app.services.history_service import get_history_store
+from app.services.report_service import build_report_content, get_report_service
+from app.services.similarity_service import get_similarity_index
+from app.services.admission_service import Ticket, RequestCancelled, get_admission_controller
+from app.services.model_registry import DEFAULT_MODEL_PATH, get_model_registry
+from app.ml_model.segmentation import SlidingWindowSegmenter, load_segmentation_model
+import asyncio
 import logging
 from typing import Dict, Any, Optional
 import time
 from datetime import datetime
 import os
-from app.utils.grad_cam import create_gradcam
+from app.utils.grad_cam import png_to_data_url
+from app.services.storage_service import heatmap_key
 import tensorflow as tf
-from PIL import Image
 import io
 
 logger = logging.getLogger(__name__)
 
-# Initialize model (placeholder for now)
-model = None
-model_handler = None # Add this to store ModelHandler instance
-gradcam = None
+# What /results reports for scans that have no results to serve
+SCAN_STATUS_MESSAGES = {
+    "uploaded": "Scan has not been processed yet",
+    "processing": "Scan is being processed",
+    "failed": "Scan processing failed",
+}
+
+# Sliding-window 3D U-Net segmenter for NIfTI/DICOM volumes
+model: Optional[SlidingWindowSegmenter] = None
 
 def load_model():
     """
     Load the 3D U-Net model and the ML image model
     """
-    global model, model_handler, gradcam
+    global model
     if model is None:
         try:
-            # TODO: Implement actual medical model loading
             logger.info("Loading 3D U-Net model...")
-            # model = torch.load(settings.MODEL_PATH, map_location=settings.DEVICE)
-            logger.info("Medical model loaded successfully (placeholder)")
+            if os.path.exists(settings.MODEL_PATH):
+                network = load_segmentation_model(settings.MODEL_PATH, settings.DEVICE)
+            elif settings.SEGMENTATION_STANDIN:
+                logger.warning(f"No 3D U-Net weights at {settings.MODEL_PATH}, using a randomly initialized stand-in")
+                network = load_segmentation_model(None)
+            else:
+                network = None
+                logger.warning(f"3D U-Net weights not found at {settings.MODEL_PATH}. Volume segmentation will not be available.")
+            if network is not None:
+                model = SlidingWindowSegmenter(
+                    network,
+                    patch_size=(settings.SEGMENTATION_PATCH_SIZE,) * 3,
+                    overlap=settings.SEGMENTATION_OVERLAP,
+                    batch_size=settings.SEGMENTATION_BATCH_SIZE,
+                    num_threads=settings.SEGMENTATION_THREADS,
+                    threshold=settings.SEGMENTATION_THRESHOLD,
+                    min_component_voxels=settings.SEGMENTATION_MIN_COMPONENT_VOXELS,
+                    scratch_dir=settings.SEGMENTATION_SCRATCH_DIR or None,
+                    device=settings.DEVICE
+                )
+                logger.info("Medical model loaded successfully")
         except Exception as e:
             logger.error(f"Error loading medical model: {str(e)}")
             # Decide if this error should stop startup or just log
 
-    if model_handler is None:
+    registry = get_model_registry()
+    if registry.active is None:
         try:
-            model_path = os.path.join(os.path.dirname(__file__), "../ml_model/best_model.keras")
+            model_path = DEFAULT_MODEL_PATH
             if not os.path.exists(model_path):
                  logger.warning(f"ML model file not found at {model_path}. Image prediction will not be available.")
                  # Don't raise exception here, just log warning if ML model is optional
             else:
-                 model_handler = ModelHandler(model_path)
-                 logger.info("ML image model loaded successfully")
-                 gradcam = create_gradcam(model_handler.model)
-                 logger.info("GradCAM instance created successfully")
+                 # The version carries the file's digest, so a replaced model never reuses old cache keys
+                 registry.activate(registry.load(model_path))
+                 logger.info("ML image model and GradCAM loaded successfully")
         except Exception as e:
              logger.error(f"Error loading ML image model: {str(e)}")
              # Decide if this error should stop startup or just log
 
-async def process_scan(file_path: str) -> Dict[str, Any]:
+def shutdown_model_pool():
+    """
+    Stop the model replica processes of every loaded model version
+    """
+    get_model_registry().shutdown()
+
+async def predict_image(file_path: str, return_embedding: bool = False):
     """
-    Process a brain scan using the appropriate AI model based on file type
+    Run the active image classifier without blocking the event loop.
+    With return_embedding, returns (prediction, embedding) from the same forward pass.
+    """
+    async with get_model_registry().lease() as slot:
+        return await slot.predict(file_path, return_embedding)
+
+async def process_scan(file_path: str, scan_id: Optional[str] = None, ticket: Optional[Ticket] = None) -> Dict[str, Any]:
+    """
+    Process a brain scan using the appropriate AI model based on file type.
+    When a scan_id is given, the results are queued for persistence.
+    Runs under admission control, as batch work unless a ticket says otherwise.
     """
     try:
-        start_time = time.time()
-
-        file_extension = os.path.splitext(file_path)[1].lower()
-
-        if file_extension in ('.dcm', '.nii', '.nii.gz'):
-            # Existing logic for medical images
-            logger.info(f"Processing medical image: {file_path}")
-            if not validate_medical_image(file_path):
-                raise ValueError("Invalid medical image file")
-
-            # Load medical image
-            image = load_medical_image(file_path)
-
-            # TODO: Implement actual medical image processing (3D U-Net etc.)
-            # For now, return mock results for medical images
-            results = {
-                "anomalies": [
-                    {
-                        "type": "tumor",
-                        "location": [100, 150, 200],
-                        "size": 25.5,
-                        "confidence": 0.95
-                    }
-                ],
-                "metrics": {
-                    "volume": 1500.0,
-                    "density": 1.2
-                },
-                "confidence_score": 0.95,
-                "processing_time": time.time() - start_time,
-                "file_type_processed": "medical"
-            }
+        async with get_admission_controller().slot(ticket or Ticket("batch"), "scan"):
+            results = await _run_scan(file_path, scan_id)
 
-        elif file_extension in ('.jpg', '.jpeg', '.png'):
-            # Logic for standard image files using ML model
-            logger.info(f"Processing standard image: {file_path}")
-            if model_handler is None:
-                 raise Exception("ML image model not loaded.")
+        logger.info(f"Scan processed successfully: {file_path}")
+        if scan_id:
+            persist_results(scan_id, results)
+            # Build the report in the background now that inference is done
+            await get_report_service().enqueue(scan_id, results, results.get("model_version"))
+        return results
 
-            # Use the ML model handler to predict
-            prediction_results = model_handler.predict(file_path)
+    except Exception as e:
+        logger.error(f"Error processing scan: {str(e)}")
+        if scan_id:
+            get_persistence_writer().update("scans", {
+                "id": scan_id,
+                "status": "failed",
+                "updated_at": datetime.now()
+            })
+            get_history_store().record_status(scan_id, "failed")
+        raise
 
-            # Get filename from file_path for logging
-            file_name = os.path.basename(file_path) # Get just the filename
+async def _run_scan(file_path: str, scan_id: Optional[str]) -> Dict[str, Any]:
+    """
+    Run the model that matches the file type and format its results
+    """
+    start_time = time.time()
 
-            # Log the prediction results
-            logger.info(f"Prediction results for {file_name}: {prediction_results}")
+    file_extension = get_file_extension(file_path)
 
-            # Format results for standard images
-            results = {
-                "prediction": prediction_results, # Contains predicted_class, confidence, all_probabilities
-                "processing_time": time.time() - start_time,
-                "file_type_processed": "standard_image"
-            }
+    if file_extension in ('.dcm', '.nii', '.nii.gz'):
+        # Existing logic for medical images
+        logger.info(f"Processing medical image: {file_path}")
+        if model is None:
+            raise Exception("3D segmentation model not loaded.")
+
+        # Validate and load in one pass, off the event loop: .nii.gz may be decompressed
+        # into the volume cache here, keyed by the sha256 recorded at upload time
+        upload = await asyncio.to_thread(get_storage_manager().lookup, scan_id, "upload") if scan_id else None
+        try:
+            image = await asyncio.to_thread(load_medical_image, file_path, upload.content_hash if upload else None)
+        except Exception:
+            raise ValueError("Invalid medical image file")
+
+        # Sliding-window 3D U-Net; CPU-bound, so keep it off the event loop
+        results = await asyncio.to_thread(model.segment, image)
+        results.update({
+            "processing_time": time.time() - start_time,
+            "file_type_processed": "medical"
+        })
+
+    elif file_extension in ('.jpg', '.jpeg', '.png'):
+        # Logic for standard image files using ML model
+        logger.info(f"Processing standard image: {file_path}")
+        # Use the active model version for the whole scan
+        async with get_model_registry().lease() as slot:
+            # Tumor predictions get a GradCAM heatmap, so the cascade escalates them to the full model
+            prediction_results, embedding = await slot.predict(file_path, return_embedding=True, need_gradcam=True)
+            if scan_id:
+                # Index the penultimate-layer features for similar-case search
+                await asyncio.to_thread(get_similarity_index(slot.index_version).add, scan_id, embedding)
+                if prediction_results["predicted_class"] != "notumor":
+                    # Store the heatmap now so the report queued after this scan can embed it
+                    try:
+                        await _heatmap_png(slot, scan_id, file_path, prediction_results)
+                    except Exception as e:
+                        logger.error(f"Error generating heatmap for scan {scan_id}: {str(e)}")
+
+        # Get filename from file_path for logging
+        file_name = os.path.basename(file_path) # Get just the filename
+
+        # Log the prediction results
+        logger.info(f"Prediction results for {file_name}: {prediction_results}")
+
+        # Format results for standard images
+        results = {
+            "prediction": prediction_results, # Contains predicted_class, confidence, all_probabilities
+            "processing_time": time.time() - start_time,
+            "file_type_processed": "standard_image",
+            "model_version": slot.version
+        }
+
+    else:
+        raise ValueError(f"Unsupported file type for processing: {file_extension}")
+
+    return results
+
+async def _heatmap_png(slot, scan_id: str, file_path: str, prediction: Dict[str, Any],
+                       ticket: Optional[Ticket] = None) -> Optional[bytes]:
+    """
+    Return the stored GradCAM heatmap of a scan for this model version,
+    generating and storing it first if needed. With a ticket whose deadline
+    has passed, GradCAM is skipped and None is returned.
+    """
+    storage = get_storage_manager()
+    # The index lookup commits to SQLite and the PNG is read from disk, so both run off the event loop
+    stored_heatmap = await asyncio.to_thread(_read_artifact, heatmap_key(scan_id, slot.version))
+    if stored_heatmap is not None:
+        return stored_heatmap
+    # GradCAM is the expensive, optional stage: shed it once the deadline has passed
+    # (the prediction is still returned) and stop if nobody is waiting for the answer
+    if ticket is not None and not await ticket.should_run("GradCAM"):
+        logger.info(f"Deadline passed, skipping GradCAM for scan {scan_id}")
+        return None
+    img_array = await asyncio.to_thread(slot.handler.preprocessor.load, file_path)
+    predicted_class = np.argmax(list(prediction['all_probabilities'].values()))
+    heatmap_png = await asyncio.to_thread(slot.gradcam.generate_heatmap_png, img_array, predicted_class)
+    await asyncio.to_thread(
+        storage.put_bytes, heatmap_key(scan_id, slot.version), "heatmap", heatmap_png, ".png", scan_id=scan_id
+    )
+    logger.info(f"GradCAM heatmap stored for scan {scan_id}")
+    return heatmap_png
+
+def _read_artifact(key: str) -> Optional[bytes]:
+    """
+    Contents of a stored artifact, or None if there is none; blocking
+    """
+    record = get_storage_manager().get(key)
+    if record is None:
+        return None
+    with open(record.path, "rb") as f:
+        return f.read()
+
+def persist_results(scan_id: str, results: Dict[str, Any]) -> None:
+    """
+    Queue the analysis results and the scan status update for the background writer
+    """
+    writer = get_persistence_writer()
+    prediction = results.get("prediction", {})
+    now = datetime.now()
+    writer.upsert("analysis_results", {
+        "scan_id": scan_id,
+        "predicted_class": prediction.get("predicted_class"),
+        "confidence_score": prediction.get("confidence", results.get("confidence_score")),
+        "processing_time": results.get("processing_time"),
+        "results": results,
+        "created_at": now
+    }, conflict_key="scan_id")
+    writer.update("scans", {
+        "id": scan_id,
+        "status": "completed",
+        "updated_at": now
+    })
+    get_history_store().record_result(scan_id, results)
 
+async def get_scan_results(scan_id: str, include_model: bool = False, ticket: Optional[Ticket] = None) -> Optional[Dict[str, Any]]:
+    """
+    Get the results of a scan.
+    Completed scans are served from their stored results. A standard image
+    that was uploaded without processing is classified on demand; other
+    scans (still processing, failed, or a volume) only report their status.
+    With a ticket, work is shed or stopped between stages once the deadline
+    passes or the client disconnects.
+    """
+    try:
+        storage = get_storage_manager()
+        scan = await asyncio.to_thread(get_history_store().get_scan, scan_id)
+        upload = await asyncio.to_thread(storage.lookup, scan_id, "upload")
+        if scan is None and upload is None:
+            logger.warning(f"No scan found for scan_id: {scan_id}")
+            return None
+        ticket = ticket or Ticket("interactive")
+
+        if scan is not None and scan["status"] == "completed" and scan["results"]:
+            results = await _stored_results(scan, upload, ticket)
+        elif (upload is not None and get_file_extension(upload.path) in ('.jpg', '.jpeg', '.png')
+              and (scan is None or scan["status"] == "uploaded")):
+            results = await _classify_upload(scan_id, upload.path, ticket)
         else:
-            raise ValueError(f"Unsupported file type for processing: {file_extension}")
+            # Volumes are never fed to the 2D classifier; their results come from process_scan
+            status = scan["status"] if scan is not None else "uploaded"
+            return {
+                "scan_id": scan_id,
+                "status": status,
+                "message": SCAN_STATUS_MESSAGES.get(status, "No results available"),
+                "progress": 0.0,
+                "created_at": (scan["created_at"] if scan is not None else datetime.now()).isoformat()
+            }
 
-        logger.info(f"Scan processed successfully: {file_path}")
+        if include_model:
+            mesh = await asyncio.to_thread(storage.lookup, scan_id, "mesh")
+            results["model"] = {
+                "url": f"https://storage.example.com/models/{scan_id}.gltf",
+                "format": "gltf",
+                "size": mesh.size if mesh else 1024000
+            }
         return results
-
     except Exception as e:
-        logger.error(f"Error processing scan: {str(e)}")
+        logger.error(f"Error getting scan results: {str(e)}")
         raise
 
-async def get_scan_results(scan_id: str, include_model: bool = False) -> Dict[str, Any]:
+async def _stored_results(scan: Dict[str, Any], upload, ticket: Ticket) -> Dict[str, Any]:
     """
-    Get the results of a processed scan
+    Results persisted by process_scan, with the heatmap stored for the model
+    version that produced them (regenerated only if that version is still active)
     """
-    try:
-        if model_handler is None or gradcam is None:
-            raise Exception("ML model or GradCAM not loaded")
-        uploads_dir = os.path.join(os.path.dirname(__file__), "../../uploads")
-        files = [f for f in os.listdir(uploads_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
-        if not files:
-            raise Exception("No processed files found")
-        latest_file = max(files, key=lambda x: os.path.getctime(os.path.join(uploads_dir, x)))
-        file_path = os.path.join(uploads_dir, latest_file)
-        prediction_results = model_handler.predict(file_path)
+    scan_id = scan["scan_id"]
+    stored = scan["results"]
+    prediction = stored.get("prediction")
+    if prediction is not None:
+        if prediction["predicted_class"] == "notumor":
+            prediction["message"] = "No suspicious regions detected."
+        elif stored.get("model_version"):
+            version = stored["model_version"]
+            heatmap_png = await asyncio.to_thread(_read_artifact, heatmap_key(scan_id, version))
+            if heatmap_png is None and upload is not None and get_model_registry().active_version == version:
+                try:
+                    async with get_admission_controller().slot(ticket, "results"), get_model_registry().lease() as slot:
+                        if slot.version == version:
+                            heatmap_png = await _heatmap_png(slot, scan_id, upload.path, prediction, ticket)
+                except RequestCancelled:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error regenerating heatmap for scan {scan_id}: {str(e)}")
+            if heatmap_png is not None:
+                prediction["heatmap_url"] = png_to_data_url(heatmap_png)
+    return {
+        "scan_id": scan_id,
+        "status": "completed",
+        "message": "Analysis complete",
+        "progress": 1.0,
+        "results": stored,
+        "created_at": scan["created_at"].isoformat()
+    }
+
+async def _classify_upload(scan_id: str, file_path: str, ticket: Ticket) -> Dict[str, Any]:
+    """
+    Classify a standard image that was uploaded without being processed
+    """
+    # Prediction and heatmap come from the same model version, even across a reload
+    async with get_admission_controller().slot(ticket, "results"), get_model_registry().lease() as slot:
+        # Tumor predictions need a GradCAM heatmap, so the cascade escalates them to the full model
+        prediction_results = await slot.predict(file_path, need_gradcam=True)
         
         # Check if prediction is "notumor"
         if prediction_results["predicted_class"] == "notumor":
@@ -142,65 +342,40 @@ async def get_scan_results(scan_id: str, include_model: bool = False) -> Dict[st
             prediction_results["message"] = "No suspicious regions detected."
             heatmap_url = None
         else:
-            # Generate heatmap only for tumor cases
+            # Generate heatmap only for tumor cases, reusing a stored one when available
             try:
-                logger.info("Generating GradCAM heatmap for results endpoint")
-                image = Image.open(file_path).convert('RGB').resize((224, 224))
-                img_array = np.array(image)
-                predicted_class = np.argmax(list(prediction_results['all_probabilities'].values()))
-                heatmap_url = gradcam.generate_heatmap_image(img_array, predicted_class)
-                logger.info("Heatmap generated successfully for results endpoint")
+                heatmap_png = await _heatmap_png(slot, scan_id, file_path, prediction_results, ticket)
+                heatmap_url = png_to_data_url(heatmap_png) if heatmap_png is not None else None
+            except RequestCancelled:
+                raise
             except Exception as e:
                 logger.error(f"Error generating heatmap in results endpoint: {str(e)}")
                 heatmap_url = None
-        
-        results = {
-            "scan_id": scan_id,
-            "status": "completed",
-            "progress": 1.0,
-            "results": {
-                "prediction": prediction_results,
-                "processing_time": 5.0,
-                "file_type_processed": "standard_image"
-            },
-            "created_at": datetime.now().isoformat()
-        }
-        
-        if heatmap_url:
-            results["results"]["prediction"]["heatmap_url"] = heatmap_url
-        
-        if include_model:
-            results["model"] = {
-                "url": f"https://storage.example.com/models/{scan_id}.gltf",
-                "format": "gltf",
-                "size": 1024000
-            }
-        return results
-    except Exception as e:
-        logger.error(f"Error getting scan results: {str(e)}")
-        raise
+    
+    results = {
+        "scan_id": scan_id,
+        "status": "completed",
+        "message": "Analysis complete",
+        "progress": 1.0,
+        "results": {
+            "prediction": prediction_results,
+            "processing_time": 5.0,
+            "file_type_processed": "standard_image",
+            "model_version": slot.version
+        },
+        "created_at": datetime.now().isoformat()
+    }
+    
+    if heatmap_url:
+        results["results"]["prediction"]["heatmap_url"] = heatmap_url
+    return results
 
 def generate_report(results: Dict[str, Any]) -> Dict[str, Any]:
     """
     Generate a natural language report from the analysis results
     """
     try:
-        # TODO: Implement actual report generation
-        # For now, return mock report
-        return {
-            "summary": "Brain scan analysis completed successfully",
-            "findings": [
-                {
-                    "type": "tumor",
-                    "description": "Small mass detected in the right frontal lobe",
-                    "severity": "moderate"
-                }
-            ],
-            "recommendations": [
-                "Follow-up scan recommended in 3 months",
-                "Consult with neurologist for detailed analysis"
-            ]
-        }
+        return build_report_content(results)
     except Exception as e:
         logger.error(f"Error generating report: {str(e)}")
         raise
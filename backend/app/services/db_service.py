@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Schema for the local stand-in. It only uses types and syntax shared by
+# SQLite and Postgres so it mirrors supabase/migrations/.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    file_size BIGINT NOT NULL,
+    file_type TEXT NOT NULL,
+    public_url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'uploaded',
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analysis_results (
+    scan_id TEXT PRIMARY KEY REFERENCES scans(id) ON DELETE CASCADE,
+    predicted_class TEXT,
+    confidence_score REAL,
+    processing_time REAL,
+    results TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+
+def _to_db_value(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class SQLiteBackend:
+    """
+    SQLite stand-in for the Supabase tables, used for local runs and benchmarks.
+
+    Connections are pooled and reused across batches; every batch is written
+    with a single ``executemany`` inside one transaction.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4, schema: str = SCHEMA):
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._pool.put(conn)
+        with self.connection() as conn:
+            conn.executescript(schema)
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def upsert(self, table: str, rows: List[Dict[str, Any]], conflict_key: str) -> None:
+        columns = list(rows[0].keys())
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != conflict_key)
+        sql = (
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT ({conflict_key}) DO "
+            + (f"UPDATE SET {updates}" if updates else "NOTHING")
+        )
+        params = [tuple(_to_db_value(row[c]) for c in columns) for row in rows]
+        with self.connection() as conn:
+            with conn:
+                conn.executemany(sql, params)
+
+    def update(self, table: str, rows: List[Dict[str, Any]], key: str) -> None:
+        columns = [c for c in rows[0].keys() if c != key]
+        sql = f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns)} WHERE {key} = ?"
+        params = [tuple(_to_db_value(row[c]) for c in columns) + (row[key],) for row in rows]
+        with self.connection() as conn:
+            with conn:
+                conn.executemany(sql, params)
+
+    def close(self) -> None:
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+
+class SupabaseBackend:
+    """
+    Writes batches to Supabase through one shared client (and HTTP connection pool).
+    """
+
+    def __init__(self, url: str, key: str):
+        from supabase import create_client
+
+        self.client = create_client(url, key)
+
+    def upsert(self, table: str, rows: List[Dict[str, Any]], conflict_key: str) -> None:
+        rows = [{k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()} for row in rows]
+        self.client.table(table).upsert(rows, on_conflict=conflict_key).execute()
+
+    def update(self, table: str, rows: List[Dict[str, Any]], key: str) -> None:
+        # PostgREST has no bulk update by key, so updates are sent per row
+        for row in rows:
+            values = {k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items() if k != key}
+            self.client.table(table).update(values).eq(key, row[key]).execute()
+
+    def close(self) -> None:
+        pass
+
+
+@dataclass
+class _Write:
+    op: str  # "upsert" or "update"
+    table: str
+    key: str
+    row: Dict[str, Any] = field(default_factory=dict)
+
+
+class PersistenceWriter:
+    """
+    Background writer that batches scan and result rows off the request path.
+
+    Handlers call :meth:`upsert` / :meth:`update`, which only enqueue the row.
+    A single task drains up to ``batch_size`` rows at a time and writes them
+    in a worker thread. Only rows that are adjacent in submission order and
+    share a shape are merged into one statement, so writes land in queue
+    order (a result never overtakes the scan it references). Failed groups
+    are retried with exponential backoff and then written row by row, so a
+    single bad row does not take its neighbours down with it.
+    """
+
+    def __init__(
+        self,
+        backend,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        max_retries: int = 5,
+        max_queue_size: int = 10000,
+    ):
+        self.backend = backend
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.rows_written = 0
+        self.rows_dropped = 0
+
+    def upsert(self, table: str, row: Dict[str, Any], conflict_key: str = "id") -> None:
+        self._submit(_Write("upsert", table, conflict_key, row))
+
+    def update(self, table: str, row: Dict[str, Any], key: str = "id") -> None:
+        self._submit(_Write("update", table, key, row))
+
+    def _submit(self, write: _Write) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        try:
+            self._queue.put_nowait(write)
+        except asyncio.QueueFull:
+            self.rows_dropped += 1
+            logger.error(f"Persistence queue full, dropping {write.op} on {write.table}")
+
+    async def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info(f"Persistence writer started (batch_size={self.batch_size})")
+
+    async def stop(self) -> None:
+        """
+        Flush everything still queued and stop the background task
+        """
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info(f"Persistence writer stopped ({self.rows_written} rows written)")
+
+    async def flush(self) -> None:
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _next_batch(self) -> List[_Write]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                for (op, table, key, _), rows in self._runs(batch):
+                    await self._write_with_retry(op, table, key, rows)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _runs(batch: List[_Write]) -> List[Tuple[Tuple[str, str, str, Tuple[str, ...]], List[Dict[str, Any]]]]:
+        """
+        Split a batch into runs of consecutive writes with the same statement shape
+        """
+        runs: List[Tuple[Tuple[str, str, str, Tuple[str, ...]], List[Dict[str, Any]]]] = []
+        for write in batch:
+            group_key = (write.op, write.table, write.key, tuple(write.row.keys()))
+            if runs and runs[-1][0] == group_key:
+                runs[-1][1].append(write.row)
+            else:
+                runs.append((group_key, [write.row]))
+        return runs
+
+    async def _write_with_retry(self, op: str, table: str, key: str, rows: List[Dict[str, Any]]) -> None:
+        write = self.backend.upsert if op == "upsert" else self.backend.update
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.to_thread(write, table, rows, key)
+                self.rows_written += len(rows)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    if len(rows) > 1:
+                        logger.error(f"Giving up on {op} of {len(rows)} rows into {table}: {str(e)}; writing them one by one")
+                        await self._write_rows_individually(write, op, table, key, rows)
+                    else:
+                        self.rows_dropped += 1
+                        logger.error(f"Giving up on {op} of 1 row into {table}: {str(e)}")
+                    return
+                delay = min(0.1 * 2 ** attempt, 10.0)
+                logger.warning(f"Error writing {len(rows)} rows into {table} (attempt {attempt + 1}): {str(e)}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+
+    async def _write_rows_individually(self, write, op: str, table: str, key: str, rows: List[Dict[str, Any]]) -> None:
+        """
+        Last resort for a group that keeps failing: isolate the rows that cannot be written
+        """
+        for row in rows:
+            try:
+                await asyncio.to_thread(write, table, [row], key)
+                self.rows_written += 1
+            except Exception as e:
+                self.rows_dropped += 1
+                logger.error(f"Dropping {op} into {table} ({key}={row.get(key)}): {str(e)}")
+
+
+def create_backend():
+    """
+    Create the configured persistence backend, falling back to the SQLite stand-in
+    """
+    backend = settings.PERSISTENCE_BACKEND
+    if backend == "auto":
+        backend = "supabase" if settings.SUPABASE_URL and settings.SUPABASE_KEY else "sqlite"
+    if backend == "supabase":
+        logger.info("Using Supabase persistence backend")
+        return SupabaseBackend(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+    logger.info(f"Using SQLite persistence backend at {settings.SQLITE_DB_PATH}")
+    return SQLiteBackend(settings.SQLITE_DB_PATH, pool_size=settings.DB_POOL_SIZE)
+
+
+_persistence_writer: Optional[PersistenceWriter] = None
+
+
+def get_persistence_writer() -> PersistenceWriter:
+    """
+    Return the process-wide persistence writer, creating it on first use
+    """
+    global _persistence_writer
+    if _persistence_writer is None:
+        _persistence_writer = PersistenceWriter(
+            create_backend(),
+            batch_size=settings.DB_BATCH_SIZE,
+            flush_interval=settings.DB_FLUSH_INTERVAL_SECONDS,
+            max_retries=settings.DB_MAX_RETRIES,
+            max_queue_size=settings.DB_QUEUE_MAX_SIZE,
+        )
+    return _persistence_writer
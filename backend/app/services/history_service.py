@@ -0,0 +1,234 @@
+import base64
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.db_service import PersistenceWriter, SQLiteBackend, get_persistence_writer
+
+logger = logging.getLogger(__name__)
+
+# created_at/updated_at are epoch seconds so they sort numerically. Every
+# list query is served by one of the (…, created_at, scan_id) indexes and
+# walks it from the cursor position, so page latency does not depend on
+# how many scans are stored. Confidence has no index: it is checked on a
+# bounded stretch of the walk (see ScanHistoryStore.list_scans).
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scan_history (
+    scan_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    file_name TEXT,
+    file_type TEXT,
+    predicted_class TEXT,
+    confidence REAL,
+    processing_time REAL,
+    results TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_created ON scan_history (created_at DESC, scan_id DESC);
+CREATE INDEX IF NOT EXISTS idx_history_class_created ON scan_history (predicted_class, created_at DESC, scan_id DESC);
+"""
+
+SUMMARY_COLUMNS = (
+    "scan_id", "status", "file_name", "file_type", "predicted_class",
+    "confidence", "processing_time", "created_at", "updated_at",
+)
+
+
+def encode_cursor(created_at: float, scan_id: str) -> str:
+    raw = json.dumps([created_at, scan_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, scan_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(created_at), str(scan_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class ScanHistoryStore:
+    """
+    Indexed local store of scan summaries backing the dashboard history.
+
+    The table lives in the local SQLite database. Writes go through a
+    :class:`PersistenceWriter` so request handlers only enqueue rows, and the
+    writer keeps them in submission order, so a scan's upload row is always
+    in place before its result or status updates; reads use keyset (cursor)
+    pagination over the indexes.
+    """
+
+    def __init__(self, backend: SQLiteBackend, writer: PersistenceWriter, scan_limit: int = 5000):
+        self.backend = backend
+        self.writer = writer
+        self.scan_limit = scan_limit
+        with self.backend.connection() as conn:
+            conn.executescript(HISTORY_SCHEMA)
+
+    def record_upload(self, scan_id: str, file_name: str, file_type: str, status: str, created_at: datetime) -> None:
+        timestamp = created_at.timestamp()
+        self.writer.upsert("scan_history", {
+            "scan_id": scan_id,
+            "status": status,
+            "file_name": file_name,
+            "file_type": file_type,
+            "created_at": timestamp,
+            "updated_at": timestamp,
+        }, conflict_key="scan_id")
+
+    def record_result(self, scan_id: str, results: Dict[str, Any]) -> None:
+        prediction = results.get("prediction", {})
+        self.writer.update("scan_history", {
+            "scan_id": scan_id,
+            "status": "completed",
+            "predicted_class": prediction.get("predicted_class"),
+            "confidence": prediction.get("confidence", results.get("confidence_score")),
+            "processing_time": results.get("processing_time"),
+            "results": results,
+            "updated_at": time.time(),
+        }, key="scan_id")
+
+    def record_status(self, scan_id: str, status: str) -> None:
+        self.writer.update("scan_history", {
+            "scan_id": scan_id,
+            "status": status,
+            "updated_at": time.time(),
+        }, key="scan_id")
+
+    def list_scans(
+        self,
+        limit: int,
+        cursor: Optional[str] = None,
+        predicted_class: Optional[str] = None,
+        min_confidence: Optional[float] = None,
+        max_confidence: Optional[float] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Return one page of scan summaries, newest first, and the cursor for the next page.
+
+        Confidence filters are applied to at most ``scan_limit`` index entries
+        per page, so a selective filter can return a short (even empty) page
+        whose cursor continues after the last entry examined.
+        """
+        where, params = [], []
+        if cursor:
+            created_at, scan_id = decode_cursor(cursor)
+            where.append("(created_at, scan_id) < (?, ?)")
+            params += [created_at, scan_id]
+        if predicted_class:
+            where.append("predicted_class = ?")
+            params.append(predicted_class)
+        if created_after:
+            where.append("created_at >= ?")
+            params.append(created_after.timestamp())
+        if created_before:
+            where.append("created_at < ?")
+            params.append(created_before.timestamp())
+        residual, residual_params = [], []
+        if min_confidence is not None:
+            residual.append("confidence >= ?")
+            residual_params.append(min_confidence)
+        if max_confidence is not None:
+            residual.append("confidence <= ?")
+            residual_params.append(max_confidence)
+
+        order = " ORDER BY created_at DESC, scan_id DESC"
+        with self.backend.connection() as conn:
+            boundary = None
+            if residual:
+                # Confidence is only checked up to the scan_limit-th index entry from the cursor
+                boundary = conn.execute(
+                    "SELECT created_at, scan_id FROM scan_history"
+                    + (" WHERE " + " AND ".join(where) if where else "") + order + " LIMIT 1 OFFSET ?",
+                    params + [self.scan_limit - 1],
+                ).fetchone()
+                if boundary is not None:
+                    where.append("(created_at, scan_id) >= (?, ?)")
+                    params += list(boundary)
+                where += residual
+                params += residual_params
+
+            sql = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM scan_history"
+            if where:
+                sql += " WHERE " + " AND ".join(where)
+            sql += order + " LIMIT ?"
+            params.append(limit + 1)
+            rows = conn.execute(sql, params).fetchall()
+
+        items = [self._to_summary(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last[7], last[0])
+        elif boundary is not None:
+            # Short page: continue after the last entry examined
+            next_cursor = encode_cursor(*boundary)
+        return items, next_cursor
+
+    def get_scan(self, scan_id: str) -> Optional[Dict[str, Any]]:
+        with self.backend.connection() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(SUMMARY_COLUMNS)}, results FROM scan_history WHERE scan_id = ?",
+                (scan_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        scan = self._to_summary(row[:len(SUMMARY_COLUMNS)])
+        scan["results"] = json.loads(row[-1]) if row[-1] else {}
+        return scan
+
+    def get_summaries(self, scan_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Look up the summaries of several scans in one query, keyed by scan id
+        """
+        if not scan_ids:
+            return {}
+        with self.backend.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM scan_history "
+                f"WHERE scan_id IN ({', '.join('?' * len(scan_ids))})",
+                list(scan_ids),
+            ).fetchall()
+        return {summary["scan_id"]: summary for summary in map(self._to_summary, rows)}
+
+    @staticmethod
+    def _to_summary(row) -> Dict[str, Any]:
+        summary = dict(zip(SUMMARY_COLUMNS, row))
+        summary["created_at"] = datetime.fromtimestamp(summary["created_at"])
+        summary["updated_at"] = datetime.fromtimestamp(summary["updated_at"])
+        return summary
+
+
+_history_store: Optional[ScanHistoryStore] = None
+
+
+def get_history_store() -> ScanHistoryStore:
+    """
+    Return the process-wide scan history store, creating it on first use.
+
+    With the SQLite persistence backend the history table shares its database
+    and writer. With Supabase the history index stays in the local SQLite
+    database, which then needs a writer of its own.
+    """
+    global _history_store
+    if _history_store is None:
+        writer = get_persistence_writer()
+        if isinstance(writer.backend, SQLiteBackend):
+            _history_store = ScanHistoryStore(writer.backend, writer, settings.HISTORY_SCAN_LIMIT)
+        else:
+            backend = SQLiteBackend(settings.SQLITE_DB_PATH, pool_size=settings.DB_POOL_SIZE, schema=HISTORY_SCHEMA)
+            _history_store = ScanHistoryStore(backend, PersistenceWriter(
+                backend,
+                batch_size=settings.DB_BATCH_SIZE,
+                flush_interval=settings.DB_FLUSH_INTERVAL_SECONDS,
+                max_retries=settings.DB_MAX_RETRIES,
+                max_queue_size=settings.DB_QUEUE_MAX_SIZE,
+            ), settings.HISTORY_SCAN_LIMIT)
+    return _history_store
@@ -0,0 +1,347 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.ml_model.cascade import CascadeStats, escalation_reason
+from app.ml_model.model_handler import ModelHandler
+from app.ml_model.replica_pool import ModelReplicaPool, available_cpus
+from app.services.report_service import get_report_service
+from app.utils.grad_cam import create_gradcam
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(__file__), "../ml_model/best_model.keras")
+DEFAULT_FAST_MODEL_PATH = os.path.join(os.path.dirname(__file__), "../ml_model/fast_model.keras")
+
+
+def model_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def split_cores(replicas: int, threads: int, fast_replicas: int, fast_threads: int):
+    """
+    Disjoint core lists for the full and the fast model pools, or None if
+    there are too few cores. Without explicit thread counts the cores are
+    shared out by replica count.
+    """
+    cpus = available_cpus()
+    if threads and fast_threads:
+        fast_share = fast_replicas * fast_threads
+    else:
+        fast_share = len(cpus) * fast_replicas // (replicas + fast_replicas)
+    fast_share = min(max(fast_share, fast_replicas), len(cpus) - replicas)
+    if fast_share < fast_replicas:
+        logger.warning(f"Too few cores ({len(cpus)}) to give the cascade fast model its own, not pinning")
+        return None
+    return cpus[:-fast_share], cpus[-fast_share:]
+
+
+class ModelSlot:
+    """
+    One loaded version of the image model: handler, GradCAM and (optionally)
+    its replica pool and cascade fast model, plus a count of the requests
+    currently using it.
+    """
+
+    def __init__(self, version: str, path: str, digest: str, handler: ModelHandler,
+                 gradcam, pool: Optional[ModelReplicaPool] = None,
+                 fast_handler: Optional[ModelHandler] = None, fast_digest: Optional[str] = None,
+                 fast_pool: Optional[ModelReplicaPool] = None):
+        self.version = version
+        self.path = path
+        self.digest = digest
+        self.handler = handler
+        self.gradcam = gradcam
+        self.pool = pool
+        self.fast_handler = fast_handler
+        self.fast_digest = fast_digest
+        self.fast_pool = fast_pool
+        self.cascade_stats = CascadeStats() if fast_handler is not None else None
+        self.loaded_at = datetime.now()
+        self.inflight = 0
+        self.retired = False
+
+    @property
+    def index_version(self) -> str:
+        """
+        Name of the embedding index for this slot. With a cascade, embeddings
+        come from the fast model, which runs for every image.
+        """
+        if self.fast_handler is None:
+            return self.version
+        return f"{self.version}-fast-{self.fast_digest[:12]}"
+
+    async def _predict_full(self, file_path: str, return_embedding: bool = False):
+        if self.pool is not None:
+            return await self.pool.predict_async(file_path, return_embedding)
+        return await asyncio.to_thread(self.handler.predict, file_path, return_embedding)
+
+    async def predict(self, file_path: str, return_embedding: bool = False, need_gradcam: bool = False):
+        """
+        Run the classifier without blocking the event loop, on the
+        least-loaded replica when this slot has a replica pool.
+
+        In cascade mode the fast model runs first and its answer is returned
+        unless it is below CASCADE_CONFIDENCE_THRESHOLD, or it is a tumor and
+        the caller needs a GradCAM heatmap (which comes from the full model).
+        """
+        if self.fast_handler is None:
+            return await self._predict_full(file_path, return_embedding)
+
+        start = time.perf_counter()
+        # The fast model answers most requests, so it gets replicas like the full model
+        if self.fast_pool is not None:
+            result, embedding = await self.fast_pool.predict_async(file_path, True)
+        else:
+            result, embedding = await asyncio.to_thread(self.fast_handler.predict, file_path, True)
+        fast_seconds = time.perf_counter() - start
+        reason = escalation_reason(
+            result, settings.CASCADE_CONFIDENCE_THRESHOLD, need_gradcam or settings.CASCADE_ESCALATE_TUMORS
+        )
+        full_seconds = 0.0
+        fast_confidence = result["confidence"]
+        if reason is not None:
+            start = time.perf_counter()
+            result = await self._predict_full(file_path)
+            full_seconds = time.perf_counter() - start
+        self.cascade_stats.record(reason, fast_seconds, full_seconds)
+        result["cascade"] = {
+            "stage": "fast" if reason is None else "full",
+            "escalation_reason": reason,
+            "fast_confidence": fast_confidence,
+        }
+        return (result, embedding) if return_embedding else result
+
+    def close(self) -> None:
+        for pool in (self.pool, self.fast_pool):
+            if pool is not None:
+                pool.shutdown()
+        self.pool = None
+        self.fast_pool = None
+        self.handler = None
+        self.fast_handler = None
+        self.gradcam = None
+        logger.info(f"Released model version {self.version}")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "path": self.path,
+            "digest": self.digest,
+            "loaded_at": self.loaded_at.isoformat(),
+            "inflight": self.inflight,
+            "replicas": self.pool.size if self.pool is not None else 1,
+            "fast_replicas": self.fast_pool.size if self.fast_pool is not None else None,
+            "cascade": self.cascade_stats.snapshot() if self.cascade_stats is not None else None,
+        }
+
+
+class ModelRegistry:
+    """
+    Versioned model slots with zero-downtime reloads.
+
+    A reload builds and warms up a complete new slot in a worker thread while
+    the active one keeps serving. Switching is a single reference swap on the
+    event loop, so each request sees exactly one version from ``lease`` to
+    release. The previous slot is retired and closed once its last in-flight
+    request finishes.
+    """
+
+    def __init__(self):
+        self.active: Optional[ModelSlot] = None
+        self._draining: List[ModelSlot] = []
+        self._reload_task: Optional[asyncio.Task] = None
+        self.last_error: Optional[str] = None
+        # Every version activated in this process, with the model file digest it named
+        self._digests: Dict[str, str] = {}
+
+    @property
+    def active_version(self) -> Optional[str]:
+        return self.active.version if self.active is not None else None
+
+    @property
+    def active_index_version(self) -> Optional[str]:
+        return self.active.index_version if self.active is not None else None
+
+    @property
+    def reloading(self) -> bool:
+        return self._reload_task is not None and not self._reload_task.done()
+
+    def load(self, path: str, version: Optional[str] = None) -> ModelSlot:
+        """
+        Load, and warm up, a new slot; blocking, so run it off the event loop
+        """
+        digest = model_digest(path)
+        version = version or f"{settings.MODEL_VERSION}+{digest[:12]}"
+        logger.info(f"Loading model version {version} from {path}")
+        handler = ModelHandler(path, fold_rescale=settings.FOLD_RESCALE_INTO_MODEL)
+        gradcam = create_gradcam(handler.model)
+
+        # Trace the inference and gradient graphs now, not on the first request
+        size = handler.img_size[::-1]
+        dtype = np.uint8 if handler.fold_rescale else np.float32
+        handler.inference_model.predict(np.zeros((1, *size, 3), dtype=dtype), verbose=0)
+        gradcam.compute_heatmap(np.zeros((*size, 3), dtype=np.uint8))
+
+        fast_handler, fast_digest = None, None
+        if settings.CASCADE_ENABLED:
+            fast_path = settings.CASCADE_FAST_MODEL_PATH or DEFAULT_FAST_MODEL_PATH
+            if os.path.exists(fast_path):
+                fast_digest = model_digest(fast_path)
+                fast_handler = ModelHandler(fast_path, fold_rescale=settings.FOLD_RESCALE_INTO_MODEL)
+                fast_size = fast_handler.img_size[::-1]
+                fast_handler.inference_model.predict(np.zeros((1, *fast_size, 3), dtype=dtype), verbose=0)
+                logger.info(f"Cascade fast model loaded from {fast_path} (input {fast_handler.img_size})")
+            else:
+                logger.warning(f"Cascade enabled but no fast model at {fast_path}; using the full model only")
+
+        pool, fast_pool = None, None
+        if settings.MODEL_REPLICAS > 1:
+            full_cpus, fast_cpus = None, None
+            pin = settings.PIN_MODEL_REPLICAS
+            fast_threads = settings.CASCADE_FAST_THREADS_PER_REPLICA or settings.THREADS_PER_REPLICA
+            if fast_handler is not None and settings.CASCADE_FAST_REPLICAS > 0 and pin:
+                cores = split_cores(
+                    settings.MODEL_REPLICAS, settings.THREADS_PER_REPLICA, settings.CASCADE_FAST_REPLICAS, fast_threads
+                )
+                if cores is None:
+                    pin = False
+                else:
+                    full_cpus, fast_cpus = cores
+            pool = ModelReplicaPool(
+                path,
+                replicas=settings.MODEL_REPLICAS,
+                threads_per_replica=settings.THREADS_PER_REPLICA,
+                pin=pin,
+                fold_rescale=settings.FOLD_RESCALE_INTO_MODEL,
+                cpus=full_cpus
+            )
+            pool.warmup()
+            logger.info(f"Model replica pool started with {pool.size} replicas")
+            if fast_handler is not None and settings.CASCADE_FAST_REPLICAS > 0:
+                fast_pool = ModelReplicaPool(
+                    fast_path,
+                    replicas=settings.CASCADE_FAST_REPLICAS,
+                    threads_per_replica=fast_threads,
+                    pin=pin,
+                    fold_rescale=settings.FOLD_RESCALE_INTO_MODEL,
+                    cpus=fast_cpus
+                )
+                fast_pool.warmup()
+                logger.info(f"Cascade fast model replica pool started with {fast_pool.size} replicas")
+        return ModelSlot(version, path, digest, handler, gradcam, pool, fast_handler, fast_digest, fast_pool)
+
+    def activate(self, slot: ModelSlot) -> None:
+        """
+        Make ``slot`` serve all new requests and retire the previous one
+        """
+        previous, self.active = self.active, slot
+        self._digests[slot.version] = slot.digest
+        # New reports are keyed by the version that produced their results
+        get_report_service().model_version = slot.version
+        logger.info(f"Model version {slot.version} is now active")
+        if previous is not None:
+            previous.retired = True
+            self._draining.append(previous)
+            self._release_if_drained(previous)
+
+    def _release_if_drained(self, slot: ModelSlot) -> None:
+        if slot.retired and slot.inflight == 0 and slot in self._draining:
+            self._draining.remove(slot)
+            try:
+                asyncio.get_running_loop().run_in_executor(None, slot.close)
+            except RuntimeError:
+                slot.close()
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        Pin the active slot for the duration of a request
+        """
+        slot = self.active
+        if slot is None:
+            raise Exception("ML image model not loaded.")
+        slot.inflight += 1
+        try:
+            yield slot
+        finally:
+            slot.inflight -= 1
+            self._release_if_drained(slot)
+
+    async def start_reload(self, path: Optional[str] = None, version: Optional[str] = None) -> bool:
+        """
+        Start loading a new version in the background; False if a reload is already running.
+
+        Heatmaps, reports and embedding indexes are keyed by version, so an explicit
+        ``version`` already used for a different model file raises ValueError.
+        """
+        if self.reloading:
+            return False
+        if version is not None and version in self._digests:
+            candidate = path or DEFAULT_MODEL_PATH
+            digest = await asyncio.to_thread(model_digest, candidate) if os.path.exists(candidate) else None
+            if digest is not None and digest != self._digests[version]:
+                raise ValueError(f"Version {version} already names a different model file")
+            if self.reloading:
+                return False
+        self.last_error = None
+        self._reload_task = asyncio.get_running_loop().create_task(self.reload(path, version))
+        return True
+
+    async def reload(self, path: Optional[str] = None, version: Optional[str] = None) -> Optional[ModelSlot]:
+        path = path or DEFAULT_MODEL_PATH
+        try:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Model file not found at {path}")
+            if version is None and self.active is not None:
+                digest = await asyncio.to_thread(model_digest, path)
+                if digest == self.active.digest:
+                    logger.info("Model file is unchanged, keeping the active version")
+                    return self.active
+            slot = await asyncio.to_thread(self.load, path, version)
+            self.activate(slot)
+            return slot
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Model reload failed: {str(e)}")
+            return None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "active": self.active.describe() if self.active is not None else None,
+            "draining": [slot.describe() for slot in self._draining],
+            "reloading": self.reloading,
+            "last_error": self.last_error,
+        }
+
+    def shutdown(self) -> None:
+        for slot in self._draining + ([self.active] if self.active is not None else []):
+            for pool in (slot.pool, slot.fast_pool):
+                if pool is not None:
+                    pool.shutdown()
+        self._draining = []
+
+
+_model_registry: Optional[ModelRegistry] = None
+
+
+def get_model_registry() -> ModelRegistry:
+    """
+    Return the process-wide model registry, creating it on first use
+    """
+    global _model_registry
+    if _model_registry is None:
+        _model_registry = ModelRegistry()
+    return _model_registry
@@ -0,0 +1,278 @@
+import asyncio
+import base64
+import io
+import json
+import logging
+from datetime import datetime
+from string import Template
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.services.storage_service import get_storage_manager, heatmap_key
+
+logger = logging.getLogger(__name__)
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Image as PDFImage, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    REPORTLAB_AVAILABLE = True
+except ImportError:
+    REPORTLAB_AVAILABLE = False
+
+# Text templates are compiled once at import and only substituted per report
+SUMMARY_TEMPLATES = {
+    "tumor": Template("AI analysis suggests a $label with $confidence% confidence."),
+    "notumor": Template("No suspicious regions detected ($confidence% confidence)."),
+    "medical": Template("$count suspicious region(s) detected with an overall confidence of $confidence%."),
+}
+FINDING_TEMPLATE = Template("$description ($confidence% confidence).")
+ANOMALY_TEMPLATE = Template("$type at voxel $location, size $size, ($confidence% confidence).")
+
+CLASS_LABELS = {
+    "glioma": "glioma",
+    "meningioma": "meningioma",
+    "pituitary": "pituitary tumor",
+}
+CLASS_DESCRIPTIONS = {
+    "glioma": "Imaging features consistent with a glioma",
+    "meningioma": "Imaging features consistent with a meningioma",
+    "pituitary": "Imaging features consistent with a pituitary tumor",
+}
+RECOMMENDATIONS = {
+    "tumor": [
+        "Review by a radiologist is recommended",
+        "Consult with neurologist for detailed analysis",
+    ],
+    "notumor": [
+        "No follow-up indicated by the AI analysis; correlate clinically",
+    ],
+}
+DISCLAIMER = (
+    "This report was generated automatically by an AI model and is not a diagnosis. "
+    "It must be reviewed by a qualified medical professional."
+)
+
+
+def _percent(value: Optional[float]) -> str:
+    return f"{(value or 0.0) * 100:.1f}"
+
+
+def build_report_content(results: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the summary, findings and recommendations for a set of analysis results
+    """
+    prediction = results.get("prediction")
+    if prediction:
+        predicted_class = prediction.get("predicted_class")
+        confidence = _percent(prediction.get("confidence"))
+        if predicted_class == "notumor":
+            return {
+                "summary": SUMMARY_TEMPLATES["notumor"].substitute(confidence=confidence),
+                "findings": [],
+                "recommendations": list(RECOMMENDATIONS["notumor"]),
+            }
+        return {
+            "summary": SUMMARY_TEMPLATES["tumor"].substitute(
+                label=CLASS_LABELS.get(predicted_class, predicted_class), confidence=confidence
+            ),
+            "findings": [{
+                "type": predicted_class,
+                "description": FINDING_TEMPLATE.substitute(
+                    description=CLASS_DESCRIPTIONS.get(predicted_class, predicted_class), confidence=confidence
+                ),
+                "confidence": prediction.get("confidence"),
+            }],
+            "recommendations": list(RECOMMENDATIONS["tumor"]),
+        }
+
+    anomalies = results.get("anomalies", [])
+    return {
+        "summary": SUMMARY_TEMPLATES["medical"].substitute(
+            count=len(anomalies), confidence=_percent(results.get("confidence_score"))
+        ),
+        "findings": [
+            {
+                "type": anomaly.get("type"),
+                "description": ANOMALY_TEMPLATE.substitute(
+                    type=str(anomaly.get("type", "anomaly")).capitalize(),
+                    location=anomaly.get("location"),
+                    size=anomaly.get("size"),
+                    confidence=_percent(anomaly.get("confidence")),
+                ),
+                "confidence": anomaly.get("confidence"),
+            }
+            for anomaly in anomalies
+        ],
+        "recommendations": list(RECOMMENDATIONS["tumor" if anomalies else "notumor"]),
+    }
+
+
+class ReportService:
+    """
+    Builds JSON and PDF reports in the background after inference.
+
+    Finished reports are stored as ``report`` artifacts keyed by scan and
+    model version, so the report endpoint serves them straight from storage.
+    The stored GradCAM heatmap is embedded as-is instead of being recomputed.
+    """
+
+    def __init__(self, model_version: str, workers: int = 2):
+        self.model_version = model_version
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pending: set = set()
+        # PDF styles are built once and reused for every report
+        self._styles = getSampleStyleSheet() if REPORTLAB_AVAILABLE else None
+
+    def cache_key(self, scan_id: str, fmt: str, model_version: Optional[str] = None) -> str:
+        return f"{scan_id}-report-{model_version or self.model_version}-{fmt}"
+
+    def is_pending(self, scan_id: str, model_version: Optional[str] = None) -> bool:
+        return (scan_id, model_version or self.model_version) in self._pending
+
+    def get_cached(self, scan_id: str, fmt: str, model_version: Optional[str] = None):
+        return get_storage_manager().get(self.cache_key(scan_id, fmt, model_version))
+
+    def is_built(self, scan_id: str, model_version: Optional[str] = None) -> bool:
+        formats = ("json", "pdf") if REPORTLAB_AVAILABLE else ("json",)
+        return all(self.get_cached(scan_id, fmt, model_version) is not None for fmt in formats)
+
+    async def enqueue(self, scan_id: str, results: Dict[str, Any], model_version: Optional[str] = None) -> bool:
+        """
+        Queue a report build; returns False if one is already queued or built
+        """
+        model_version = model_version or self.model_version
+        job = (scan_id, model_version)
+        if job in self._pending:
+            return False
+        # Claim the job before checking storage (index commits, off the event loop)
+        # so a concurrent enqueue of the same report backs off
+        self._pending.add(job)
+        try:
+            built = await asyncio.to_thread(self.is_built, scan_id, model_version)
+        except Exception:
+            self._pending.discard(job)
+            raise
+        if built:
+            self._pending.discard(job)
+            return False
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queue.put_nowait((scan_id, model_version, results))
+        return True
+
+    async def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(f"Report service started with {self.workers} workers (PDF {'enabled' if REPORTLAB_AVAILABLE else 'disabled'})")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            scan_id, model_version, results = await self._queue.get()
+            try:
+                await asyncio.to_thread(self.build, scan_id, model_version, results)
+            except Exception as e:
+                logger.error(f"Error generating report for {scan_id}: {str(e)}")
+            finally:
+                self._pending.discard((scan_id, model_version))
+                self._queue.task_done()
+
+    def build(self, scan_id: str, model_version: str, results: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build and store the JSON (and, when reportlab is installed, PDF) report
+        """
+        storage = get_storage_manager()
+        heatmap = storage.get(heatmap_key(scan_id, model_version))
+        heatmap_png = None
+        if heatmap is not None:
+            with open(heatmap.path, "rb") as f:
+                heatmap_png = f.read()
+
+        created_at = datetime.now()
+        report = {
+            "report_id": f"NN-{created_at.strftime('%Y%m%d')}-{scan_id[:8]}",
+            "scan_id": scan_id,
+            "model_version": model_version,
+            "created_at": created_at.isoformat(),
+            **build_report_content(results),
+            "probabilities": results.get("prediction", {}).get("all_probabilities"),
+            "processing_time": results.get("processing_time"),
+            "heatmap": f"data:image/png;base64,{base64.b64encode(heatmap_png).decode()}" if heatmap_png else None,
+            "disclaimer": DISCLAIMER,
+        }
+
+        if REPORTLAB_AVAILABLE:
+            storage.put_bytes(
+                self.cache_key(scan_id, "pdf", model_version), "report",
+                self._render_pdf(report, heatmap_png), ".pdf", scan_id=scan_id
+            )
+        # The JSON report is written last: its presence marks the report as complete
+        storage.put_bytes(
+            self.cache_key(scan_id, "json", model_version), "report",
+            json.dumps(report).encode(), ".json", scan_id=scan_id
+        )
+        logger.info(f"Report generated for scan {scan_id} (model {model_version})")
+        return report
+
+    def _render_pdf(self, report: Dict[str, Any], heatmap_png: Optional[bytes]) -> bytes:
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4)
+        styles = self._styles
+        story = [Paragraph("NEURONAV AI ANALYSIS REPORT", styles["Title"]), Spacer(1, 20)]
+
+        study_table = Table([
+            ["Report ID:", report["report_id"]],
+            ["Scan ID:", report["scan_id"]],
+            ["AI Model Version:", report["model_version"]],
+            ["Created:", report["created_at"]],
+            ["Processing Time:", f"{report['processing_time'] or 0:.2f}s"],
+        ])
+        study_table.setStyle(TableStyle([
+            ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+            ("FONTNAME", (0, 0), (0, -1), "Helvetica-Bold"),
+            ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ]))
+        story += [study_table, Spacer(1, 20)]
+
+        story += [Paragraph("SUMMARY", styles["Heading2"]), Paragraph(report["summary"], styles["Normal"])]
+        if report["findings"]:
+            story.append(Paragraph("AI FINDINGS", styles["Heading2"]))
+            story += [Paragraph(f"• {finding['description']}", styles["Normal"]) for finding in report["findings"]]
+        if heatmap_png:
+            story += [Spacer(1, 12), Paragraph("GRAD-CAM HEATMAP", styles["Heading2"]),
+                      PDFImage(io.BytesIO(heatmap_png), width=224, height=224)]
+        story.append(Paragraph("RECOMMENDATIONS", styles["Heading2"]))
+        story += [Paragraph(f"• {item}", styles["Normal"]) for item in report["recommendations"]]
+        story += [Spacer(1, 20), Paragraph(report["disclaimer"], styles["Italic"])]
+
+        doc.build(story)
+        return buffer.getvalue()
+
+
+_report_service: Optional[ReportService] = None
+
+
+def get_report_service() -> ReportService:
+    """
+    Return the process-wide report service, creating it on first use
+    """
+    global _report_service
+    if _report_service is None:
+        _report_service = ReportService(settings.MODEL_VERSION, workers=settings.REPORT_WORKERS)
+    return _report_service
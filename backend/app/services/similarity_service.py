@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingIndex:
+    """
+    Append-only, memory-mapped index of L2-normalized float32 embeddings.
+
+    Vectors live in ``vectors.f32`` (grown by doubling, never rewritten) and
+    the row -> scan id mapping in ``ids.txt``. Small indexes are searched
+    exactly with a chunked matrix product. Once the index passes
+    ``exact_threshold`` rows, a k-means coarse quantizer is trained once and
+    every vector is assigned to its nearest centroid (IVF). New vectors are
+    assigned on add, so incremental adds never require a rebuild, and queries
+    only score the rows in the ``nprobe`` closest lists.
+    """
+
+    def __init__(self, directory: str, exact_threshold: int = 50000, nlist: int = 1024, nprobe: int = 16):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.exact_threshold = exact_threshold
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._training = False
+
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._assignments: Optional[np.memmap] = None
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: Dict[int, List[np.ndarray]] = {}
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._load()
+
+    @property
+    def _meta_path(self) -> Path:
+        return self.directory / "meta.json"
+
+    def _load(self) -> None:
+        if not self._meta_path.exists():
+            return
+        meta = json.loads(self._meta_path.read_text())
+        self.dim, self.capacity = meta["dim"], meta["capacity"]
+        with open(self.directory / "ids.txt") as f:
+            self._ids = f.read().splitlines()
+        # meta.json is written last on add, so its count is the number of complete rows
+        self.count = min(meta["count"], len(self._ids))
+        if len(self._ids) != self.count:
+            self._ids = self._ids[:self.count]
+            (self.directory / "ids.txt").write_text("".join(f"{scan_id}\n" for scan_id in self._ids))
+        self._rows = {scan_id: row for row, scan_id in enumerate(self._ids)}
+        self._open_files()
+        centroids_path = self.directory / "centroids.npy"
+        if centroids_path.exists():
+            self.centroids = np.load(centroids_path)
+            self._build_lists(self._assignments[:self.count])
+        logger.info(f"Loaded embedding index with {self.count} vectors (dim={self.dim}, ivf={self.centroids is not None})")
+
+    def _open_files(self) -> None:
+        self._vectors = np.memmap(self.directory / "vectors.f32", dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self._assignments = np.memmap(self.directory / "assignments.i32", dtype=np.int32, mode="r+", shape=(self.capacity,))
+
+    def _grow(self, needed: int) -> None:
+        new_capacity = max(1024, self.capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+        if new_capacity == self.capacity:
+            return
+        for name, row_bytes in (("vectors.f32", self.dim * 4), ("assignments.i32", 4)):
+            with open(self.directory / name, "ab") as f:
+                f.truncate(new_capacity * row_bytes)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._assignments.flush()
+        self.capacity = new_capacity
+        self._open_files()
+
+    def _write_meta(self) -> None:
+        tmp_path = self._meta_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"dim": self.dim, "count": self.count, "capacity": self.capacity}))
+        os.replace(tmp_path, self._meta_path)
+
+    def _build_lists(self, assignments: np.ndarray) -> None:
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self._lists = {
+            c: [order[bounds[c]:bounds[c + 1]].astype(np.int64)]
+            for c in range(len(self.centroids)) if bounds[c + 1] > bounds[c]
+        }
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, scan_id: str) -> bool:
+        return scan_id in self._rows
+
+    def add(self, scan_id: str, embedding: np.ndarray) -> None:
+        self.add_batch([scan_id], np.asarray(embedding, dtype=np.float32)[np.newaxis])
+
+    def add_batch(self, scan_ids: List[str], embeddings: np.ndarray) -> None:
+        """
+        Append embeddings for new scans; existing scan ids are skipped
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(scan_ids), -1)
+        with self._lock:
+            keep = [i for i, scan_id in enumerate(scan_ids) if scan_id not in self._rows]
+            if not keep:
+                return
+            embeddings = embeddings[keep]
+            scan_ids = [scan_ids[i] for i in keep]
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Expected embeddings of dimension {self.dim}, got {embeddings.shape[1]}")
+
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+            start, end = self.count, self.count + len(scan_ids)
+            self._grow(end)
+            self._vectors[start:end] = embeddings
+            if self.centroids is not None:
+                assignments = self._assign(embeddings)
+                self._assignments[start:end] = assignments
+                rows = np.arange(start, end, dtype=np.int64)
+                for c in np.unique(assignments):
+                    parts = self._lists.setdefault(int(c), [])
+                    parts.append(rows[assignments == c])
+                    if len(parts) > 32:
+                        parts[:] = [np.concatenate(parts)]
+            with open(self.directory / "ids.txt", "a") as f:
+                f.write("".join(f"{scan_id}\n" for scan_id in scan_ids))
+            for offset, scan_id in enumerate(scan_ids):
+                self._rows[scan_id] = start + offset
+            self._ids.extend(scan_ids)
+            self.count = end
+            self._write_meta()
+
+        if self.centroids is None and self.count >= self.exact_threshold and not self._training:
+            self._training = True
+            threading.Thread(target=self.train, daemon=True).start()
+
+    def train(self, sample_size: int = 100000) -> None:
+        """
+        Train the IVF coarse quantizer once and assign every stored vector
+        """
+        from sklearn.cluster import MiniBatchKMeans
+
+        try:
+            count = self.count
+            nlist = min(self.nlist, max(1, count // 39))
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+            kmeans = MiniBatchKMeans(n_clusters=nlist, batch_size=4096, n_init=1, random_state=0)
+            kmeans.fit(self._vectors[sample])
+            centroids = kmeans.cluster_centers_.astype(np.float32)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+            with self._lock:
+                self.centroids = centroids
+                for start in range(0, self.count, 65536):
+                    end = min(start + 65536, self.count)
+                    self._assignments[start:end] = self._assign(np.asarray(self._vectors[start:end]))
+                self._assignments.flush()
+                np.save(self.directory / "centroids.npy", centroids)
+                self._build_lists(np.asarray(self._assignments[:self.count]))
+            logger.info(f"Trained IVF quantizer with {nlist} lists over {self.count} vectors")
+        finally:
+            self._training = False
+
+    def get(self, scan_id: str) -> Optional[np.ndarray]:
+        row = self._rows.get(scan_id)
+        return None if row is None else np.array(self._vectors[row])
+
+    def search(self, query: np.ndarray, k: int = 5, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Return the k most similar scans as (scan_id, cosine similarity) pairs
+        """
+        if self.count == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        count = self.count
+        wanted = k + (1 if exclude else 0)
+
+        if self.centroids is None:
+            rows, scores = self._search_exact(query, count, wanted)
+        else:
+            rows, scores = self._search_ivf(query, count, wanted)
+
+        results = []
+        for row, score in zip(rows, scores):
+            scan_id = self._ids[row]
+            if scan_id != exclude:
+                results.append((scan_id, float(score)))
+        return results[:k]
+
+    def _search_exact(self, query: np.ndarray, count: int, k: int, chunk: int = 65536):
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, count, chunk):
+            scores = self._vectors[start:min(start + chunk, count)] @ query
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+        order = np.argsort(-best_scores)[:k]
+        return best_rows[order], best_scores[order]
+
+    def _search_ivf(self, query: np.ndarray, count: int, k: int):
+        probes = np.argpartition(-(self.centroids @ query), min(self.nprobe, len(self.centroids)) - 1)[:self.nprobe]
+        parts = [part for c in probes for part in self._lists.get(int(c), [])]
+        if not parts:
+            return self._search_exact(query, count, k)
+        candidates = np.concatenate(parts)
+        candidates = np.sort(candidates[candidates < count])
+        scores = self._vectors[candidates] @ query
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        order = top[np.argsort(-scores[top])]
+        return candidates[order], scores[order]
+
+
+_similarity_indexes: Dict[str, EmbeddingIndex] = {}
+
+
+def get_similarity_index(model_version: str) -> EmbeddingIndex:
+    """
+    Return the process-wide embedding index for a model version; embeddings
+    from different versions live in separate indexes and are never compared
+    """
+    index = _similarity_indexes.get(model_version)
+    if index is None:
+        index = _similarity_indexes[model_version] = EmbeddingIndex(
+            os.path.join(settings.EMBEDDING_INDEX_DIR, model_version),
+            exact_threshold=settings.SIMILAR_EXACT_THRESHOLD,
+            nlist=settings.SIMILAR_NLIST,
+            nprobe=settings.SIMILAR_NPROBE,
+        )
+    return index
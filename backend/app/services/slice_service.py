@@ -0,0 +1,331 @@
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import settings
+from app.services.volume_cache import get_volume_cache
+from app.utils.file_utils import get_file_extension
+
+logger = logging.getLogger(__name__)
+
+PLANES = ("axial", "coronal", "sagittal")
+SLICE_FORMATS = {"png": "image/png", "webp": "image/webp"}
+
+# Uncompressed DICOM transfer syntaxes whose pixel data can be memory-mapped directly
+UNCOMPRESSED_SYNTAXES = {"1.2.840.10008.1.2", "1.2.840.10008.1.2.1"}
+
+
+class Volume:
+    """
+    Read-only view of a NIfTI or DICOM volume that reads one slice at a time.
+
+    Uncompressed NIfTI voxel data is memory-mapped directly, so a read only
+    touches the bytes of the requested slice (``.nii.gz`` is resolved to its
+    decompressed copy in the volume cache first). Uncompressed DICOM pixel data is
+    memory-mapped at its file offset; compressed DICOM falls back to decoding
+    the pixel array once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.default_window: Optional[Tuple[float, float]] = None
+        self._rescale: Optional[Tuple[float, float]] = None
+        self._bottom_up = False
+        extension = get_file_extension(path)
+        if extension in (".nii", ".nii.gz"):
+            self._open_nifti()
+        elif extension == ".dcm":
+            self._open_dicom()
+        else:
+            raise ValueError(f"Slice preview is not supported for {extension} files")
+
+    def _open_nifti(self) -> None:
+        import nibabel as nib
+
+        image = nib.load(self.path, mmap=True)
+        proxy = image.dataobj
+        if get_file_extension(self.path) == ".nii":
+            # Map the voxel block directly: nibabel's proxy serves partial slices with
+            # buffered reads, which is slow for planes that are strided on disk
+            self._data = np.memmap(self.path, dtype=proxy.dtype, mode="r", offset=proxy.offset,
+                                   shape=proxy.shape, order=proxy.order)
+            slope, intercept = float(proxy.slope), float(proxy.inter)
+            self._rescale = (slope, intercept) if (slope, intercept) != (1.0, 0.0) else None
+        else:
+            self._data = proxy
+        shape = image.shape[:3] + (1,) * (3 - len(image.shape[:3]))
+        self.shape = tuple(int(n) for n in shape)
+        # NIfTI voxel axes are (x, y, z): sagittal, coronal, axial
+        self._axes = {"sagittal": 0, "coronal": 1, "axial": 2}
+        self._bottom_up = True
+
+    def _open_dicom(self) -> None:
+        import pydicom
+
+        dataset = pydicom.dcmread(self.path, defer_size="1 KB")
+        frames = int(getattr(dataset, "NumberOfFrames", 1) or 1)
+        rows, columns = int(dataset.Rows), int(dataset.Columns)
+        element = dataset.get_item("PixelData")
+        syntax = str(dataset.file_meta.TransferSyntaxUID)
+        if (syntax in UNCOMPRESSED_SYNTAXES and element is not None and getattr(element, "value_tell", None)
+                and int(getattr(dataset, "SamplesPerPixel", 1)) == 1):
+            dtype = np.dtype(f"{'i' if dataset.PixelRepresentation else 'u'}{dataset.BitsAllocated // 8}").newbyteorder("<")
+            data = np.memmap(self.path, dtype=dtype, mode="r", offset=element.value_tell,
+                             shape=(frames, rows, columns))
+        else:
+            data = dataset.pixel_array.reshape(frames, rows, columns, -1)[..., 0]
+        slope = float(getattr(dataset, "RescaleSlope", 1) or 1)
+        intercept = float(getattr(dataset, "RescaleIntercept", 0) or 0)
+        self._data = data
+        self._rescale = (slope, intercept) if (slope, intercept) != (1.0, 0.0) else None
+        self.shape = (frames, rows, columns)
+        # Frames are stacked axially: (z, y, x)
+        self._axes = {"axial": 0, "coronal": 1, "sagittal": 2}
+        center, width = getattr(dataset, "WindowCenter", None), getattr(dataset, "WindowWidth", None)
+        if center is not None and width is not None:
+            first = lambda value: float(value[0] if isinstance(value, pydicom.multival.MultiValue) else value)
+            self.default_window = (first(width), first(center))
+
+    def num_slices(self, plane: str) -> int:
+        return self.shape[self._axes[plane]]
+
+    def read_slice(self, plane: str, index: int) -> np.ndarray:
+        """
+        Read a single 2D slice as float32, oriented for display
+        """
+        axis = self._axes[plane]
+        count = self.shape[axis]
+        if not 0 <= index < count:
+            raise IndexError(f"Slice index {index} out of range for {plane} plane (0-{count - 1})")
+        # Only the first volume of a 4D series is previewed
+        key = [slice(None)] * 3 + [0] * (len(self._data.shape) - 3)
+        key[axis] = index
+        data = np.asarray(self._data[tuple(key[:len(self._data.shape)])], dtype=np.float32)
+        data = data.reshape(data.shape[:2])
+        if self._rescale:
+            slope, intercept = self._rescale
+            data = data * slope + intercept
+        if self._bottom_up:
+            # NIfTI slices are indexed (column, row) from the bottom: transpose and flip for display
+            data = data.T[::-1]
+        return np.ascontiguousarray(data)
+
+    def estimate_window(self) -> Tuple[float, float]:
+        """
+        Default (width, level) from the 1st-99th percentiles of the middle axial slice
+        """
+        if self.default_window is None:
+            middle = self.read_slice("axial", self.num_slices("axial") // 2)
+            low, high = np.percentile(middle, [1, 99])
+            self.default_window = (max(float(high - low), 1.0), float(low + high) / 2)
+        return self.default_window
+
+
+def apply_window(data: np.ndarray, width: float, level: float) -> np.ndarray:
+    """
+    Map intensities in [level - width/2, level + width/2] linearly to 0-255
+    """
+    width = max(float(width), 1e-6)
+    scaled = (data - (level - width / 2)) * (255.0 / width)
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def encode_slice(pixels: np.ndarray, fmt: str, max_size: Optional[int] = None) -> bytes:
+    image = Image.fromarray(pixels, mode="L")
+    if max_size and max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.BILINEAR)
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        image.save(buffer, format="WEBP", quality=80, method=0)
+    else:
+        # Low zlib effort: encoding speed matters more than a few percent of size here
+        image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+@dataclass(frozen=True)
+class SliceRequest:
+    path: str
+    plane: str
+    index: int
+    width: Optional[float] = None
+    level: Optional[float] = None
+    fmt: str = "png"
+    max_size: Optional[int] = None
+    # sha256 of the upload, so the volume cache does not re-hash it; not part of the cache key
+    content_hash: Optional[str] = field(default=None, compare=False)
+
+
+class SliceService:
+    """
+    Renders orthogonal slice previews of uploaded volumes.
+
+    Open volumes and encoded slices are kept in LRU caches (the latter
+    bounded in bytes). After each request the neighbouring slices in the
+    same plane are rendered in the background, so scrolling mostly hits
+    the cache.
+    """
+
+    def __init__(self, cache_bytes: int = 64 * 1024 * 1024, max_volumes: int = 8,
+                 prefetch: int = 2, workers: int = 2):
+        self.cache_bytes = cache_bytes
+        self.max_volumes = max_volumes
+        self.prefetch = prefetch
+        self._slices: "OrderedDict[SliceRequest, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self._volumes: "OrderedDict[str, Volume]" = OrderedDict()
+        self._inflight: Dict[SliceRequest, Future] = {}
+        self._last_index: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="slice-prefetch")
+        self.hits = 0
+        self.misses = 0
+
+    def volume(self, path: str, content_hash: Optional[str] = None) -> Volume:
+        with self._lock:
+            volume = self._volumes.get(path)
+            if volume is not None:
+                self._volumes.move_to_end(path)
+                return volume
+        # .nii.gz is read from its decompressed copy so slices can be memory-mapped
+        volume = Volume(get_volume_cache().resolve(path, content_hash))
+        with self._lock:
+            self._volumes[path] = volume
+            while len(self._volumes) > self.max_volumes:
+                self._volumes.popitem(last=False)
+        return volume
+
+    def info(self, path: str, content_hash: Optional[str] = None):
+        volume = self.volume(path, content_hash)
+        width, level = volume.estimate_window()
+        return {
+            "shape": list(volume.shape),
+            "slices": {plane: volume.num_slices(plane) for plane in PLANES},
+            "window": width,
+            "level": level,
+        }
+
+    def get_cached(self, request: SliceRequest) -> Optional[bytes]:
+        with self._lock:
+            data = self._slices.get(request)
+            if data is not None:
+                self._slices.move_to_end(request)
+                self.hits += 1
+            return data
+
+    def render(self, request: SliceRequest, prefetch: bool = True) -> bytes:
+        """
+        Return the encoded slice, from cache (or an in-flight prefetch) when possible
+        """
+        data = self.get_cached(request)
+        if data is None:
+            with self._lock:
+                pending = self._inflight.get(request)
+                if pending is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            data = pending.result() if pending is not None else self._render(request)
+        if prefetch and self.prefetch:
+            self.prefetch_neighbours(request)
+        return data
+
+    def _render(self, request: SliceRequest) -> bytes:
+        volume = self.volume(request.path, request.content_hash)
+        width, level = request.width, request.level
+        if width is None or level is None:
+            default_width, default_level = volume.estimate_window()
+            width = default_width if width is None else width
+            level = default_level if level is None else level
+        pixels = apply_window(volume.read_slice(request.plane, request.index), width, level)
+        data = encode_slice(pixels, request.fmt, request.max_size)
+        self._store(request, data)
+        return data
+
+    def _store(self, request: SliceRequest, data: bytes) -> None:
+        with self._lock:
+            if request in self._slices:
+                return
+            self._slices[request] = data
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_bytes and self._slices:
+                _, evicted = self._slices.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    def prefetch_neighbours(self, request: SliceRequest) -> None:
+        """
+        Render the next slices in the scroll direction (both ways when unknown)
+        and the one just behind, without blocking the caller
+        """
+        try:
+            count = self.volume(request.path, request.content_hash).num_slices(request.plane)
+        except Exception:
+            return
+        with self._lock:
+            previous = self._last_index.get((request.path, request.plane))
+            self._last_index[(request.path, request.plane)] = request.index
+        if previous is None or previous == request.index:
+            offsets = [sign * d for d in range(1, self.prefetch + 1) for sign in (1, -1)]
+        else:
+            step = 1 if request.index > previous else -1
+            offsets = [step * d for d in range(1, self.prefetch + 1)] + [-step]
+
+        for offset in offsets:
+            index = request.index + offset
+            if not 0 <= index < count:
+                continue
+            neighbour = replace(request, index=index)
+            with self._lock:
+                if neighbour in self._slices or neighbour in self._inflight:
+                    continue
+                self._inflight[neighbour] = self._executor.submit(self._prefetch_one, neighbour)
+
+    def schedule_prefetch(self, request: SliceRequest) -> None:
+        """
+        prefetch_neighbours from a worker thread, for callers on the event loop:
+        counting the slices may have to reopen (and decompress) the volume
+        """
+        self._executor.submit(self.prefetch_neighbours, request)
+
+    def _prefetch_one(self, request: SliceRequest) -> bytes:
+        try:
+            return self._render(request)
+        except Exception as e:
+            logger.debug(f"Prefetch of {request.plane} slice {request.index} failed: {str(e)}")
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(request, None)
+
+    def stats(self):
+        with self._lock:
+            return {"slices": len(self._slices), "bytes": self._cached_bytes,
+                    "volumes": len(self._volumes), "hits": self.hits, "misses": self.misses}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_slice_service: Optional[SliceService] = None
+
+
+def get_slice_service() -> SliceService:
+    """
+    Return the process-wide slice preview service, creating it on first use
+    """
+    global _slice_service
+    if _slice_service is None:
+        _slice_service = SliceService(
+            cache_bytes=settings.SLICE_CACHE_BYTES,
+            max_volumes=settings.SLICE_MAX_OPEN_VOLUMES,
+            prefetch=settings.SLICE_PREFETCH,
+        )
+    return _slice_service
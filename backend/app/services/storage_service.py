@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_KINDS = ("upload", "heatmap", "mesh", "report", "volume")
+
+
+def heatmap_key(scan_id: str, model_version: str) -> str:
+    """Heatmaps depend on the model, so each version stores its own"""
+    return f"{scan_id}-heatmap-{model_version}"
+
+
+@dataclass
+class ArtifactRecord:
+    key: str
+    kind: str
+    scan_id: Optional[str]
+    path: str
+    size: int
+    created_at: float
+    last_access: float
+    content_hash: Optional[str] = None
+
+
+class StorageManager:
+    """
+    Sharded on-disk artifact store with an SQLite metadata index.
+
+    Files are placed under ``<root>/<kind>/<ab>/<cd>/`` using a hash of the
+    artifact key, so no directory grows unbounded and nothing is ever found by
+    listing directories. The index tracks sizes and access times, which lets
+    the store enforce a disk quota (LRU eviction) and expire artifacts by TTL.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        index_path: str,
+        quota_bytes: int,
+        ttl_seconds: Dict[str, int],
+        shard_depth: int = 2,
+        kind_quota_bytes: Optional[Dict[str, int]] = None,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        # Optional per-kind caps, e.g. so regenerable caches cannot crowd out uploads
+        self.kind_quota_bytes = kind_quota_bytes or {}
+        self.shard_depth = shard_depth
+
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS artifacts (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                scan_id TEXT,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                content_hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_artifacts_scan ON artifacts (scan_id, kind);
+            CREATE INDEX IF NOT EXISTS idx_artifacts_access ON artifacts (last_access);
+            CREATE INDEX IF NOT EXISTS idx_artifacts_kind_created ON artifacts (kind, created_at);
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(artifacts)")}
+        if "content_hash" not in columns:
+            self._conn.execute("ALTER TABLE artifacts ADD COLUMN content_hash TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_artifacts_hash ON artifacts (content_hash, kind)"
+        )
+        self._conn.commit()
+        self._used_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM artifacts"
+        ).fetchone()[0]
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_settings(cls) -> "StorageManager":
+        return cls(
+            root=settings.UPLOAD_DIR,
+            index_path=settings.STORAGE_INDEX_PATH,
+            quota_bytes=settings.STORAGE_QUOTA_BYTES,
+            ttl_seconds={
+                "upload": settings.UPLOAD_TTL_SECONDS,
+                "heatmap": settings.HEATMAP_TTL_SECONDS,
+                "mesh": settings.MESH_TTL_SECONDS,
+                "report": settings.REPORT_TTL_SECONDS,
+                "volume": settings.VOLUME_CACHE_TTL_SECONDS,
+            },
+            shard_depth=settings.STORAGE_SHARD_DEPTH,
+            kind_quota_bytes={"volume": settings.VOLUME_CACHE_BYTES},
+        )
+
+    @property
+    def used_bytes(self) -> int:
+        return self._used_bytes
+
+    def path_for(self, key: str, kind: str, suffix: str = "") -> Path:
+        """
+        Return the sharded path an artifact should be written to
+        """
+        if kind not in ARTIFACT_KINDS:
+            raise ValueError(f"Unknown artifact kind: {kind}")
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        directory = self.root.joinpath(kind, *shards)
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / f"{key}{suffix}"
+
+    def register(
+        self,
+        key: str,
+        kind: str,
+        path: str,
+        scan_id: Optional[str] = None,
+        content_hash: Optional[str] = None,
+    ) -> ArtifactRecord:
+        """
+        Record an artifact that has been written to ``path`` and enforce the quota
+        """
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT size FROM artifacts WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifacts "
+                "(key, kind, scan_id, path, size, created_at, last_access, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, scan_id, str(path), size, now, now, content_hash),
+            )
+            self._conn.commit()
+            self._used_bytes += size - (previous[0] if previous else 0)
+        if kind in self.kind_quota_bytes:
+            self.enforce_kind_quota(kind, protect=key)
+        self.enforce_quota(protect=key)
+        return ArtifactRecord(key, kind, scan_id, str(path), size, now, now, content_hash)
+
+    def put_bytes(self, key: str, kind: str, data: bytes, suffix: str = "", scan_id: Optional[str] = None) -> ArtifactRecord:
+        """
+        Write ``data`` as a new artifact and register it
+        """
+        path = self.path_for(key, kind, suffix)
+        tmp_path = path.with_name(path.name + ".part")
+        with open(tmp_path, "wb") as buffer:
+            buffer.write(data)
+        os.replace(tmp_path, path)
+        return self.register(key, kind, str(path), scan_id)
+
+    def lookup(self, scan_id: str, kind: str) -> Optional[ArtifactRecord]:
+        """
+        Find the most recent artifact of ``kind`` for a scan and mark it as accessed
+        """
+        return self._lookup_where("scan_id = ? AND kind = ?", (scan_id, kind))
+
+    def get(self, key: str) -> Optional[ArtifactRecord]:
+        """
+        Find an artifact by its key and mark it as accessed
+        """
+        return self._lookup_where("key = ?", (key,))
+
+    def lookup_by_hash(self, content_hash: str, kind: str = "upload") -> Optional[ArtifactRecord]:
+        """
+        Find the most recent artifact of ``kind`` with the given content hash
+        """
+        return self._lookup_where("content_hash = ? AND kind = ?", (content_hash, kind))
+
+    def _lookup_where(self, where: str, params: tuple) -> Optional[ArtifactRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, kind, scan_id, path, size, created_at, last_access, content_hash "
+                f"FROM artifacts WHERE {where} ORDER BY created_at DESC LIMIT 1",
+                params,
+            ).fetchone()
+            if row is None:
+                return None
+            record = ArtifactRecord(*row)
+            if not os.path.exists(record.path):
+                self._delete_locked(record.key, record.path, record.size)
+                self._conn.commit()
+                return None
+            record.last_access = time.time()
+            self._conn.execute(
+                "UPDATE artifacts SET last_access = ? WHERE key = ?",
+                (record.last_access, record.key),
+            )
+            self._conn.commit()
+        return record
+
+    def delete(self, key: str) -> None:
+        """
+        Remove an artifact from disk and from the index
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, size FROM artifacts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._delete_locked(key, row[0], row[1])
+                self._conn.commit()
+
+    def _delete_locked(self, key: str, path: str, size: int) -> None:
+        try:
+            Path(path).unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"Error removing artifact {path}: {str(e)}")
+        self._conn.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+        self._used_bytes -= size
+
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        """
+        Evict every artifact whose kind-specific TTL has elapsed
+        """
+        now = now or time.time()
+        evicted = 0
+        with self._lock:
+            for kind, ttl in self.ttl_seconds.items():
+                if ttl <= 0:
+                    continue
+                rows = self._conn.execute(
+                    "SELECT key, path, size FROM artifacts WHERE kind = ? AND created_at < ?",
+                    (kind, now - ttl),
+                ).fetchall()
+                for key, path, size in rows:
+                    self._delete_locked(key, path, size)
+                evicted += len(rows)
+            self._conn.commit()
+        if evicted:
+            logger.info(f"Evicted {evicted} expired artifacts")
+        return evicted
+
+    def enforce_quota(self, protect: Optional[str] = None) -> int:
+        """
+        Evict least recently used artifacts until usage fits within the quota
+        """
+        if self.quota_bytes <= 0 or self._used_bytes <= self.quota_bytes:
+            return 0
+        evicted = 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT key, path, size FROM artifacts ORDER BY last_access ASC"
+            )
+            for key, path, size in cursor.fetchall():
+                if self._used_bytes <= self.quota_bytes:
+                    break
+                if key == protect:
+                    continue
+                self._delete_locked(key, path, size)
+                evicted += 1
+            self._conn.commit()
+        if evicted:
+            logger.info(f"Evicted {evicted} artifacts to enforce storage quota")
+        if self._used_bytes > self.quota_bytes:
+            logger.warning(f"Storage usage {self._used_bytes} bytes still exceeds quota {self.quota_bytes} bytes")
+        return evicted
+
+    def enforce_kind_quota(self, kind: str, protect: Optional[str] = None) -> int:
+        """
+        Evict least recently used artifacts of ``kind`` until they fit within its own quota
+        """
+        quota = self.kind_quota_bytes.get(kind, 0)
+        if quota <= 0:
+            return 0
+        evicted = 0
+        with self._lock:
+            used = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE kind = ?", (kind,)
+            ).fetchone()[0]
+            if used <= quota:
+                return 0
+            rows = self._conn.execute(
+                "SELECT key, path, size FROM artifacts WHERE kind = ? ORDER BY last_access ASC", (kind,)
+            ).fetchall()
+            for key, path, size in rows:
+                if used <= quota:
+                    break
+                if key == protect:
+                    continue
+                self._delete_locked(key, path, size)
+                used -= size
+                evicted += 1
+            self._conn.commit()
+        if evicted:
+            logger.info(f"Evicted {evicted} {kind} artifacts to enforce the {kind} quota")
+        return evicted
+
+    def sweep(self) -> int:
+        evicted = self.evict_expired()
+        for kind in self.kind_quota_bytes:
+            evicted += self.enforce_kind_quota(kind)
+        return evicted + self.enforce_quota()
+
+    async def _run_sweeper(self, interval: float) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"Error sweeping storage: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def start_sweeper(self, interval: Optional[float] = None) -> None:
+        """
+        Start the background TTL/quota sweeper on the running event loop
+        """
+        if self._sweeper is None or self._sweeper.done():
+            interval = interval or settings.STORAGE_SWEEP_INTERVAL_SECONDS
+            self._sweeper = asyncio.get_running_loop().create_task(self._run_sweeper(interval))
+            logger.info(f"Storage sweeper started (interval={interval}s)")
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+
+_storage_manager: Optional[StorageManager] = None
+
+
+def get_storage_manager() -> StorageManager:
+    """
+    Return the process-wide storage manager, creating it on first use
+    """
+    global _storage_manager
+    if _storage_manager is None:
+        _storage_manager = StorageManager.from_settings()
+    return _storage_manager
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.services.storage_service import StorageManager, get_storage_manager
+
+logger = logging.getLogger(__name__)
+
+try:
+    # ISA-L's gzip is a drop-in replacement that decompresses several times faster than zlib
+    from isal import igzip as gzip
+    ISAL_AVAILABLE = True
+except ImportError:
+    import gzip
+    ISAL_AVAILABLE = False
+
+COMPRESSED_SUFFIX = ".nii.gz"
+
+
+class VolumeCache:
+    """
+    Cache of decompressed ``.nii.gz`` volumes.
+
+    Each compressed volume is decompressed once, in a single streaming pass,
+    into a plain ``.nii`` stored as a ``volume`` artifact keyed by the content
+    hash of the compressed file. Later readers (classification, slice
+    previews, meshing) open that file, which nibabel and numpy can memory-map,
+    instead of re-running zlib from the start of the stream. Eviction is
+    handled by the storage manager's ``volume`` quota and TTL.
+
+    Callers that know the upload's sha256 (recorded at upload time) pass it
+    in; otherwise the file is hashed once and the hash is memoized in a
+    bounded LRU keyed by path, size and mtime.
+    """
+
+    def __init__(self, storage: StorageManager, chunk_size: int = 4 * 1024 * 1024, max_hashes: int = 1024):
+        self.storage = storage
+        self.chunk_size = chunk_size
+        self.max_hashes = max_hashes
+        self._hashes: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+        # Per-key decompression locks with a count of the threads using them, dropped when unused
+        self._locks: Dict[str, List] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(content_hash: str) -> str:
+        return f"volume-{content_hash}"
+
+    def _content_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            content_hash = self._hashes.get(memo_key)
+            if content_hash is not None:
+                self._hashes.move_to_end(memo_key)
+                return content_hash
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                hasher.update(chunk)
+        content_hash = hasher.hexdigest()
+        with self._lock:
+            self._hashes[memo_key] = content_hash
+            while len(self._hashes) > self.max_hashes:
+                self._hashes.popitem(last=False)
+        return content_hash
+
+    def resolve(self, path: str, content_hash: Optional[str] = None) -> str:
+        """
+        Return a path to read the volume from: the decompressed copy for
+        ``.nii.gz`` files (created on first use), the original path otherwise
+        """
+        if not str(path).lower().endswith(COMPRESSED_SUFFIX):
+            return str(path)
+        content_hash = content_hash or self._content_hash(path)
+        key = self.key_for(content_hash)
+        record = self.storage.get(key)
+        if record is not None:
+            return record.path
+
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        # One decompression per volume, even with concurrent readers
+        try:
+            with entry[0]:
+                record = self.storage.get(key)
+                if record is None:
+                    record = self._decompress(path, key, content_hash)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+        return record.path
+
+    def _decompress(self, path: str, key: str, content_hash: str):
+        target = self.storage.path_for(key, "volume", ".nii")
+        tmp_path = target.with_name(target.name + ".part")
+        try:
+            with gzip.open(path, "rb") as source, open(tmp_path, "wb") as buffer:
+                while True:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    buffer.write(chunk)
+            os.replace(tmp_path, target)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        record = self.storage.register(key, "volume", str(target), content_hash=content_hash)
+        logger.info(f"Decompressed {os.path.basename(path)} into the volume cache ({record.size} bytes)")
+        return record
+
+
+_volume_cache: Optional[VolumeCache] = None
+
+
+def get_volume_cache() -> VolumeCache:
+    """
+    Return the process-wide volume cache, creating it on first use
+    """
+    global _volume_cache
+    if _volume_cache is None:
+        _volume_cache = VolumeCache(get_storage_manager())
+    return _volume_cache
@@ -1,61 +1,127 @@
 import os
-import shutil
+import hashlib
+from dataclasses import dataclass
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 from app.core.config import settings
 import nibabel as nib
 import pydicom
-from typing import Union
+from typing import BinaryIO, Optional, Union
 import logging
 from pathlib import Path
+from app.services.storage_service import get_storage_manager
+from app.services.volume_cache import get_volume_cache
 
 logger = logging.getLogger(__name__)
 
-async def save_upload_file(file: UploadFile) -> str:
+class UploadTooLargeError(Exception):
     """
-    Save an uploaded file to the uploads directory
+    Raised when an upload exceeds settings.MAX_UPLOAD_SIZE
     """
+    def __init__(self, max_size: int):
+        super().__init__(f"File exceeds maximum upload size of {max_size} bytes")
+        self.max_size = max_size
+
+@dataclass
+class SavedUpload:
+    scan_id: str
+    path: str
+    size: int
+    content_hash: str  # sha256 hex digest of the file contents
+
+def get_file_extension(filename: str) -> str:
+    """
+    Return the lower-cased extension of a file, keeping compound ones like .nii.gz
+    """
+    filename = filename.lower()
+    if filename.endswith('.nii.gz'):
+        return '.nii.gz'
+    return Path(filename).suffix
+
+def _write_chunk(buffer: BinaryIO, hasher, chunk: bytes) -> None:
+    hasher.update(chunk)
+    buffer.write(chunk)
+
+async def save_upload_file(
+    file: UploadFile,
+    scan_id: Optional[str] = None,
+    max_size: Optional[int] = None,
+    chunk_size: Optional[int] = None
+) -> SavedUpload:
+    """
+    Stream an uploaded file into the sharded upload store in fixed-size chunks.
+
+    Disk writes and hashing run in the threadpool so the event loop is never
+    blocked, the upload is aborted as soon as it passes ``max_size`` and a
+    sha256 content hash is computed during the same pass.
+    """
+    max_size = max_size or settings.MAX_UPLOAD_SIZE
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    if file.size is not None and file.size > max_size:
+        raise UploadTooLargeError(max_size)
+
+    storage = get_storage_manager()
+    
+    # Generate unique filename
+    scan_id = scan_id or os.urandom(8).hex()
+    file_ext = get_file_extension(file.filename)
+    file_path = str(storage.path_for(scan_id, "upload", file_ext))
+    tmp_path = f"{file_path}.part"
+    
+    hasher = hashlib.sha256()
+    size = 0
     try:
-        # Create uploads directory if it doesn't exist
-        upload_dir = Path(settings.UPLOAD_DIR)
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate unique filename
-        file_ext = Path(file.filename).suffix
-        unique_filename = f"{os.urandom(8).hex()}{file_ext}"
-        file_path = str(upload_dir / unique_filename)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        buffer = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLargeError(max_size)
+                await run_in_threadpool(_write_chunk, buffer, hasher, chunk)
+        finally:
+            await run_in_threadpool(buffer.close)
+        await run_in_threadpool(os.replace, tmp_path, file_path)
+        content_hash = hasher.hexdigest()
+        # Registering writes to SQLite and may evict old files to stay under quota
+        await run_in_threadpool(
+            storage.register, scan_id, "upload", file_path, scan_id=scan_id, content_hash=content_hash
+        )
         
-        logger.info(f"File saved successfully: {file_path}")
-        return file_path
+        logger.info(f"File saved successfully: {file_path} ({size} bytes, sha256={content_hash})")
+        return SavedUpload(scan_id=scan_id, path=file_path, size=size, content_hash=content_hash)
     except Exception as e:
+        Path(tmp_path).unlink(missing_ok=True)
         logger.error(f"Error saving file: {str(e)}")
         raise
 
-def load_medical_image(file_path: str) -> Union[nib.Nifti1Image, pydicom.FileDataset]:
+def load_medical_image(file_path: str, content_hash: Optional[str] = None) -> Union[nib.Nifti1Image, pydicom.FileDataset]:
     """
-    Load a medical image file (DICOM or NIfTI)
+    Load a medical image file (DICOM or NIfTI).
+    Gzipped NIfTI is read from its decompressed, memory-mappable copy in the volume cache;
+    pass the upload's sha256 as ``content_hash`` to skip re-hashing the file.
+    Blocking (hashing, decompression), so call it off the event loop.
     """
     try:
         file_path = str(Path(file_path))
         if file_path.lower().endswith('.dcm'):
             return pydicom.dcmread(file_path)
         elif file_path.lower().endswith(('.nii', '.nii.gz')):
-            return nib.load(file_path)
+            return nib.load(get_volume_cache().resolve(file_path, content_hash), mmap=True)
         else:
             raise ValueError("Unsupported file format")
     except Exception as e:
         logger.error(f"Error loading medical image: {str(e)}")
         raise
 
-def validate_medical_image(file_path: str) -> bool:
+def validate_medical_image(file_path: str, content_hash: Optional[str] = None) -> bool:
     """
     Validate that the file is a valid medical image
     """
     try:
-        load_medical_image(file_path)
+        load_medical_image(file_path, content_hash)
         return True
     except Exception as e:
         logger.error(f"Invalid medical image: {str(e)}")
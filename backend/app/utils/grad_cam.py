@@ -7,6 +7,7 @@ import io
 import base64
 import logging
 import traceback
+from app.ml_model.preprocessing import ImagePreprocessor
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -22,6 +23,7 @@ class GradCAM:
             layer_name: Name of the layer to use for GradCAM. If None, uses the last conv layer.
         """
         self.model = model
+        self.preprocessor = ImagePreprocessor()
         
         # If no layer specified, use the last conv layer
         if layer_name is None:
@@ -66,8 +68,7 @@ class GradCAM:
                 raise ValueError(f"Expected 3D input array, got shape {img_array.shape}")
             
             # Normalize image for model input
-            img_for_model = img_array.astype('float32') / 255.0
-            img_for_model = np.expand_dims(img_for_model, axis=0)
+            img_for_model = self.preprocessor.normalize(img_array)
             logger.info(f"Prepared image for model: shape={img_for_model.shape}, dtype={img_for_model.dtype}")
             
             with tf.GradientTape() as tape:
@@ -156,16 +157,16 @@ class GradCAM:
             logger.error(traceback.format_exc())
             raise
 
-    def generate_heatmap_image(self, img_array, pred_index=None):
+    def generate_heatmap_png(self, img_array, pred_index=None):
         """
-        Generate a complete heatmap visualization.
+        Generate a heatmap overlay encoded as PNG bytes.
         
         Args:
             img_array: Original image array
             pred_index: Index of the predicted class
             
         Returns:
-            Base64 encoded image with heatmap overlay
+            PNG encoded image with heatmap overlay
         """
         try:
             logger.info("Starting heatmap image generation")
@@ -180,19 +181,42 @@ class GradCAM:
             output_img = Image.fromarray(output)
             logger.info(f"Created PIL Image: size={output_img.size}, mode={output_img.mode}")
             
-            # Convert to base64
             buffered = io.BytesIO()
             output_img.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            logger.info("Successfully encoded image to base64")
+            return buffered.getvalue()
+            
+        except Exception as e:
+            logger.error(f"Error generating heatmap PNG: {str(e)}")
+            logger.error(traceback.format_exc())
+            raise
+
+    def generate_heatmap_image(self, img_array, pred_index=None):
+        """
+        Generate a complete heatmap visualization.
+        
+        Args:
+            img_array: Original image array
+            pred_index: Index of the predicted class
             
-            return f"data:image/png;base64,{img_str}"
+        Returns:
+            Base64 encoded image with heatmap overlay
+        """
+        try:
+            png_bytes = self.generate_heatmap_png(img_array, pred_index)
+            return png_to_data_url(png_bytes)
             
         except Exception as e:
             logger.error(f"Error generating heatmap image: {str(e)}")
             logger.error(traceback.format_exc())
             raise
 
+def png_to_data_url(png_bytes):
+    """
+    Encode PNG bytes as a base64 data URL.
+    """
+    img_str = base64.b64encode(png_bytes).decode()
+    return f"data:image/png;base64,{img_str}"
+
 def create_gradcam(model, layer_name=None):
     """
     Factory function to create a GradCAM instance.
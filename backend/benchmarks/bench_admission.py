@@ -0,0 +1,113 @@
+"""
+Load test for admission control: closed-loop batch clients saturate the
+inference slots while interactive requests arrive at a steady rate. Reports
+interactive latency percentiles with plain FIFO slots vs. the priority- and
+deadline-aware AdmissionController, plus how much GradCAM work is skipped
+for clients that disconnect mid-request or whose deadline has passed.
+
+Inference is simulated with sleeps in worker threads (like waiting on a model
+replica process), so the numbers measure queueing, not the model.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_admission --duration 20
+"""
+import argparse
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+
+import numpy as np
+
+from app.services.admission_service import AdmissionController, AdmissionRejected, RequestCancelled, Ticket
+
+
+class FakeRequest:
+    """Stands in for a Starlette request whose client may give up after a while"""
+
+    def __init__(self, give_up_after=None):
+        self.give_up_at = None if give_up_after is None else time.monotonic() + give_up_after
+
+    async def is_disconnected(self):
+        return self.give_up_at is not None and time.monotonic() >= self.give_up_at
+
+
+class FifoSlots:
+    """Baseline: a semaphore, first come first served, no shedding"""
+
+    def __init__(self, slots):
+        self._semaphore = asyncio.Semaphore(slots)
+
+    @asynccontextmanager
+    async def slot(self, ticket, kind):
+        async with self._semaphore:
+            yield ticket
+
+
+async def handle(slots, ticket, args, stats):
+    """One request: prediction, then GradCAM unless the client has gone or the deadline passed"""
+    start = time.monotonic()
+    try:
+        async with slots.slot(ticket, "results"):
+            await asyncio.to_thread(time.sleep, args.predict_ms / 1000)
+            if await ticket.should_run("GradCAM"):
+                await asyncio.to_thread(time.sleep, args.gradcam_ms / 1000)
+            else:
+                stats["gradcam_shed"] += 1
+        stats["latencies"].append(time.monotonic() - start)
+    except AdmissionRejected:
+        stats["shed"] += 1
+    except RequestCancelled:
+        stats["cancelled"] += 1
+
+
+async def batch_client(slots, args, stats, stop):
+    while time.monotonic() < stop:
+        await handle(slots, Ticket("batch"), args, stats)
+
+
+async def interactive_load(slots, args, stats, stop):
+    tasks = []
+    rng = random.Random(0)
+    while time.monotonic() < stop:
+        await asyncio.sleep(rng.expovariate(args.rate))
+        give_up = args.give_up_after if rng.random() < args.give_up_share else None
+        deadline = time.monotonic() + args.deadline_ms / 1000
+        ticket = Ticket("interactive", deadline, FakeRequest(give_up))
+        tasks.append(asyncio.create_task(handle(slots, ticket, args, stats)))
+    await asyncio.gather(*tasks)
+
+
+async def run(name, slots, args):
+    stop = time.monotonic() + args.duration
+    interactive = {"latencies": [], "shed": 0, "cancelled": 0, "gradcam_shed": 0}
+    batch = {"latencies": [], "shed": 0, "cancelled": 0, "gradcam_shed": 0}
+    await asyncio.gather(
+        interactive_load(slots, args, interactive, stop),
+        *(batch_client(slots, args, batch, stop) for _ in range(args.batch_clients)),
+    )
+    p50, p99 = np.percentile(interactive["latencies"], [50, 99]) * 1000
+    print(f"{name:10s} interactive p50 {p50:7.0f} ms, p99 {p99:7.0f} ms, "
+          f"completed {len(interactive['latencies'])}, shed/expired {interactive['shed']}, "
+          f"cancelled {interactive['cancelled']}, GradCAM shed {interactive['gradcam_shed']} | batch {len(batch['latencies']) / args.duration:.1f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--batch-clients", type=int, default=32, help="Closed-loop batch clients")
+    parser.add_argument("--rate", type=float, default=4.0, help="Interactive requests per second")
+    parser.add_argument("--deadline-ms", type=float, default=2000)
+    parser.add_argument("--predict-ms", type=float, default=80)
+    parser.add_argument("--gradcam-ms", type=float, default=150)
+    parser.add_argument("--give-up-share", type=float, default=0.1, help="Share of interactive clients that disconnect")
+    parser.add_argument("--give-up-after", type=float, default=0.05, help="Seconds before they disconnect")
+    args = parser.parse_args()
+
+    asyncio.run(run("fifo", FifoSlots(args.slots), args))
+    asyncio.run(run("admission", AdmissionController(args.slots, reserved_interactive=1), args))
+
+
+if __name__ == "__main__":
+    main()
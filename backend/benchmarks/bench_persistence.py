@@ -0,0 +1,69 @@
+"""
+Benchmark the background persistence writer with batching on and off.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_persistence --rows 5000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from app.services.db_service import PersistenceWriter, SQLiteBackend
+
+
+async def run(rows: int, batch_size: int, db_path: str) -> float:
+    backend = SQLiteBackend(db_path)
+    writer = PersistenceWriter(backend, batch_size=batch_size, flush_interval=0.05)
+    await writer.start()
+
+    start = time.perf_counter()
+    for i in range(rows):
+        scan_id = str(uuid.uuid4())
+        now = datetime.now()
+        writer.upsert("scans", {
+            "id": scan_id,
+            "file_name": f"scan_{i}.png",
+            "file_path": f"uploads/upload/{scan_id}.png",
+            "file_size": 1024,
+            "file_type": "image/png",
+            "public_url": "",
+            "status": "completed",
+            "created_at": now,
+            "updated_at": now,
+        })
+        writer.upsert("analysis_results", {
+            "scan_id": scan_id,
+            "predicted_class": "glioma",
+            "confidence_score": 0.9,
+            "processing_time": 0.1,
+            "results": {"prediction": {"predicted_class": "glioma", "confidence": 0.9}},
+            "created_at": now,
+        }, conflict_key="scan_id")
+        if i % 500 == 0:
+            # Let the writer run, as it would between requests
+            await asyncio.sleep(0)
+    await writer.stop()
+    elapsed = time.perf_counter() - start
+    backend.close()
+    return writer.rows_written / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000, help="Number of scans to persist")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 500])
+    args = parser.parse_args()
+
+    print(f"{'batch_size':>10}  {'rows/sec':>12}")
+    for batch_size in args.batch_sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            rate = asyncio.run(run(args.rows, batch_size, os.path.join(tmp, "bench.db")))
+        print(f"{batch_size:>10}  {rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark decode + preprocess time and allocations per image, comparing the
+previous ModelHandler preprocessing with ImagePreprocessor, and check that
+the two produce matching model inputs.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_preprocessing                  # synthetic 1024x1024 JPEGs
+    python -m benchmarks.bench_preprocessing --image-dir scans/ --check-parity
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from app.ml_model.preprocessing import ImagePreprocessor
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def legacy_preprocess(image_path, size=(224, 224)):
+    """The preprocessing ModelHandler used before ImagePreprocessor"""
+    img = Image.open(image_path)
+    img = img.resize(size)
+    img = img.convert('RGB')
+    img_array = np.array(img)
+    img_array = img_array / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+
+def make_synthetic_images(directory, count, size):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size] / size
+    paths = []
+    for i in range(count):
+        # Smooth structure plus noise compresses like a real scan, unlike pure noise
+        base = np.sin(x * rng.uniform(2, 12)) * np.cos(y * rng.uniform(2, 12))
+        img = ((base + 1) * 110 + rng.normal(0, 8, base.shape)).clip(0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"synthetic_{i}.jpg")
+        Image.fromarray(img, mode='L').convert('RGB').save(path, quality=92)
+        paths.append(path)
+    return paths
+
+
+def measure(fn, paths, repeats):
+    fn(paths[0])  # warm up
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for path in paths:
+            fn(path)
+    elapsed = time.perf_counter() - start
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n = repeats * len(paths)
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    return elapsed / n * 1000, allocations / n, peak / 1024
+
+
+def check_parity(paths, preprocessor, tolerance):
+    worst_mean = worst_max = 0.0
+    for path in paths:
+        expected = legacy_preprocess(path).astype(np.float32)
+        actual = preprocessor.preprocess(path)
+        diff = np.abs(expected - actual)
+        worst_mean = max(worst_mean, float(diff.mean()))
+        worst_max = max(worst_max, float(diff.max()))
+    ok = worst_mean <= tolerance
+    print(f"parity: worst mean abs diff {worst_mean:.5f}, worst max abs diff {worst_max:.5f} "
+          f"-> {'OK' if ok else 'FAIL'} (tolerance {tolerance})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-dir", help="Directory of images (default: generate synthetic JPEGs)")
+    parser.add_argument("--count", type=int, default=20, help="Synthetic images to generate")
+    parser.add_argument("--source-size", type=int, default=1024, help="Synthetic image side length")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--check-parity", action="store_true", help="Fail if outputs diverge from the legacy path")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Allowed mean abs difference in [0, 1] units")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.image_dir:
+            paths = sorted(
+                os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir)
+                if f.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            paths = make_synthetic_images(tmp, args.count, args.source_size)
+
+        exact = ImagePreprocessor(use_draft=False)
+        draft = ImagePreprocessor(use_draft=True)
+        candidates = [
+            ("legacy (float64)", legacy_preprocess),
+            ("engine, full decode", exact.preprocess),
+            ("engine, draft decode", draft.preprocess),
+            ("engine, uint8 only", draft.load),
+        ]
+        print(f"{len(paths)} images x {args.repeats} repeats")
+        print(f"{'path':<22} {'ms/image':>9} {'allocs/image':>13} {'peak KiB':>9}")
+        for name, fn in candidates:
+            ms, allocs, peak = measure(fn, paths, args.repeats)
+            print(f"{name:<22} {ms:>9.2f} {allocs:>13.1f} {peak:>9.0f}")
+
+        if args.check_parity:
+            print("full decode:", end=" ")
+            ok = check_parity(paths, exact, args.tolerance)
+            print("draft decode:", end=" ")
+            ok = check_parity(paths, draft, args.tolerance) and ok
+            if not ok:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Sweep model replica pool configurations and report throughput and tail latency.
+
+Each configuration is written as REPLICASxTHREADS, e.g. 1x32 is one replica
+with 32 intra-op threads and 8x4 is eight replicas with four threads each.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_replicas --model app/ml_model/best_model.keras \\
+        --configs 1x32 2x16 4x8 8x4 --requests 400 --concurrency 32 --pin
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from app.ml_model.replica_pool import ModelReplicaPool
+
+
+def run_config(model_path, image_path, replicas, threads, pin, requests, concurrency):
+    pool = ModelReplicaPool(model_path, replicas=replicas, threads_per_replica=threads, pin=pin)
+    try:
+        pool.warmup()
+        for _ in range(replicas * 2):
+            pool.predict(image_path)
+
+        def timed_request(_):
+            start = time.perf_counter()
+            pool.predict(image_path)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            latencies = np.array(list(clients.map(timed_request, range(requests))))
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    return requests / elapsed, p50, p95, p99
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="app/ml_model/best_model.keras")
+    parser.add_argument("--image", help="Image to classify (default: a synthetic 512x512 JPEG)")
+    parser.add_argument("--configs", nargs="+", default=["1x0", "2x0", "4x0"], help="REPLICASxTHREADS, 0 threads = TF default")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pin", action="store_true", help="Pin each replica to its own cores")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = args.image
+        if image_path is None:
+            image_path = os.path.join(tmp, "synthetic.jpg")
+            rng = np.random.default_rng(0)
+            Image.fromarray(rng.integers(0, 255, (512, 512, 3), dtype=np.uint8)).save(image_path)
+
+        print(f"{args.requests} requests, concurrency {args.concurrency}, pin={args.pin}")
+        print(f"{'config':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for config in args.configs:
+            replicas, threads = (int(v) for v in config.lower().split("x"))
+            rate, p50, p95, p99 = run_config(
+                args.model, image_path, replicas, threads, args.pin, args.requests, args.concurrency
+            )
+            print(f"{config:>8} {rate:>8.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark the sliding-window 3D segmentation engine on a synthetic volume.
+
+First a sanity check: a "network" that thresholds intensity runs through the
+full pipeline (patching, Gaussian blending, memmap accumulation, connected
+components) and must recover the centroids and volumes of the spheres
+planted in the phantom. Then the randomly initialized TinyUNet3D stand-in
+is timed for several overlap / batch-size / thread settings, with the peak
+resident memory compared to holding full-volume float32 logits.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_segmentation --shape 160 192 160 --patch 64
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+import torch
+from torch import nn
+
+from app.ml_model.segmentation import SlidingWindowSegmenter, TinyUNet3D
+
+SPHERES = [((40, 60, 50), 12), ((100, 120, 90), 8), ((70, 150, 120), 5)]
+
+
+class IntensityThreshold(nn.Module):
+    """Single-channel logits from z-scored intensity: foreground where the phantom's spheres are"""
+
+    def forward(self, x):
+        return 20 * (x - 1.5)
+
+
+def write_phantom(path, shape, spacing):
+    grid = np.ogrid[tuple(slice(0, s) for s in shape)]
+    data = np.zeros(shape, dtype=np.int16)
+    # Brain-like ellipsoid background with mild noise
+    r2 = sum(((g - s / 2) / (0.45 * s)) ** 2 for g, s in zip(grid, shape))
+    data[r2 < 1] = 400
+    data += np.random.default_rng(0).normal(0, 10, shape).astype(np.int16)
+    for centre, radius in SPHERES:
+        inside = sum((g - c) ** 2 for g, c in zip(grid, centre)) <= radius ** 2
+        data[inside] = 1000
+    nib.save(nib.Nifti1Image(data, np.diag([*spacing, 1.0])), path)
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def check_components(image, args):
+    segmenter = SlidingWindowSegmenter(IntensityThreshold(), patch_size=(args.patch,) * 3,
+                                       overlap=0.5, batch_size=args.batch_size)
+    result = segmenter.segment(image)
+    voxel_volume = np.prod(args.spacing)
+    print("sanity check (intensity-threshold network):")
+    for (centre, radius), anomaly in zip(SPHERES, result["anomalies"]):
+        grid = np.ogrid[tuple(slice(-radius, radius + 1) for _ in range(3))]
+        expected = int((sum(g ** 2 for g in grid) <= radius ** 2).sum())
+        print(f"  sphere at {centre}: centroid {anomaly['location']}, "
+              f"{anomaly['voxels']} voxels (expected {expected}), {anomaly['volume']:.0f} mm^3 "
+              f"(expected {expected * voxel_volume:.0f})")
+        assert anomaly["location"] == list(centre) and anomaly["voxels"] == expected
+    assert len(result["anomalies"]) == len(SPHERES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shape", type=int, nargs=3, default=[160, 192, 160])
+    parser.add_argument("--spacing", type=float, nargs=3, default=[1.0, 1.0, 1.2])
+    parser.add_argument("--patch", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--overlaps", type=float, nargs="+", default=[0.25, 0.5])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--threads", type=int, nargs="+", default=[0], help="torch intra-op threads, 0 = default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "phantom.nii")
+        write_phantom(path, tuple(args.shape), args.spacing)
+        image = nib.load(path, mmap=True)
+        voxels = int(np.prod(args.shape))
+        print(f"volume {tuple(args.shape)}: full float32 logits for 2 classes would be "
+              f"{voxels * 2 * 4 / 2**20:.0f} MiB; baseline RSS {peak_rss_mib():.0f} MiB")
+
+        check_components(image, args)
+
+        torch.manual_seed(0)
+        network = TinyUNet3D()
+        print(f"\n{'overlap':>8} {'batch':>6} {'threads':>8} {'patches':>8} {'seconds':>8} "
+              f"{'Mvox/s':>7} {'peak RSS MiB':>13}")
+        for threads in args.threads:
+            for overlap in args.overlaps:
+                for batch_size in args.batch_sizes:
+                    segmenter = SlidingWindowSegmenter(network, patch_size=(args.patch,) * 3, overlap=overlap,
+                                                       batch_size=batch_size, num_threads=threads,
+                                                       scratch_dir=tmp)
+                    start = time.perf_counter()
+                    result = segmenter.segment(image)
+                    elapsed = time.perf_counter() - start
+                    print(f"{overlap:>8.2f} {batch_size:>6d} {threads or torch.get_num_threads():>8d} "
+                          f"{int(result['metrics']['patches']):>8d} {elapsed:>8.2f} "
+                          f"{voxels / elapsed / 1e6:>7.2f} {peak_rss_mib():>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
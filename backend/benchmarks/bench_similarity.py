@@ -0,0 +1,75 @@
+"""
+Benchmark incremental adds and top-k query latency of the embedding index,
+and the recall of approximate (IVF) search against exact search.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_similarity --n 1000000 --dim 1280
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.similarity_service import EmbeddingIndex
+
+
+def clustered_vectors(rng, n, dim, centers):
+    # Embeddings of real scans cluster by anatomy and class rather than being uniform noise
+    labels = rng.integers(0, len(centers), n)
+    return centers[labels] + rng.normal(0, 0.35, (n, dim)).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=1000000, help="Number of stored embeddings")
+    parser.add_argument("--dim", type=int, default=1280, help="Embedding dimension")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=50000, help="Vectors appended per add_batch call")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(0, 1, (200, args.dim)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = EmbeddingIndex(tmp, exact_threshold=args.n + 1, nlist=args.nlist, nprobe=args.nprobe)
+        start = time.perf_counter()
+        for offset in range(0, args.n, args.batch):
+            size = min(args.batch, args.n - offset)
+            index.add_batch([f"scan-{offset + i}" for i in range(size)], clustered_vectors(rng, size, args.dim, centers))
+        print(f"added {args.n} x {args.dim} embeddings in {time.perf_counter() - start:.1f}s")
+
+        queries = clustered_vectors(rng, args.queries, args.dim, centers)
+        exact = []
+        start = time.perf_counter()
+        for query in queries[:20]:
+            exact.append({scan_id for scan_id, _ in index.search(query, args.k)})
+        print(f"exact search:  {(time.perf_counter() - start) / 20 * 1000:8.2f} ms/query")
+
+        start = time.perf_counter()
+        index.train()
+        print(f"trained IVF quantizer in {time.perf_counter() - start:.1f}s")
+
+        latencies, hits = [], 0
+        for i, query in enumerate(queries):
+            start = time.perf_counter()
+            found = index.search(query, args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if i < len(exact):
+                hits += len(exact[i] & {scan_id for scan_id, _ in found})
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"ivf search:    {p50:8.2f} ms/query p50, {p99:.2f} ms p99 "
+              f"(nlist={len(index.centroids)}, nprobe={args.nprobe})")
+        print(f"recall@{args.k} vs exact: {hits / (len(exact) * args.k):.3f}")
+
+        start = time.perf_counter()
+        for i in range(1000):
+            index.add(f"new-{i}", clustered_vectors(rng, 1, args.dim, centers)[0])
+        print(f"incremental add after training: {(time.perf_counter() - start):.3f} ms/vector")
+
+
+if __name__ == "__main__":
+    main()
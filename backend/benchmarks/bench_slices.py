@@ -0,0 +1,81 @@
+"""
+Benchmark slice preview latency while scrolling through a synthetic volume:
+loading the whole volume per request vs. memory-mapped single-slice reads,
+with and without the rendered-slice cache and neighbour prefetch.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_slices --shape 512 512 512
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from app.services.slice_service import SliceRequest, SliceService, apply_window, encode_slice
+
+
+def write_volume(path, shape):
+    # Head-like phantom: a textured ellipsoid with mild noise, so encoded sizes are realistic
+    rng = np.random.default_rng(0)
+    x, y = np.meshgrid(np.linspace(-1, 1, shape[0]), np.linspace(-1, 1, shape[1]), indexing="ij")
+    data = np.empty(shape, dtype=np.int16)
+    # Filled slab by slab so the generator never holds a float64 copy of the volume
+    for z in range(shape[2]):
+        r2 = x ** 2 + y ** 2 + np.linspace(-1, 1, shape[2])[z] ** 2
+        slab = np.where(r2 < 0.8, 700 + 250 * np.cos(12 * r2), 0) + rng.normal(0, 15, shape[:2])
+        data[:, :, z] = slab.astype(np.int16)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+
+
+def scroll(render, count, steps, pause):
+    latencies = []
+    for index in range(count // 2 - steps // 2, count // 2 + steps // 2):
+        start = time.perf_counter()
+        render(index)
+        latencies.append((time.perf_counter() - start) * 1000)
+        # Users pause between scroll events; this is when prefetch gets ahead
+        time.sleep(pause)
+    return np.percentile(latencies, [50, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shape", type=int, nargs=3, default=[512, 512, 512])
+    parser.add_argument("--steps", type=int, default=60, help="Consecutive slices scrolled through")
+    parser.add_argument("--pause", type=float, default=0.01, help="Seconds between scroll events")
+    parser.add_argument("--format", default="png", choices=["png", "webp"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "volume.nii")
+        write_volume(path, tuple(args.shape))
+        count = args.shape[2]
+        print(f"volume {tuple(args.shape)} int16, {os.path.getsize(path) / 2**20:.0f} MiB")
+
+        def full_load(index):
+            data = np.asarray(nib.load(path).get_fdata(dtype=np.float32))
+            encode_slice(apply_window(data[:, :, index].T[::-1], 1200, 600), args.format)
+
+        p50, p99 = scroll(full_load, count, min(args.steps, 10), 0)
+        print(f"full volume load per request: {p50:8.2f} ms p50, {p99:8.2f} ms p99")
+
+        for label, prefetch in (("mmap slice, no prefetch", 0), ("mmap slice + prefetch", 2)):
+            service = SliceService(prefetch=prefetch)
+            request = lambda index: service.render(SliceRequest(path, "axial", index, 1200, 600, args.format))
+            p50, p99 = scroll(request, count, args.steps, args.pause)
+            print(f"{label:30s} {p50:8.2f} ms p50, {p99:8.2f} ms p99  {service.stats()}")
+            service.shutdown()
+
+        service = SliceService(prefetch=0)
+        for plane in ("coronal", "sagittal"):
+            request = lambda index: service.render(SliceRequest(path, plane, index, 1200, 600, args.format))
+            p50, p99 = scroll(request, args.shape[1 if plane == "coronal" else 0], 10, 0)
+            print(f"mmap {plane:9s} slice (cold):  {p50:8.2f} ms p50, {p99:8.2f} ms p99")
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
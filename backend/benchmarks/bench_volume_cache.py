@@ -0,0 +1,83 @@
+"""
+Benchmark random axial slice access on a gzipped NIfTI volume: reading
+straight from the .nii.gz (every read decompresses from the start of the
+stream) vs. reading from the volume cache's decompressed, memory-mapped copy.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_volume_cache --shape 256 256 256
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+
+from app.services.slice_service import Volume
+from app.services.storage_service import StorageManager
+from app.services.volume_cache import ISAL_AVAILABLE, VolumeCache
+
+
+def write_volume(path, shape):
+    # Textured ellipsoid with mild noise: compresses roughly like a real head scan
+    rng = np.random.default_rng(0)
+    x, y = np.meshgrid(np.linspace(-1, 1, shape[0]), np.linspace(-1, 1, shape[1]), indexing="ij")
+    data = np.empty(shape, dtype=np.int16)
+    for z in range(shape[2]):
+        r2 = x ** 2 + y ** 2 + np.linspace(-1, 1, shape[2])[z] ** 2
+        slab = np.where(r2 < 0.8, 700 + 250 * np.cos(12 * r2), 0) + rng.normal(0, 15, shape[:2])
+        data[:, :, z] = slab.astype(np.int16)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+
+
+def time_reads(read, indices):
+    latencies = []
+    for index in indices:
+        start = time.perf_counter()
+        read(index)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, [50, 99])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shape", type=int, nargs=3, default=[256, 256, 256])
+    parser.add_argument("--reads", type=int, default=50, help="Random slices read per method")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "volume.nii.gz")
+        write_volume(path, tuple(args.shape))
+        raw_bytes = np.prod(args.shape) * 2
+        print(f"volume {tuple(args.shape)} int16: {raw_bytes / 2**20:.0f} MiB raw, "
+              f"{os.path.getsize(path) / 2**20:.0f} MiB gzipped (isal={ISAL_AVAILABLE})")
+        indices = np.random.default_rng(1).integers(0, args.shape[2], args.reads)
+
+        image = nib.load(path)
+        p50, p99 = time_reads(lambda z: np.asarray(image.dataobj[:, :, z]), indices)
+        print(f"random slice from .nii.gz:       {p50:8.2f} ms p50, {p99:8.2f} ms p99")
+
+        start = time.perf_counter()
+        np.asarray(nib.load(path).dataobj)
+        print(f"full decompress via nibabel:     {(time.perf_counter() - start) * 1000:8.0f} ms")
+
+        storage = StorageManager(os.path.join(tmp, "store"), os.path.join(tmp, "index.db"),
+                                 quota_bytes=0, ttl_seconds={}, kind_quota_bytes={"volume": 4 * raw_bytes})
+        cache = VolumeCache(storage)
+        start = time.perf_counter()
+        cached_path = cache.resolve(path)
+        print(f"one-time streaming decompress:   {(time.perf_counter() - start) * 1000:8.0f} ms")
+        start = time.perf_counter()
+        cache.resolve(path)
+        print(f"cache hit (hash memo + lookup):  {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+        volume = Volume(cached_path)
+        p50, p99 = time_reads(lambda z: volume.read_slice("axial", int(z)), indices)
+        print(f"random slice from cached .nii:   {p50:8.2f} ms p50, {p99:8.2f} ms p99")
+        p50, p99 = time_reads(lambda z: volume.read_slice("sagittal", int(z)), indices)
+        print(f"random sagittal from cache:      {p50:8.2f} ms p50, {p99:8.2f} ms p99")
+
+
+if __name__ == "__main__":
+    main()
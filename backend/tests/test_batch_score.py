@@ -0,0 +1,79 @@
+import os
+
+import pandas as pd
+import pytest
+
+from app.ml_model.batch_score import ResultWriter
+
+
+def rows(start, count, model_version="v1"):
+    return [
+        {"path": f"img_{i}.png", "model_version": model_version, "predicted_class": "glioma",
+         "confidence": 0.9, "error": None}
+        for i in range(start, start + count)
+    ]
+
+
+def test_csv_resume_truncates_unfinished_chunk(tmp_path):
+    output = str(tmp_path / "scores.csv")
+    writer = ResultWriter(output, run_key="key")
+    assert writer.resume() == 0
+    writer.add(rows(0, 3))
+    writer.flush()
+
+    # A chunk written just before a crash, with the checkpoint never advanced past it
+    pd.DataFrame(rows(3, 2, model_version="crashed")).to_csv(output, mode="a", header=False, index=False)
+
+    resumed = ResultWriter(output, run_key="key")
+    assert resumed.resume() == 3
+    resumed.add(rows(3, 2))
+    resumed.flush()
+
+    frame = pd.read_csv(output)
+    assert frame["path"].tolist() == [f"img_{i}.png" for i in range(5)]
+    assert set(frame["model_version"]) == {"v1"}
+
+
+def test_parquet_resume_replaces_unfinished_part(tmp_path):
+    pytest.importorskip("pyarrow")
+    output = str(tmp_path / "scores.parquet")
+    writer = ResultWriter(output, run_key="key")
+    writer.resume()
+    writer.add(rows(0, 3))
+    writer.flush()
+    pd.DataFrame(rows(3, 2, model_version="crashed")).to_parquet(
+        os.path.join(output, f"part-{3:012d}.parquet"), index=False
+    )
+
+    resumed = ResultWriter(output, run_key="key")
+    assert resumed.resume() == 3
+    resumed.add(rows(3, 2))
+    resumed.flush()
+
+    frame = pd.read_parquet(output).sort_values("path")
+    assert frame["path"].tolist() == [f"img_{i}.png" for i in range(5)]
+    assert set(frame["model_version"]) == {"v1"}
+
+
+def test_resume_refuses_checkpoint_of_another_run(tmp_path):
+    output = str(tmp_path / "scores.csv")
+    writer = ResultWriter(output, run_key="key")
+    writer.resume()
+    writer.add(rows(0, 2))
+    writer.flush()
+
+    with pytest.raises(SystemExit):
+        ResultWriter(output, run_key="other").resume()
+    assert len(pd.read_csv(output)) == 2
+
+
+def test_existing_output_without_checkpoint_needs_overwrite(tmp_path):
+    output = tmp_path / "scores.csv"
+    output.write_text("path\nkeep.png\n")
+
+    with pytest.raises(SystemExit):
+        ResultWriter(str(output), run_key="key").resume()
+    assert output.read_text() == "path\nkeep.png\n"
+
+    assert ResultWriter(str(output), run_key="key", overwrite=True).resume() == 0
+    assert not output.exists()
@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime
+
+from app.services.db_service import PersistenceWriter, SQLiteBackend
+from app.services.history_service import ScanHistoryStore
+
+
+def test_result_recorded_in_same_batch_as_upload(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "neuronav.db"), pool_size=1)
+    writer = PersistenceWriter(backend, flush_interval=0.05, max_retries=0)
+    store = ScanHistoryStore(backend, writer)
+
+    async def run():
+        await writer.start()
+        store.record_upload("old", "old.png", "image/png", "uploaded", datetime.now())
+        await writer.flush()
+
+        # Another scan's update is queued ahead of the new scan's upload and result
+        store.record_status("old", "processing")
+        store.record_upload("new", "new.png", "image/png", "uploaded", datetime.now())
+        store.record_status("new", "processing")
+        store.record_result("new", {"prediction": {"predicted_class": "glioma", "confidence": 0.9}})
+        await writer.stop()
+
+    asyncio.run(run())
+
+    scan = store.get_scan("new")
+    assert scan["status"] == "completed"
+    assert scan["predicted_class"] == "glioma"
+    assert store.get_scan("old")["status"] == "processing"
+
+
+def test_confidence_filter_pages_through_bounded_windows(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "neuronav.db"), pool_size=1)
+    store = ScanHistoryStore(backend, PersistenceWriter(backend), scan_limit=10)
+    rows = [
+        (f"scan-{i:03d}", "completed", f"{i}.png", "image/png", "glioma", 0.95 if i % 7 == 0 else 0.4,
+         1.0, None, 1000.0 + i, 1000.0 + i)
+        for i in range(100)
+    ]
+    with backend.connection() as conn:
+        conn.executemany("INSERT INTO scan_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+
+    found, cursor, pages = [], None, 0
+    while True:
+        items, cursor = store.list_scans(3, cursor=cursor, min_confidence=0.9)
+        found += [item["scan_id"] for item in items]
+        pages += 1
+        if cursor is None:
+            break
+
+    # Each page examines at most 10 rows, so some pages come back short or empty
+    assert found == [f"scan-{i:03d}" for i in range(99, -1, -1) if i % 7 == 0]
+    assert pages >= 10
@@ -0,0 +1,70 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+from app.services.db_service import PersistenceWriter, SQLiteBackend
+
+
+def scan_row(scan_id):
+    now = datetime.now()
+    return {
+        "id": scan_id,
+        "file_name": f"{scan_id}.png",
+        "file_path": f"uploads/{scan_id}.png",
+        "file_size": 10,
+        "file_type": "image/png",
+        "public_url": f"/uploads/{scan_id}.png",
+        "status": "uploaded",
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def result_row(scan_id):
+    return {
+        "scan_id": scan_id,
+        "predicted_class": "glioma",
+        "confidence_score": 0.9,
+        "processing_time": 0.1,
+        "results": {"prediction": {"predicted_class": "glioma"}},
+        "created_at": datetime.now(),
+    }
+
+
+def status_row(scan_id, status):
+    return {"id": scan_id, "status": status, "updated_at": datetime.now()}
+
+
+def test_mixed_batch_keeps_submission_order_and_isolates_bad_rows(tmp_path):
+    db_path = str(tmp_path / "neuronav.db")
+    writer = PersistenceWriter(SQLiteBackend(db_path, pool_size=1), flush_interval=0.05, max_retries=1)
+
+    async def run():
+        await writer.start()
+        writer.upsert("scans", scan_row("a"))
+        await writer.flush()
+
+        # One batch: scan a's result, then scan b's upload, result and status
+        # updates. The results of a and b share a shape but are not adjacent,
+        # so b's result must not run before b's scan row exists.
+        writer.update("scans", status_row("a", "processing"))
+        writer.upsert("analysis_results", result_row("a"), conflict_key="scan_id")
+        writer.upsert("scans", scan_row("b"))
+        writer.update("scans", status_row("b", "processing"))
+        writer.upsert("analysis_results", result_row("missing"), conflict_key="scan_id")
+        writer.upsert("analysis_results", result_row("b"), conflict_key="scan_id")
+        writer.update("scans", status_row("a", "completed"))
+        writer.update("scans", status_row("b", "completed"))
+        await writer.stop()
+
+    asyncio.run(run())
+
+    conn = sqlite3.connect(db_path)
+    statuses = dict(conn.execute("SELECT id, status FROM scans").fetchall())
+    results = {row[0] for row in conn.execute("SELECT scan_id FROM analysis_results")}
+    conn.close()
+    assert statuses == {"a": "completed", "b": "completed"}
+    # The result for an unknown scan violates the foreign key; only it is dropped
+    assert results == {"a", "b"}
+    assert writer.rows_dropped == 1
+    assert writer.rows_written == 8
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.ml_model.preprocessing import ImagePreprocessor
+from benchmarks.bench_preprocessing import legacy_preprocess, make_synthetic_images
+
+
+@pytest.fixture(scope="module")
+def images(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("images")
+    paths = make_synthetic_images(str(directory), count=4, size=1024)
+    # Grayscale PNG and an image already at the model's input size
+    rng = np.random.default_rng(1)
+    png = directory / "grayscale.png"
+    Image.fromarray(rng.integers(0, 256, (300, 400), dtype=np.uint8), mode="L").save(png)
+    small = directory / "small.jpg"
+    Image.fromarray(rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)).save(small, quality=92)
+    return paths + [str(png), str(small)]
+
+
+def test_full_decode_matches_legacy_exactly(images):
+    preprocessor = ImagePreprocessor(use_draft=False)
+    for path in images:
+        expected = legacy_preprocess(path).astype(np.float32)
+        actual = preprocessor.preprocess(path)
+        assert actual.dtype == np.float32
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_draft_decode_stays_within_tolerance(images):
+    preprocessor = ImagePreprocessor(use_draft=True)
+    for path in images:
+        expected = legacy_preprocess(path).astype(np.float32)
+        actual = preprocessor.preprocess(path)
+        assert actual.shape == expected.shape
+        assert float(np.abs(actual - expected).mean()) <= 0.01
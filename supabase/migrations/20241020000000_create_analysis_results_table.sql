@@ -0,0 +1,30 @@
+-- Analysis results written by the backend persistence writer.
+-- One row per scan so the writer can upsert on scan_id.
+CREATE TABLE IF NOT EXISTS analysis_results (
+    scan_id UUID PRIMARY KEY REFERENCES scans(id) ON DELETE CASCADE,
+    predicted_class TEXT,
+    confidence_score DOUBLE PRECISION,
+    processing_time DOUBLE PRECISION,
+    results JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL
+);
+
+ALTER TABLE analysis_results ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow public insert" ON analysis_results;
+CREATE POLICY "Allow public insert" ON analysis_results
+    FOR INSERT
+    TO public
+    WITH CHECK (true);
+
+DROP POLICY IF EXISTS "Allow public update" ON analysis_results;
+CREATE POLICY "Allow public update" ON analysis_results
+    FOR UPDATE
+    TO public
+    USING (true);
+
+DROP POLICY IF EXISTS "Allow public update" ON scans;
+CREATE POLICY "Allow public update" ON scans
+    FOR UPDATE
+    TO public
+    USING (true);